@@ -125,7 +125,7 @@ class FileVersion {
     return FileVersion(
       id: json['id'] as int,
       versionNumber: json['version_number'] as int,
-      fileUrl: json['file'] as String,
+      fileUrl: (json['download_url'] ?? json['file']) as String,
       note: json['note'] as String?,
       createdAt: DateTime.parse(json['created_at'] as String),
     );
@@ -80,16 +80,27 @@ class ApiService {
     };
   }
 
+  // List endpoints are cursor-paginated ({next, previous, results}); follow `next` to collect every page.
+  Future<List<dynamic>> _getAllPages(Uri url) async {
+    final headers = await _getHeaders();
+    final List<dynamic> results = [];
+    Uri? next = url;
+    while (next != null) {
+      final res = await http.get(next, headers: headers);
+      if (res.statusCode != 200) break;
+      final data = jsonDecode(res.body);
+      results.addAll(data['results'] as List<dynamic>);
+      next = data['next'] != null ? Uri.parse(data['next'] as String) : null;
+    }
+    return results;
+  }
+
   // Client endpoints
   Future<List<Client>> getClients() async {
     final url = Uri.parse('$baseUrl/api/clients/');
     try {
-      final headers = await _getHeaders();
-      final res = await http.get(url, headers: headers);
-      if (res.statusCode == 200) {
-        final List<dynamic> data = jsonDecode(res.body);
-        return data.map((c) => Client.fromJson(c as Map<String, dynamic>)).toList();
-      }
+      final data = await _getAllPages(url);
+      return data.map((c) => Client.fromJson(c as Map<String, dynamic>)).toList();
     } catch (_) {}
     return [];
   }
@@ -110,12 +121,8 @@ class ApiService {
   Future<List<Project>> getProjects() async {
     final url = Uri.parse('$baseUrl/api/projects/');
     try {
-      final headers = await _getHeaders();
-      final res = await http.get(url, headers: headers);
-      if (res.statusCode == 200) {
-        final List<dynamic> data = jsonDecode(res.body);
-        return data.map((p) => Project.fromJson(p as Map<String, dynamic>)).toList();
-      }
+      final data = await _getAllPages(url);
+      return data.map((p) => Project.fromJson(p as Map<String, dynamic>)).toList();
     } catch (_) {}
     return [];
   }
@@ -134,14 +141,11 @@ class ApiService {
 
   // Media endpoints
   Future<List<MediaFile>> getMedia() async {
-    final url = Uri.parse('$baseUrl/api/media/');
+    // lightweight list shape: nested versions/share_links/duplicates are fetched per file on demand
+    final url = Uri.parse('$baseUrl/api/media/?expand=');
     try {
-      final headers = await _getHeaders();
-      final res = await http.get(url, headers: headers);
-      if (res.statusCode == 200) {
-        final List<dynamic> data = jsonDecode(res.body);
-        return data.map((m) => MediaFile.fromJson(m as Map<String, dynamic>)).toList();
-      }
+      final data = await _getAllPages(url);
+      return data.map((m) => MediaFile.fromJson(m as Map<String, dynamic>)).toList();
     } catch (_) {}
     return [];
   }
@@ -201,6 +205,27 @@ class ApiService {
     return null;
   }
 
+  // Bulk media endpoints: one request and one transaction for many files.
+  // Returns the per-file results ({id, result: ok|skipped|not_found, detail?}), or null on failure.
+  Future<List<dynamic>?> bulkMediaAction(String action, List<int> ids, [Map<String, dynamic> params = const {}]) async {
+    final url = Uri.parse('$baseUrl/api/media/bulk_$action/');
+    try {
+      final headers = await _getHeaders();
+      final res = await http.post(url, headers: headers, body: jsonEncode({'ids': ids, ...params}));
+      if (res.statusCode == 200) {
+        return jsonDecode(res.body)['results'];
+      }
+    } catch (_) {}
+    return null;
+  }
+
+  Future<List<dynamic>?> softDeleteMediaBulk(List<int> ids) => bulkMediaAction('delete', ids);
+
+  Future<List<dynamic>?> restoreMediaBulk(List<int> ids) => bulkMediaAction('restore', ids);
+
+  Future<List<dynamic>?> setMediaStatusBulk(List<int> ids, String status) =>
+      bulkMediaAction('status', ids, {'status': status});
+
   // Version endpoints
   Future<List<FileVersion>> getVersions(int mediaId) async {
     final url = Uri.parse('$baseUrl/api/media/$mediaId/versions/');
@@ -278,12 +303,8 @@ class ApiService {
   Future<List<DeletedFile>> getDeletedFiles() async {
     final url = Uri.parse('$baseUrl/api/deleted/');
     try {
-      final headers = await _getHeaders();
-      final res = await http.get(url, headers: headers);
-      if (res.statusCode == 200) {
-        final List<dynamic> data = jsonDecode(res.body);
-        return data.map((d) => DeletedFile.fromJson(d as Map<String, dynamic>)).toList();
-      }
+      final data = await _getAllPages(url);
+      return data.map((d) => DeletedFile.fromJson(d as Map<String, dynamic>)).toList();
     } catch (_) {}
     return [];
   }
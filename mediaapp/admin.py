@@ -1,20 +1,22 @@
 from django.contrib import admin
-from .models import Client, Project, MediaFile, DeletedFile, FileVersion, ShareLink
+from .models import (Client, Project, MediaFile, DeletedFile, FileVersion, ShareLink, ShareAccessBucket, Rendition,
+                     ImageTransform, StorageTierRule)
 
 
 @admin.register(Client)
 class ClientAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'owner', 'created_at')
+    list_display = ('id', 'name', 'owner', 'bytes_used', 'vault_bytes', 'quota_bytes', 'created_at')
 
 
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'client', 'created_at')
+    list_display = ('id', 'name', 'client', 'bytes_used', 'vault_bytes', 'quota_bytes', 'created_at')
 
 
 @admin.register(MediaFile)
 class MediaFileAdmin(admin.ModelAdmin):
-    list_display = ('id', 'project', 'file', 'media_type', 'status', 'is_deleted', 'file_hash', 'created_at')
+    list_display = ('id', 'project', 'file', 'media_type', 'size', 'status', 'storage_tier', 'is_deleted', 'file_hash',
+                    'created_at')
 
 
 @admin.register(DeletedFile)
@@ -24,9 +26,29 @@ class DeletedFileAdmin(admin.ModelAdmin):
 
 @admin.register(FileVersion)
 class FileVersionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'media', 'version_number', 'created_by', 'created_at')
+    list_display = ('id', 'media', 'version_number', 'size', 'created_by', 'created_at')
 
 
 @admin.register(ShareLink)
 class ShareLinkAdmin(admin.ModelAdmin):
     list_display = ('id', 'media', 'created_by', 'permission', 'expires_at', 'access_count', 'created_at')
+
+
+@admin.register(ShareAccessBucket)
+class ShareAccessBucketAdmin(admin.ModelAdmin):
+    list_display = ('id', 'link', 'bucket_start', 'count')
+
+
+@admin.register(Rendition)
+class RenditionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'media', 'version', 'size', 'width', 'height', 'bytes', 'last_accessed')
+
+
+@admin.register(ImageTransform)
+class ImageTransformAdmin(admin.ModelAdmin):
+    list_display = ('key', 'file', 'width', 'height', 'bytes', 'last_accessed')
+
+
+@admin.register(StorageTierRule)
+class StorageTierRuleAdmin(admin.ModelAdmin):
+    list_display = ('id', 'client', 'project', 'status', 'min_age_days', 'tier', 'created_at')
@@ -0,0 +1,105 @@
+"""Async versions of the transfer endpoints, for running under an ASGI server (uvicorn).
+
+Under WSGI every download or upload holds a worker thread for as long as the client takes,
+so a few slow phones can starve the API. Under ASGI the server reads request bodies before
+the view runs, and these views stream responses from the event loop, so a slow client costs
+a coroutine instead of a worker. Blocking work (storage reads and writes, hashing, the cache)
+runs in threads through sync_to_async; the ORM is used through its async methods.
+
+They mirror the DRF endpoints of the same name, under /api/async/, with the same (open)
+permissions. Sync views and the rest of the API keep working under either server.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlencode
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods
+
+from .caching import resolve_share, share_is_valid
+from .downloads import aserve_file
+from .models import FileVersion, MediaFile, ShareLink, UploadSession
+from .share_access import record_share_access
+from .tasks import rehydrate_on_access
+from .views import append_chunk
+
+
+async def aget_or_404(queryset, **lookup):
+    try:
+        return await queryset.aget(**lookup)
+    except (queryset.model.DoesNotExist, ValueError):
+        raise Http404
+
+
+async def resolve_valid_share(request):
+    """The cached share record for ``?token=``, or an error response."""
+    token = request.GET.get('token')
+    if not token:
+        return None, JsonResponse({'detail': 'token required'}, status=400)
+    share = await sync_to_async(resolve_share)(token)
+    if share is None:
+        raise Http404
+    if not share_is_valid(share):
+        return None, JsonResponse({'detail': 'link expired'}, status=403)
+    return share, None
+
+
+@require_GET
+async def media_download(request, pk):
+    """Stream a media file, or ``?version=<id>`` of it, with Range and conditional GET support."""
+    media = await aget_or_404(MediaFile.objects.filter(is_deleted=False), pk=pk)
+    as_attachment = 'attachment' in request.GET
+    if request.GET.get('version'):
+        version = await aget_or_404(FileVersion.objects.filter(media=media), pk=request.GET['version'])
+        response = await aserve_file(request, version.content, etag=version.file_hash or None,
+                                     last_modified=version.created_at, filename=version.display_name,
+                                     as_attachment=as_attachment)
+        await sync_to_async(rehydrate_on_access)(version)
+    else:
+        response = await aserve_file(request, media.file, etag=media.file_hash, last_modified=media.modified_at,
+                                     filename=media.display_name, as_attachment=as_attachment)
+        await sync_to_async(rehydrate_on_access)(media)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@require_GET
+async def share_public_access(request):
+    """Public endpoint: describe the file behind a share token and count the visit."""
+    share, error = await resolve_valid_share(request)
+    if error:
+        return error
+    await sync_to_async(record_share_access)(share['id'])
+    download_url = reverse('async_share_download') + '?' + urlencode({'token': share['token']})
+    return JsonResponse({
+        'file': request.build_absolute_uri(download_url),
+        'media_type': share['media__media_type'],
+        'permission': share['permission'],
+        'created_by': share['created_by__username'],
+    })
+
+
+@require_GET
+async def share_download(request):
+    """Public endpoint: stream the shared file with Range and conditional GET support."""
+    share, error = await resolve_valid_share(request)
+    if error:
+        return error
+    link = await aget_or_404(ShareLink.objects.select_related('media'), token=share['token'])
+    media = link.media
+    as_attachment = link.permission == 'download' and 'attachment' in request.GET
+    response = await aserve_file(request, media.file, etag=media.file_hash, last_modified=media.modified_at,
+                                 filename=media.display_name, as_attachment=as_attachment)
+    await sync_to_async(rehydrate_on_access)(media)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+async def upload_chunk(request, pk):
+    """Append one chunk to a resumable upload (see UploadSessionViewSet.update)."""
+    session = await aget_or_404(UploadSession.objects.all(), pk=pk)
+    code, data, headers = await sync_to_async(append_chunk)(session, request.headers, request)
+    return JsonResponse(data, status=code, headers=headers)
@@ -0,0 +1,246 @@
+"""Ingest many files at once, from a multipart upload or a zip/tar archive, into an UploadBatch.
+
+Each file is read once: the same pass sniffs its type from the leading bytes, hashes it and
+stores it. Rows are bulk-inserted UPLOAD_BATCH_INSERT_SIZE at a time, each group in its own short
+transaction, and handed to Celery as a group of process_batch_item tasks (renditions and
+perceptual hash) on commit.
+Files that would take the project or its client over its storage quota are skipped.
+"""
+import hashlib
+import itertools
+import os
+import tarfile
+import tempfile
+import zipfile
+
+from celery import group
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .caching import adjust_counts, bump_listing
+from .models import MediaFile, UploadBatch
+from .search import index_media
+from .tasks import process_batch_item
+from .usage import adjust_usage, remaining_quota
+
+SNIFF_BYTES = 18  # through a BMP's DIB header size
+COPY_BLOCK_SIZE = 1024 * 1024
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+# leading bytes of the image formats cameras, phones and editors produce
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'II*\x00', b'MM\x00*')
+# a BMP's "BM" is followed by its file size; bytes 14-18 give the size of the DIB header, one of
+# BITMAPCOREHEADER, BITMAPINFOHEADER, BITMAPV4HEADER or BITMAPV5HEADER
+BMP_DIB_HEADER_SIZES = {12, 40, 108, 124}
+# ISO base media files (ftyp box) that hold still images rather than video
+ISO_IMAGE_BRANDS = {b'heic', b'heix', b'heif', b'mif1', b'msf1', b'avif'}
+# QuickTime files written without an ftyp box start straight with one of these
+QUICKTIME_ATOMS = {b'moov', b'mdat', b'wide', b'free', b'skip'}
+
+# what reading a truncated or corrupt zip or tar raises
+ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipFile, EOFError)
+
+TAR_CONTENT_TYPES = {'application/x-tar', 'application/gzip', 'application/x-gzip', 'application/x-gtar',
+                     'application/x-bzip2', 'application/x-xz'}
+
+
+def sniff_media_type(head):
+    """'image' or 'video' judged from a file's first bytes, or None for anything else."""
+    if head.startswith(IMAGE_SIGNATURES) or is_bmp(head):
+        return 'image'
+    if head[:4] == b'RIFF':
+        return {b'WEBP': 'image', b'AVI ': 'video'}.get(head[8:12])
+    if head[4:8] == b'ftyp':  # MP4, MOV, 3GP, HEIC, AVIF
+        return 'image' if head[8:12] in ISO_IMAGE_BRANDS else 'video'
+    if head[:4] == b'\x1a\x45\xdf\xa3':  # Matroska, WebM
+        return 'video'
+    if head[4:8] in QUICKTIME_ATOMS:
+        return 'video'
+    return None
+
+
+def is_bmp(head):
+    """Whether ``head`` starts a BMP: "BM" alone also begins plenty of text and other files."""
+    if head[:2] != b'BM' or len(head) < 18:
+        return False
+    dib_size = int.from_bytes(head[14:18], 'little')
+    # the file holds at least the 14-byte file header and the DIB header
+    return dib_size in BMP_DIB_HEADER_SIZES and int.from_bytes(head[2:6], 'little') >= 14 + dib_size
+
+
+def is_junk(name):
+    """Directory entries and OS metadata (``__MACOSX/``, ``.DS_Store``, ``._*``) that archives carry along."""
+    parts = name.replace('\\', '/').split('/')
+    return '__MACOSX' in parts or os.path.basename(name).startswith('.')
+
+
+def iter_uploaded_files(files):
+    for upload in files:
+        yield upload.name, upload
+
+
+def iter_zip(fileobj):
+    # zip needs its central directory, at the end, so this reads the (spooled) upload, not a stream
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or is_junk(info.filename):
+                continue
+            with archive.open(info) as member:
+                yield info.filename, member
+
+
+def iter_tar(fileobj, stream=False):
+    """Members of a (possibly compressed) tar; ``stream`` reads it front to back without seeking."""
+    with tarfile.open(fileobj=fileobj, mode='r|*' if stream else 'r:*') as archive:
+        for info in archive:
+            if info.isfile() and not is_junk(info.name):
+                yield info.name, archive.extractfile(info)
+
+
+def iter_archive(upload):
+    if zipfile.is_zipfile(upload):
+        upload.seek(0)
+        return iter_zip(upload)
+    upload.seek(0)
+    return iter_tar(upload)
+
+
+def spool(head, fileobj):
+    """Copy a member to a spooled temporary file (disk only past SPOOL_MAX_MEMORY), hashing it on the way."""
+    hasher = hashlib.sha256(head)
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    spooled.write(head)
+    for block in iter(lambda: fileobj.read(COPY_BLOCK_SIZE), b''):
+        hasher.update(block)
+        spooled.write(block)
+    spooled.seek(0)
+    return spooled, hasher.hexdigest()
+
+
+def store_member(batch, name, fileobj, remaining=None):
+    """Store one file; returns (its unsaved MediaFile, None), or (None, error) if it is not an image or video.
+
+    ``remaining`` is the quota left in bytes (None for no quota); a larger file is not stored.
+    """
+    name = os.path.basename(name.replace('\\', '/'))
+    head = fileobj.read(SNIFF_BYTES)
+    media_type = sniff_media_type(head)
+    if media_type is None:
+        return None, {'name': name, 'detail': 'not an image or video'}
+
+    field = MediaFile._meta.get_field('file')
+    digest = getattr(fileobj, 'sha256', None)
+    if digest is not None or hasattr(fileobj, 'temporary_file_path'):
+        # an upload the hashing handlers already digested: store it as is (a temp file is moved)
+        fileobj.seek(0)
+        content, spooled = fileobj, None
+    else:
+        spooled, digest = spool(head, fileobj)
+        content = File(spooled, name)
+        content.sha256 = digest
+    size = content.size
+    if remaining is not None and size > remaining:
+        if spooled is not None:
+            spooled.close()
+        return None, {'name': name, 'detail': 'storage quota exceeded'}
+    try:
+        stored = field.storage.save(field.generate_filename(None, name), content, max_length=field.max_length)
+    finally:
+        if spooled is not None:
+            spooled.close()
+    return MediaFile(
+        project_id=batch.project_id,
+        uploaded_by_id=batch.created_by_id,
+        upload_batch=batch,
+        file=stored,
+        original_filename=name,
+        size=size,
+        media_type=media_type,
+        status=batch.media_status,
+        file_hash=digest,
+        hash_status='complete' if digest else 'pending',
+    ), None
+
+
+def save_group(batch, owner_id, rows, errors, skipped):
+    """Insert one group of stored files and record its errors, in a transaction of its own."""
+    with transaction.atomic():
+        MediaFile.objects.bulk_create(rows)
+        index_media([row.pk for row in rows])
+        adjust_usage({batch.project_id: (sum(row.size for row in rows), 0)})
+        if errors:
+            batch.errors = (batch.errors + errors)[:UploadBatch.MAX_ERRORS]
+            UploadBatch.objects.filter(pk=batch.pk).update(errors=batch.errors)
+        UploadBatch.objects.filter(pk=batch.pk).update(received=F('received') + len(rows),
+                                                       skipped=F('skipped') + skipped)
+        if rows:
+            adjust_counts(owner_id, media=len(rows))
+            bump_listing('media', 'projects')
+            media_ids = [row.pk for row in rows]
+            transaction.on_commit(lambda: group(
+                process_batch_item.si(str(batch.pk), media_id) for media_id in media_ids).apply_async())
+
+
+def ingest(batch, members):
+    """Store every (name, file object) of ``members`` into ``batch``; returns the batch, now processing.
+
+    Files are stored outside any transaction and inserted UPLOAD_BATCH_INSERT_SIZE at a time, each
+    group committed on its own. Members past UPLOAD_BATCH_MAX_FILES are not imported: they count
+    as ``skipped``, and the first of them is reported in ``batch.errors``. An unreadable archive (ARCHIVE_ERRORS) is re-raised once the files
+    read before it are saved; any other error marks the batch failed before it is re-raised.
+    """
+    owner_id = batch.project.client.owner_id
+    members = iter(members)
+    seen = 0
+    rows = []
+    try:
+        while True:
+            rows, errors, skipped, damaged = [], [], 0, None
+            remaining = remaining_quota(batch.project_id)
+            try:
+                for name, fileobj in itertools.islice(members, settings.UPLOAD_BATCH_INSERT_SIZE):
+                    seen += 1
+                    if seen > settings.UPLOAD_BATCH_MAX_FILES:
+                        errors.append({'name': name, 'detail': f'more than {settings.UPLOAD_BATCH_MAX_FILES} '
+                                                               'files; this and later files were not imported'})
+                        # counted as skipped, not read
+                        skipped += 1
+                        for _ in members:
+                            skipped += 1
+                        break
+                    row, error = store_member(batch, name, fileobj, remaining)
+                    if row is not None:
+                        rows.append(row)
+                        if remaining is not None:
+                            remaining -= row.size
+                    else:
+                        skipped += 1
+                        errors.append(error)
+            except ARCHIVE_ERRORS as exc:
+                # keep what was stored before the archive turned out to be damaged
+                damaged = exc
+            if not rows and not errors and damaged is None:
+                break
+            save_group(batch, owner_id, rows, errors, skipped)
+            rows = []
+            if damaged is not None:
+                raise damaged
+            if seen > settings.UPLOAD_BATCH_MAX_FILES:
+                break
+    except ARCHIVE_ERRORS:
+        raise
+    except Exception as exc:
+        # stored files whose rows were never inserted would keep their bytes (or blob references)
+        storage = MediaFile._meta.get_field('file').storage
+        for row in rows:
+            storage.delete(row.file.name)
+        batch.errors = (batch.errors + [{'name': '', 'detail': f'import failed: {exc}'}])[:UploadBatch.MAX_ERRORS]
+        batch.status = 'failed'
+        UploadBatch.objects.filter(pk=batch.pk).update(status='failed', errors=batch.errors,
+                                                       updated_at=timezone.now())
+        raise
+    batch.mark_received()
+    return batch
@@ -0,0 +1,145 @@
+"""Set-based versions of the per-file media operations, for the bulk API endpoints.
+
+Each operation locks its targets, applies one UPDATE (or bulk INSERT/DELETE) in a single
+transaction, adjusts the cached counters and storage totals the per-file signals would have, and returns one
+result per file: ``ok``, ``skipped`` (nothing to do) or ``not_found``. A move that would take the
+target project over quota raises usage.QuotaExceeded and changes nothing.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import search
+from .caching import adjust_counts, bump_listing
+from .models import DeletedFile, MediaFile, Project, ShareLink
+from .usage import check_quota, file_usage, tracking_usage
+
+# filters a bulk request may select files by, instead of listing ids
+FILTER_FIELDS = {
+    'project': 'project_id',
+    'client': 'project__client_id',
+    'status': 'status',
+    'media_type': 'media_type',
+}
+
+
+class TooManyTargets(Exception):
+    pass
+
+
+def select_targets(ids=None, filters=None, live=None, limit=None):
+    """Lock and return ``{id: row}`` for the selected files, in request (or id) order.
+
+    ``live`` restricts to non-deleted (True) or deleted (False) files. Call inside a transaction.
+    """
+    queryset = MediaFile.objects.select_for_update().order_by('id')
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    else:
+        queryset = queryset.filter(**{FILTER_FIELDS[name]: value for name, value in filters.items()})
+    if live is not None:
+        queryset = queryset.filter(is_deleted=not live)
+    rows = list(queryset.values('id', 'is_deleted', 'status', 'project_id', 'project__client__owner_id')[:limit + 1 if limit else None])
+    if limit and len(rows) > limit:
+        raise TooManyTargets(f'a bulk operation can select at most {limit} files')
+    return {row['id']: row for row in rows}
+
+
+def build_results(ids, targets, outcomes):
+    """One result per requested id (or per selected file when selected by filter)."""
+    results = []
+    for media_id in (ids if ids is not None else targets):
+        if media_id not in targets:
+            results.append({'id': media_id, 'result': 'not_found'})
+        else:
+            result, detail = outcomes.get(media_id, ('ok', None))
+            results.append({'id': media_id, 'result': result, **({'detail': detail} if detail else {})})
+    return results
+
+
+def count_by_owner(rows):
+    return Counter(row['project__client__owner_id'] for row in rows)
+
+
+def soft_delete(ids=None, filters=None, retention_days=60, limit=None):
+    with transaction.atomic():
+        targets = select_targets(ids, filters, limit=limit)
+        rows = [row for row in targets.values() if not row['is_deleted']]
+        now = timezone.now()
+        with tracking_usage(row['id'] for row in rows):
+            MediaFile.objects.filter(pk__in=[row['id'] for row in rows]).update(is_deleted=True, deleted_at=now)
+        DeletedFile.objects.bulk_create(
+            [DeletedFile(media_id=row['id'], deleted_at=now, expiry=now + timedelta(days=retention_days)) for row in rows],
+            batch_size=500, ignore_conflicts=True,
+        )
+        for owner_id, count in count_by_owner(rows).items():
+            adjust_counts(owner_id, media=-count, deleted=count)
+        if rows:
+            bump_listing('media', 'projects')
+    outcomes = {row['id']: ('skipped', 'already deleted') for row in targets.values() if row['is_deleted']}
+    return build_results(ids, targets, outcomes)
+
+
+def restore(ids=None, filters=None, limit=None):
+    with transaction.atomic():
+        targets = select_targets(ids, filters, limit=limit)
+        rows = [row for row in targets.values() if row['is_deleted']]
+        restored = [row['id'] for row in rows]
+        with tracking_usage(restored):
+            MediaFile.objects.filter(pk__in=restored).update(is_deleted=False, deleted_at=None)
+        vault = Counter(DeletedFile.objects.filter(media_id__in=restored)
+                        .values_list('media__project__client__owner_id', flat=True))
+        DeletedFile.objects.filter(media_id__in=restored).delete()
+        for owner_id, count in count_by_owner(rows).items():
+            adjust_counts(owner_id, media=count, deleted=-vault[owner_id])
+        if rows:
+            bump_listing('media', 'projects')
+    outcomes = {row['id']: ('skipped', 'not deleted') for row in targets.values() if not row['is_deleted']}
+    return build_results(ids, targets, outcomes)
+
+
+def set_status(status, ids=None, filters=None, limit=None):
+    with transaction.atomic():
+        targets = select_targets(ids, filters, live=True, limit=limit)
+        changed = [media_id for media_id, row in targets.items() if row['status'] != status]
+        MediaFile.objects.filter(pk__in=changed).update(status=status)
+        if changed:
+            bump_listing('media')
+    outcomes = {media_id: ('skipped', f'already {status}') for media_id, row in targets.items() if row['status'] == status}
+    return build_results(ids, targets, outcomes)
+
+
+def move_to_project(project, ids=None, filters=None, limit=None):
+    with transaction.atomic():
+        targets = select_targets(ids, filters, live=True, limit=limit)
+        rows = [row for row in targets.values() if row['project_id'] != project.pk]
+        # the files bring their versions' bytes along, as a single move does; the client only
+        # gains the bytes of files coming from another client's projects
+        usage = file_usage([row['id'] for row in rows])
+        foreign = Project.objects.filter(pk__in=usage).exclude(client_id=project.client_id).values_list('pk', flat=True)
+        check_quota(project.pk, sum(live for live, _ in usage.values()), sum(usage[pk][0] for pk in foreign))
+        with tracking_usage(row['id'] for row in rows):
+            MediaFile.objects.filter(pk__in=[row['id'] for row in rows]).update(project=project)
+        search.index_media([row['id'] for row in rows])
+        for owner_id, count in count_by_owner(rows).items():
+            adjust_counts(owner_id, media=-count)
+        if rows:
+            adjust_counts(project.client.owner_id, media=len(rows))
+            bump_listing('media', 'projects')
+    outcomes = {row['id']: ('skipped', 'already in project') for row in targets.values() if row['project_id'] == project.pk}
+    return build_results(ids, targets, outcomes)
+
+
+def create_shares(user, permission='view', expires_in_days=7, ids=None, filters=None, limit=None):
+    """Create one share link per file; returns (results, {media id: ShareLink})."""
+    expires_at = timezone.now() + timedelta(days=expires_in_days) if expires_in_days > 0 else None
+    with transaction.atomic():
+        targets = select_targets(ids, filters, live=True, limit=limit)
+        shares = ShareLink.objects.bulk_create(
+            [ShareLink(media_id=media_id, created_by=user, permission=permission, expires_at=expires_at)
+             for media_id in targets],
+            batch_size=500,
+        )
+    return build_results(ids, targets, {}), {share.media_id: share for share in shares}
@@ -0,0 +1,130 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from django.utils import timezone
+
+from .models import Client, DeletedFile, MediaFile, Project, ShareLink
+
+COUNTERS = ('clients', 'projects', 'media', 'deleted')
+GLOBAL_SCOPE = 'all'
+
+
+def counter_key(name, owner_id=None):
+    return f'counts:{owner_id or GLOBAL_SCOPE}:{name}'
+
+
+def count_from_db(owner_id=None):
+    clients = Client.objects.all()
+    projects = Project.objects.all()
+    media = MediaFile.objects.filter(is_deleted=False)
+    deleted = DeletedFile.objects.all()
+    if owner_id:
+        clients = clients.filter(owner_id=owner_id)
+        projects = projects.filter(client__owner_id=owner_id)
+        media = media.filter(project__client__owner_id=owner_id)
+        deleted = deleted.filter(media__project__client__owner_id=owner_id)
+    return {'clients': clients.count(), 'projects': projects.count(),
+            'media': media.count(), 'deleted': deleted.count()}
+
+
+def get_counts(owner_id=None):
+    """Dashboard counts for one owner (or everyone), from cached counters when they are warm."""
+    keys = {name: counter_key(name, owner_id) for name in COUNTERS}
+    cached = cache.get_many(keys.values())
+    if len(cached) == len(keys):
+        return {name: cached[key] for name, key in keys.items()}
+    counts = count_from_db(owner_id)
+    for name, key in keys.items():
+        # add, not set: an increment that landed since the COUNTs ran must not be overwritten
+        cache.add(key, counts[name], settings.COUNTS_CACHE_TIMEOUT)
+    return counts
+
+
+def adjust_counts(owner_id, **deltas):
+    """Move an owner's counters (and the global ones) once the current transaction commits."""
+    def apply():
+        for scope in {owner_id, None}:
+            for name, delta in deltas.items():
+                if not delta:
+                    continue
+                try:
+                    cache.incr(counter_key(name, scope), delta)
+                except ValueError:
+                    pass  # not cached: the next read counts from the database
+    transaction.on_commit(apply)
+
+
+def invalidate_counts(owner_ids=()):
+    """Drop counters that cannot be adjusted exactly (cascading deletes); they are recounted on next read."""
+    keys = [counter_key(name, scope) for scope in {*owner_ids, None} for name in COUNTERS]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def owner_of_project(project_id):
+    return Project.objects.filter(pk=project_id).values_list('client__owner_id', flat=True).first()
+
+
+def listing_version_key(name):
+    return f'listing-version:{name}'
+
+
+def listing_version(name):
+    """Current version token of a cached listing; part of its fragment cache keys."""
+    key = listing_version_key(name)
+    version = cache.get(key)
+    if version is None:
+        # start from the clock, so a version key that was evicted never reuses an old number
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_listing(*names):
+    """Orphan every cached fragment of these listings once the current transaction commits."""
+    def apply():
+        for name in names:
+            try:
+                cache.incr(listing_version_key(name))
+            except ValueError:
+                cache.add(listing_version_key(name), time.time_ns(), None)
+    transaction.on_commit(apply)
+
+
+def share_key(token):
+    return f'share:{token}'
+
+
+def resolve_share(token):
+    """Everything public share access needs about a token, or None if there is no such link.
+
+    One joined query on a miss. Found links are cached for up to SHARE_CACHE_TIMEOUT but never
+    past their expiry, so an expired link is never served as valid; unknown tokens are cached
+    for SHARE_NEGATIVE_CACHE_TIMEOUT so token scanning does not reach the database.
+    """
+    key = share_key(token)
+    record = cache.get(key)
+    if record is not None:
+        return record or None
+    record = (ShareLink.objects.filter(token=token)
+              .values('id', 'token', 'permission', 'expires_at', 'media_id',
+                      'media__media_type', 'created_by__username')
+              .first())
+    if record is None:
+        cache.set(key, {}, settings.SHARE_NEGATIVE_CACHE_TIMEOUT)
+        return None
+    timeout = settings.SHARE_CACHE_TIMEOUT
+    if record['expires_at'] and record['expires_at'] > timezone.now():
+        timeout = min(timeout, (record['expires_at'] - timezone.now()).total_seconds())
+    cache.set(key, record, timeout)
+    return record
+
+
+def share_is_valid(record):
+    return not (record['expires_at'] and timezone.now() >= record['expires_at'])
+
+
+def invalidate_share(token):
+    transaction.on_commit(lambda: cache.delete(share_key(token)))
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .models import MediaFile
+from .storage import copy_stored_object
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# Running SHA256 state per session. hashlib objects cannot be persisted, so the
+# digest is carried in-process between chunks and rebuilt (or deferred) on a miss.
+_MAX_RUNNING_HASHES = 1024
+_running_hashes = OrderedDict()
+
+
+def partial_name(session):
+    """Where a session's chunks are assembled: unique per session, so same-named uploads never share it."""
+    ext = os.path.splitext(default_storage.generate_filename(session.filename))[1]
+    return f'uploads_partial/{session.pk}{ext}'
+
+
+def final_name(session):
+    """The MediaFile name for a finished upload; the session id keeps same-named uploads apart."""
+    field = MediaFile._meta.get_field('file')
+    root, ext = os.path.splitext(field.generate_filename(None, session.filename))
+    suffix = f'_{session.pk.hex}{ext}'
+    return root[:field.max_length - len(suffix)] + suffix
+
+
+def read_stream(stream, length):
+    """Yield ``length`` bytes from ``stream`` in bounded blocks."""
+    remaining = length
+    while remaining > 0:
+        block = stream.read(min(STREAM_BLOCK_SIZE, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        yield block
+
+
+def get_running_hash(session, store):
+    """Return a SHA256 object covering the first ``session.offset`` bytes, or None.
+
+    A worker that missed some chunks catches up from the bytes it has not seen
+    yet, so each byte is hashed at most once per worker.
+    """
+    cached = _running_hashes.get(session.pk)
+    if cached and cached[0] <= session.offset:
+        _running_hashes.move_to_end(session.pk)
+        start, hasher = cached[0], cached[1].copy()
+    else:
+        start, hasher = 0, hashlib.sha256()
+    if start == session.offset:
+        return hasher
+    return store.catch_up_hash(session, hasher, start)
+
+
+def remember_running_hash(session, hasher):
+    _running_hashes[session.pk] = (session.offset, hasher)
+    _running_hashes.move_to_end(session.pk)
+    while len(_running_hashes) > _MAX_RUNNING_HASHES:
+        _running_hashes.popitem(last=False)
+
+
+def forget_running_hash(session):
+    _running_hashes.pop(session.pk, None)
+
+
+class LocalChunkStore:
+    """Writes each chunk at its offset in a part file under MEDIA_ROOT."""
+    min_chunk_size = 1
+
+    def part_path(self, session):
+        return default_storage.path(session.storage_name)
+
+    def start(self, session):
+        session.storage_name = partial_name(session)
+        path = self.part_path(session)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+
+    def write(self, session, offset, blocks):
+        written = 0
+        with open(self.part_path(session), 'r+b') as fh:
+            fh.seek(offset)
+            for block in blocks:
+                fh.write(block)
+                written += len(block)
+            # drop bytes left behind by an interrupted earlier attempt
+            fh.truncate()
+        return written
+
+    def catch_up_hash(self, session, hasher, start):
+        with open(self.part_path(session), 'rb') as fh:
+            fh.seek(start)
+            for block in read_stream(fh, session.offset - start):
+                hasher.update(block)
+        return hasher
+
+    def complete(self, session):
+        return session.storage_name
+
+    def move(self, name, target):
+        # rename into place: the assembled bytes are never copied
+        path = default_storage.path(target)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(default_storage.path(name), path)
+        return target
+
+    def abort(self, session):
+        try:
+            os.remove(self.part_path(session))
+        except FileNotFoundError:
+            pass
+
+
+class S3MultipartStore:
+    """Maps each chunk onto one part of an S3 multipart upload."""
+    min_chunk_size = S3_MIN_PART_SIZE
+
+    def _client(self):
+        return default_storage.connection.meta.client
+
+    def _key(self, name):
+        from storages.utils import clean_name
+        return default_storage._normalize_name(clean_name(name))
+
+    def start(self, session):
+        session.storage_name = partial_name(session)
+        response = self._client().create_multipart_upload(
+            Bucket=default_storage.bucket_name, Key=self._key(session.storage_name),
+        )
+        session.s3_upload_id = response['UploadId']
+
+    def write(self, session, offset, blocks):
+        # offsets map onto part numbers: the claimed offset is always the end of the last part
+        part_number = len(session.parts) + 1
+        # the request needs a seekable body; a large part is spooled to disk rather than held in memory
+        with tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as body:
+            for block in blocks:
+                body.write(block)
+            written = body.tell()
+            body.seek(0)
+            response = self._client().upload_part(
+                Bucket=default_storage.bucket_name, Key=self._key(session.storage_name),
+                UploadId=session.s3_upload_id, PartNumber=part_number, Body=body, ContentLength=written,
+            )
+        session.parts = session.parts + [{'PartNumber': part_number, 'ETag': response['ETag']}]
+        return written
+
+    def catch_up_hash(self, session, hasher, start):
+        # parts cannot be read back before completion; hash in the background instead
+        return None
+
+    def complete(self, session):
+        self._client().complete_multipart_upload(
+            Bucket=default_storage.bucket_name, Key=self._key(session.storage_name),
+            UploadId=session.s3_upload_id, MultipartUpload={'Parts': session.parts},
+        )
+        return session.storage_name
+
+    def move(self, name, target):
+        copy_stored_object(name, target)
+        default_storage.delete(name)
+        return target
+
+    def abort(self, session):
+        if session.s3_upload_id:
+            client = self._client()
+            try:
+                client.abort_multipart_upload(
+                    Bucket=default_storage.bucket_name, Key=self._key(session.storage_name),
+                    UploadId=session.s3_upload_id,
+                )
+            except client.exceptions.NoSuchUpload:
+                # already aborted (or expired by a bucket lifecycle rule)
+                pass
+
+
+def get_chunk_store():
+    if settings.USE_S3:
+        return S3MultipartStore()
+    return LocalChunkStore()
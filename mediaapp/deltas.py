@@ -0,0 +1,148 @@
+import bisect
+import hashlib
+import io
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .storage import reference_blob, write_blob
+
+READ_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def anchor_pattern(avg_size):
+    """A byte pattern that occurs about once every ``avg_size`` bytes of high-entropy data.
+
+    Two fixed bytes followed by a byte from a class sized to make up the rest of
+    the odds. Cut points are content-defined, so an edit only changes the chunks
+    around it, and the regex engine finds them at C speed rather than running a
+    rolling hash over every byte in Python.
+    """
+    class_size = max(1, min(256, (1 << 24) // avg_size))
+    return re.compile(b'\x5a\xa5[' + re.escape(bytes(range(class_size))) + b']')
+
+
+def iter_chunks(fh, avg_size=None):
+    """Split a file into content-defined chunks of avg_size / 4 to avg_size * 4 bytes."""
+    avg_size = avg_size or settings.VERSION_CHUNK_SIZE
+    min_size, max_size = avg_size // 4, avg_size * 4
+    anchor = anchor_pattern(avg_size)
+    buf = b''
+    eof = False
+    while True:
+        while not eof and len(buf) < max_size:
+            block = fh.read(READ_BLOCK_SIZE)
+            if not block:
+                eof = True
+            buf += block
+        if not buf:
+            return
+        match = anchor.search(buf, min_size, max_size)
+        # no anchor: cut at max_size (long uniform runs) or take the tail at EOF
+        cut = match.end() if match else min(len(buf), max_size)
+        yield buf[:cut]
+        buf = buf[cut:]
+
+
+def store_chunks(fh):
+    """Store a stream as shared chunk blobs; returns (manifest, sha256 of the whole, new bytes written)."""
+    whole = hashlib.sha256()
+    manifest = []
+    written = 0
+    for chunk in iter_chunks(fh):
+        whole.update(chunk)
+        name, stored = reference_blob(hashlib.sha256(chunk).hexdigest(), '', len(chunk),
+                                      lambda target: write_blob(target, ContentFile(chunk)))
+        manifest.append([name, len(chunk)])
+        if stored:
+            written += len(chunk)
+    return manifest, whole.hexdigest(), written
+
+
+class ChunkedReader(io.RawIOBase):
+    """Seekable, read-only view of a chunk manifest; chunks are opened as reads reach them."""
+
+    def __init__(self, manifest):
+        self.names = [name for name, _ in manifest]
+        self.offsets = [0]
+        for _, size in manifest:
+            self.offsets.append(self.offsets[-1] + size)
+        self.size = self.offsets[-1]
+        self.pos = 0
+        self.current = None  # (chunk index, open file)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def readinto(self, b):
+        if self.pos >= self.size:
+            return 0
+        index = bisect.bisect_right(self.offsets, self.pos) - 1
+        if self.current is None or self.current[0] != index:
+            self._close_current()
+            self.current = (index, default_storage.open(self.names[index], 'rb'))
+        fh = self.current[1]
+        fh.seek(self.pos - self.offsets[index])
+        data = fh.read(min(len(b), self.offsets[index + 1] - self.pos))
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def _close_current(self):
+        if self.current is not None:
+            self.current[1].close()
+            self.current = None
+
+    def close(self):
+        self._close_current()
+        super().close()
+
+
+class ReconstructedFile(File):
+    """A delta-stored version, reassembled lazily from its chunks.
+
+    Quacks enough like a FieldFile for renditions and downloads: it can be
+    reopened, and ``path`` spills it to a temporary file for tools such as ffmpeg.
+    """
+
+    def __init__(self, manifest, name, size):
+        self.manifest = manifest
+        self._spilled = None
+        super().__init__(io.BufferedReader(ChunkedReader(manifest), READ_BLOCK_SIZE), name)
+        self.size = size
+
+    def open(self, mode='rb'):
+        if self.closed:
+            self.file = io.BufferedReader(ChunkedReader(self.manifest), READ_BLOCK_SIZE)
+        else:
+            self.seek(0)
+        return self
+
+    @property
+    def path(self):
+        if self._spilled is None:
+            self._spilled = tempfile.NamedTemporaryFile(suffix=self.name[self.name.rfind('.'):] if '.' in self.name else '')
+            self.open()
+            for block in self.chunks(READ_BLOCK_SIZE):
+                self._spilled.write(block)
+            self._spilled.flush()
+            self.close()
+        return self._spilled.name
@@ -0,0 +1,159 @@
+import mimetypes
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date
+
+from .storage import tier_of
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_BLOCK_SIZE = 256 * 1024
+
+
+def parse_range(header, size):
+    """Return (start, end) for a single-range header, None to ignore it, or raise ValueError if unsatisfiable."""
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or not (match.group(1) or match.group(2)):
+        # absent, malformed or multi-range: serve the whole file
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # suffix range: the final N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or start > end:
+        raise ValueError('unsatisfiable range')
+    return start, end
+
+
+def iter_range(fh, start, length):
+    try:
+        fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = fh.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        fh.close()
+
+
+async def aiter_range(fh, start, length):
+    """iter_range for ASGI: each read runs in a worker thread, never on the event loop."""
+    read = sync_to_async(fh.read, thread_sensitive=False)
+    try:
+        await sync_to_async(fh.seek, thread_sensitive=False)(start)
+        remaining = length
+        while remaining > 0:
+            block = await read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        await sync_to_async(fh.close, thread_sensitive=False)()
+
+
+def serve_file(request, field_file, etag=None, last_modified=None, filename=None, as_attachment=False,
+               asynchronous=False):
+    """Stream a stored file honouring Range, If-None-Match/If-Modified-Since and If-Range.
+
+    ``etag`` should be a strong validator for the bytes (the file's SHA256).
+    S3 files redirect to a presigned URL, which handles ranges itself; files
+    reassembled from chunks are streamed through this process. Local files
+    are handed to the front-end server when SENDFILE_BACKEND is set, otherwise
+    served with FileResponse (zero-copy through wsgi.file_wrapper) or, for ranges,
+    streamed in blocks. ``asynchronous`` streams with an async iterator instead, for
+    async views: under ASGI, Django reads a sync iterator to the end before sending it.
+    """
+    quoted_etag = f'"{etag}"' if etag else None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=quoted_etag, last_modified=timestamp)
+    if response is None:
+        response = build_file_response(request, field_file, quoted_etag, timestamp, filename, as_attachment,
+                                       asynchronous)
+    if quoted_etag:
+        response['ETag'] = quoted_etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+async def aserve_file(request, field_file, **kwargs):
+    """serve_file for async views; opening the file (or presigning its URL) happens in a thread."""
+    return await sync_to_async(serve_file)(request, field_file, asynchronous=True, **kwargs)
+
+
+def build_file_response(request, field_file, quoted_etag, timestamp, filename, as_attachment, asynchronous=False):
+    filename = filename or os.path.basename(field_file.name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if getattr(field_file, 'storage', None) is None:
+        # reassembled on the fly (delta-stored versions): nothing to redirect or hand off to
+        response = stream_file(request, field_file.size, field_file.open, quoted_etag, timestamp, content_type,
+                               asynchronous)
+    elif settings.USE_S3:
+        url = field_file.url
+        if as_attachment:
+            url = field_file.storage.url(field_file.name, parameters={
+                'ResponseContentDisposition': content_disposition_header(True, filename),
+            })
+        response = HttpResponseRedirect(url)
+    elif settings.SENDFILE_BACKEND == 'x-accel' and tier_of(field_file.name) == 'hot':
+        # the internal location maps MEDIA_ROOT only; warm and cold files are streamed below
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.SENDFILE_URL_PREFIX + field_file.name
+    elif settings.SENDFILE_BACKEND == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = field_file.path
+    else:
+        response = stream_file(request, field_file.size,
+                               lambda: field_file.storage.open(field_file.name, 'rb'),
+                               quoted_etag, timestamp, content_type, asynchronous)
+
+    if not isinstance(response, HttpResponseRedirect):
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    return response
+
+
+def stream_file(request, size, open_file, quoted_etag, timestamp, content_type, asynchronous=False):
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # If-Range: only send a partial body if the client's copy is still current
+    if range_header and if_range and if_range != quoted_etag and if_range != (http_date(timestamp) if timestamp else None):
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    fh = open_file()
+    if asynchronous:
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1
+        response = StreamingHttpResponse(aiter_range(fh, start, length), status=206 if byte_range else 200,
+                                         content_type=content_type)
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+    elif byte_range is None:
+        response = FileResponse(fh, content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(iter_range(fh, start, length), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,121 @@
+"""Stream many media files as one zip, built while it is sent.
+
+Entries are stored, not compressed (JPEG and MP4 do not shrink), and written through an
+unseekable sink, so zipfile emits each file's CRC and sizes in a data descriptor after its
+bytes. Memory stays at one EXPORT_BLOCK_SIZE block whatever the export size, and zip64 records
+are used wherever a size or offset passes 4 GiB.
+"""
+import io
+import itertools
+import os
+import zipfile
+from collections import namedtuple
+
+from django.db.models import OuterRef, Subquery
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from .models import Blob, FileVersion
+
+EXPORT_BLOCK_SIZE = 1024 * 1024
+EXPORT_QUERY_CHUNK = 200
+
+ExportEntry = namedtuple('ExportEntry', 'name size modified file')
+
+
+class ZipSink(io.RawIOBase):
+    """Collects what zipfile writes until the response generator drains it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_date_time(value):
+    # zip timestamps are local, with two-second resolution, and cannot predate 1980
+    value = timezone.localtime(value) if timezone.is_aware(value) else value
+    return max(value.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def iter_zip(entries):
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, date_time=zip_date_time(entry.modified))
+            info.compress_type = zipfile.ZIP_STORED
+            # the size up front makes zipfile write zip64 headers for entries over 4 GiB
+            info.file_size = entry.size
+            with entry.file.open('rb') as source, archive.open(info, 'w') as target:
+                for block in iter(lambda: source.read(EXPORT_BLOCK_SIZE), b''):
+                    target.write(block)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def unique_name(name, used):
+    stem, ext = os.path.splitext(name)
+    for n in itertools.count(2):
+        if name.lower() not in used:
+            used.add(name.lower())
+            return name
+        name = f'{stem} ({n}){ext}'
+
+
+def folder_name(name):
+    return name.replace('/', '_').replace('\\', '_').strip() or 'untitled'
+
+
+def export_entries(media, latest_version=False, folders=False):
+    """One ExportEntry per file: the original, or the latest version with ``latest_version``.
+
+    ``folders`` puts each project's files in a folder of its own (for client exports).
+    Names are made unique within the archive.
+    """
+    media = media.select_related('project').order_by('project__name', 'project_id', 'created_at', 'id')
+    if latest_version:
+        latest = FileVersion.objects.filter(media=OuterRef('pk')).order_by('-version_number').values('pk')[:1]
+        media = media.annotate(latest_version_id=Subquery(latest))
+    used = set()
+    rows = media.iterator(chunk_size=EXPORT_QUERY_CHUNK)
+    while True:
+        chunk = list(itertools.islice(rows, EXPORT_QUERY_CHUNK))
+        if not chunk:
+            return
+        versions = {}
+        if latest_version:
+            versions = FileVersion.objects.in_bulk([m.latest_version_id for m in chunk if m.latest_version_id])
+        # blob sizes come from the database instead of one storage call per file
+        names = [m.file.name for m in chunk] + [v.file.name for v in versions.values() if v.file]
+        blob_sizes = dict(Blob.objects.filter(name__in=names).values_list('name', 'size'))
+        for item in chunk:
+            version = versions.get(getattr(item, 'latest_version_id', None))
+            if version is not None:
+                content, name, modified = version.content, version.display_name, version.created_at
+                size = version.size or blob_sizes.get(version.file.name) or version.file.size
+            else:
+                content, name, modified = item.file, item.display_name, item.created_at
+                size = blob_sizes.get(item.file.name) or item.file.size
+            if folders:
+                name = f'{folder_name(item.project.name)}/{name}'
+            yield ExportEntry(unique_name(name, used), size, modified, content)
+
+
+def zip_response(filename, entries):
+    response = StreamingHttpResponse((data for data in iter_zip(entries) if data), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    # let a proxy pass the archive on as it is produced rather than buffering it
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,90 @@
+"""Helpers shared by the bench_* commands: percentiles, and HTTP against a running server.
+
+The commands that load a server only speak HTTP, so the same command measures a checkout
+from before a change (served on another port) and one after it.
+"""
+import http.client
+import math
+import os
+import time
+import uuid
+from urllib.parse import urlsplit
+
+BODY_BLOCK = 1024 * 1024
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Nearest-rank percentiles of ``samples`` (plus the max), rounded to milliseconds when given seconds."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    result = {f'p{point}': ordered[max(0, math.ceil(point / 100 * len(ordered)) - 1)] for point in points}
+    result['max'] = ordered[-1]
+    return result
+
+
+def format_seconds(stats):
+    return ', '.join(f'{key} {value * 1000:.0f}ms' for key, value in stats.items())
+
+
+def connection(base_url, timeout=600):
+    parts = urlsplit(base_url)
+    factory = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return factory(parts.hostname, parts.port, timeout=timeout), parts.path.rstrip('/')
+
+
+def auth_headers(token):
+    return {'Authorization': f'Bearer {token}'} if token else {}
+
+
+def request(base_url, method, path, body=None, headers=None, read_block=BODY_BLOCK, collect=False, timeout=600):
+    """One request on a fresh connection: (status, headers, bytes received, seconds to the last byte).
+
+    With ``collect`` the body itself is returned in place of its length.
+    """
+    conn, prefix = connection(base_url, timeout)
+    started = time.perf_counter()
+    try:
+        conn.request(method, prefix + path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        received, blocks = 0, []
+        while True:
+            block = response.read(read_block)
+            if not block:
+                break
+            received += len(block)
+            if collect:
+                blocks.append(block)
+        seconds = time.perf_counter() - started
+        return response.status, response.headers, b''.join(blocks) if collect else received, seconds
+    finally:
+        conn.close()
+
+
+def random_blocks(size):
+    """``size`` bytes of incompressible data, generated a block at a time."""
+    remaining = size
+    while remaining:
+        block = os.urandom(min(BODY_BLOCK, remaining))
+        remaining -= len(block)
+        yield block
+
+
+def multipart_upload(fields, file_field, filename, size):
+    """(body iterable, headers) of a multipart form carrying ``size`` random bytes, never held in memory."""
+    boundary = uuid.uuid4().hex
+    head = b''.join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items())
+    head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+
+    def body():
+        yield head
+        yield from random_blocks(size)
+        yield tail
+
+    headers = {'Content-Type': f'multipart/form-data; boundary={boundary}',
+               'Content-Length': str(len(head) + size + len(tail))}
+    return body(), headers
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from mediaapp.tiering import apply_tier_policy
+
+
+def megabytes(n):
+    return f'{n / 1024 ** 2:.1f} MB'
+
+
+class Command(BaseCommand):
+    help = 'Move media files between the hot, warm and cold storage tiers according to the StorageTierRules.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows scanned per batch.')
+        parser.add_argument('--workers', type=int, default=None, help='Concurrent file moves.')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would move without moving it.')
+
+    def handle(self, *args, **options):
+        stats = apply_tier_policy(batch_size=options['batch_size'], workers=options['workers'],
+                                  dry_run=options['dry_run'])
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        for tier, count in stats['moved'].items():
+            self.stdout.write(f"{verb} {count} files ({megabytes(stats['bytes_moved'][tier])}) to {tier}.")
+        if stats['failed']:
+            self.stdout.write(self.style.WARNING(
+                f"{stats['failed']} files could not be moved; they will be retried on the next run."))
+        for tier, usage in stats['usage'].items():
+            self.stdout.write(f"{tier}: {usage['files']} files, {megabytes(usage['bytes'])}")
+        self.stdout.write(self.style.SUCCESS(f"Scanned {stats['scanned']} files in {stats['seconds']}s."))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from mediaapp.models import FileVersion, MediaFile
+from mediaapp.storage_io import object_sizes
+from mediaapp.usage import recompute_usage
+
+
+class Command(BaseCommand):
+    help = ('Record the size of media files and versions stored before sizes were tracked, '
+            'then rebuild the per-project and per-client storage totals.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows sized per batch.')
+        parser.add_argument('--workers', type=int, default=16, help='Concurrent stat (or S3 HEAD) requests.')
+
+    def backfill(self, model, options):
+        """Size every row of ``model`` still at 0, keyset-paginated; returns (sized, missing)."""
+        sized = missing = 0
+        last_pk = 0
+        while True:
+            batch = list(model.objects.filter(size=0, pk__gt=last_pk).exclude(file='')
+                         .order_by('pk').values_list('pk', 'file')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            sizes = object_sizes([name for _, name in batch], workers=options['workers'])
+            rows = [model(pk=pk, size=sizes[name]) for pk, name in batch if name in sizes]
+            model.objects.bulk_update(rows, ['size'])
+            sized += len(rows)
+            missing += len(batch) - len(rows)
+        return sized, missing
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        for model in (MediaFile, FileVersion):
+            sized, missing = self.backfill(model, options)
+            self.stdout.write(f'{model._meta.verbose_name_plural}: sized {sized}, {missing} missing from storage.')
+        with transaction.atomic():
+            projects, clients = recompute_usage()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt storage totals of {projects} projects and {clients} clients '
+            f'in {time.monotonic() - started:.2f}s.'))
@@ -0,0 +1,79 @@
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ._bench import auth_headers, format_seconds, multipart_upload, percentiles, request
+
+
+class Command(BaseCommand):
+    help = ('Load running servers with concurrent uploads and listings and report throughput, latency '
+            'percentiles and errors for each. Serve the same checkout twice, once on SQLite and once with '
+            'DATABASE_URL pointing at PostgreSQL (each under gunicorn with several workers), and pass both '
+            'with --url to compare the databases under write contention.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', help='Base URL of a server; repeat to compare several.')
+        parser.add_argument('--project', type=int, required=True,
+                            help='Project the test files are uploaded to (the same id on every server).')
+        parser.add_argument('--clients', type=int, default=16, help='Concurrent clients.')
+        parser.add_argument('--seconds', type=float, default=30, help='How long to load each server.')
+        parser.add_argument('--upload-share', type=float, default=0.2, help='Fraction of requests that upload.')
+        parser.add_argument('--upload-size', type=int, default=256, help='Upload size in KB.')
+        parser.add_argument('--token', help='JWT access token, if the servers require one.')
+        parser.add_argument('--keep', action='store_true', help='Keep the uploads instead of soft-deleting them.')
+
+    def handle(self, *args, **options):
+        urls = options['url'] or ['http://127.0.0.1:8000']
+        headers = auth_headers(options['token'])
+        for url in urls:
+            samples, created = self.load(url, headers, options)
+            if not samples:
+                raise CommandError(f'{url}: no request completed')
+            self.stdout.write(f'{url}: {options["clients"]} clients for {options["seconds"]:.0f}s')
+            for kind in ('upload', 'list'):
+                results = samples[kind]
+                if not results:
+                    continue
+                ok = [seconds for code, seconds in results if code < 400]
+                errors = Counter(code for code, _ in results if code >= 400)
+                self.stdout.write(f'  {kind}: {len(ok) / options["seconds"]:.1f}/s ok, '
+                                  f'{format_seconds(percentiles(ok))}'
+                                  + (f'; errors {dict(errors)}' if errors else ''))
+            if not options['keep']:
+                for media_id in created:
+                    request(url, 'DELETE', f'/api/api/media/{media_id}/', headers=headers)
+
+    def load(self, url, headers, options):
+        """Run the clients against ``url``: ({'upload'|'list': [(status, seconds)]}, ids of uploaded files)."""
+        samples, created = defaultdict(list), []
+        lock = threading.Lock()
+        size = options['upload_size'] * 1024
+        lists = ['/api/api/media/', f'/api/api/media/search/?project={options["project"]}']
+        deadline = time.monotonic() + options['seconds']
+
+        def client(number):
+            rng = random.Random(number)
+            while time.monotonic() < deadline:
+                if rng.random() < options['upload_share']:
+                    kind = 'upload'
+                    body, form_headers = multipart_upload({'project': options['project'], 'media_type': 'video'},
+                                                          'file', f'bench-db-{number}.bin', size)
+                    code, _, content, seconds = request(url, 'POST', '/api/api/media/', body,
+                                                        {**headers, **form_headers}, collect=True)
+                    if code == 201:
+                        with lock:
+                            created.append(json.loads(content)['id'])
+                else:
+                    kind = 'list'
+                    code, _, _, seconds = request(url, 'GET', rng.choice(lists), headers=headers)
+                with lock:
+                    samples[kind].append((code, seconds))
+
+        with ThreadPoolExecutor(max_workers=options['clients']) as pool:
+            list(pool.map(client, range(options['clients'])))
+        return samples, created
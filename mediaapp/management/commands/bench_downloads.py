@@ -0,0 +1,80 @@
+import random
+from collections import Counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ._bench import auth_headers, format_seconds, percentiles, request
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class Command(BaseCommand):
+    help = ('Measure the bytes a client transfers viewing one file repeatedly against a running server: '
+            'full downloads every time, conditional GETs after the first (ETag), and Range requests '
+            'seeking into it. Follows the redirect to S3 when the server hands out presigned URLs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server.')
+        parser.add_argument('--media', type=int, help='Media file to download.')
+        parser.add_argument('--share', help='Download through this share token instead of --media.')
+        parser.add_argument('--async', dest='use_async', action='store_true',
+                            help='Use the async download endpoints (ASGI deployments).')
+        parser.add_argument('--views', type=int, default=10, help='Views of the whole file.')
+        parser.add_argument('--seeks', type=int, default=10, help='Range requests at random offsets.')
+        parser.add_argument('--range-size', type=int, default=1024 * 1024, help='Bytes per Range request.')
+        parser.add_argument('--token', help='JWT access token, if the server requires one.')
+
+    def handle(self, *args, **options):
+        if bool(options['media']) == bool(options['share']):
+            raise CommandError('Give --media or --share.')
+        prefix = '/api/api/async/' if options['use_async'] else '/api/api/'
+        if options['share']:
+            path = f"{prefix}shares/download/?token={options['share']}"
+        else:
+            path = f"{prefix}media/{options['media']}/download/"
+        self.base_url, self.headers = options['url'], auth_headers(options['token'])
+
+        first = self.get(path)
+        code, headers, size, _ = first
+        if code != 200:
+            raise CommandError(f'download failed with HTTP {code}')
+        etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+        self.stdout.write(f'{size} bytes; ETag {etag or "none"}, Last-Modified {last_modified or "none"}, '
+                          f'Accept-Ranges {headers.get("Accept-Ranges", "none")}')
+
+        views = options['views']
+        full = [self.get(path) for _ in range(views)]
+        self.report(f'{views} full downloads', full)
+
+        validators = {'If-None-Match': etag} if etag else {'If-Modified-Since': last_modified} if last_modified else {}
+        conditional = [first] + [self.get(path, validators) for _ in range(views - 1)]
+        self.report(f'{views} views revalidating after the first', conditional)
+
+        length = min(options['range_size'], size)
+        seeks = []
+        for _ in range(options['seeks']):
+            start = random.randrange(0, max(size - length, 0) + 1)
+            seeks.append(self.get(path, {'Range': f'bytes={start}-{start + length - 1}'}))
+        self.report(f'{options["seeks"]} seeks of {length} bytes', seeks)
+        if seeks and size:
+            self.stdout.write(f'Seeking transferred {sum(s[2] for s in seeks) / len(seeks) / size:.1%} '
+                              'of the file per seek, where restarting the download transfers all of it')
+
+    def get(self, path, headers=None, base_url=None):
+        """GET ``path`` (following a redirect, e.g. to a presigned S3 URL): (status, headers, bytes, seconds)."""
+        # the server's credentials are not for the redirect's target
+        credentials = self.headers if base_url is None else {}
+        code, response_headers, received, seconds = request(base_url or self.base_url, 'GET', path,
+                                                            headers={**credentials, **(headers or {})})
+        if code in REDIRECTS and base_url is None:
+            location = urlsplit(response_headers['Location'])
+            target = f'{location.scheme}://{location.netloc}' if location.netloc else self.base_url
+            redirected = self.get(location.path + (f'?{location.query}' if location.query else ''), headers, target)
+            return redirected[0], redirected[1], redirected[2], seconds + redirected[3]
+        return code, response_headers, received, seconds
+
+    def report(self, label, results):
+        statuses = ', '.join(f'{count}x {code}' for code, count in sorted(Counter(r[0] for r in results).items()))
+        self.stdout.write(f'{label}: {sum(r[2] for r in results) / 1024 / 1024:.2f} MB transferred ({statuses}); '
+                          f'{format_seconds(percentiles([r[3] for r in results]))}')
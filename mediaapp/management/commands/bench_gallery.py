@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from mediaapp.models import MediaFile
+from mediaapp.renditions import render_image
+from mediaapp.storage_io import object_sizes
+
+from ._bench import format_seconds, percentiles
+
+
+class Command(BaseCommand):
+    help = ('Compare the bytes a gallery page loads as originals and as renditions, and time rendering them. '
+            'Renders in this process without storing anything.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='Take the page from this project (default: all live media).')
+        parser.add_argument('--page-size', type=int, default=40, help='Tiles per gallery page.')
+        parser.add_argument('--size', default='thumb', choices=list(settings.RENDITION_SIZES),
+                            help='Rendition the gallery shows.')
+
+    def handle(self, *args, **options):
+        media = MediaFile.objects.filter(is_deleted=False, media_type='image').order_by('-created_at', '-id')
+        if options['project']:
+            media = media.filter(project_id=options['project'])
+        page = list(media[:options['page_size']])
+        if not page:
+            raise CommandError('No live images to measure.')
+        # files stored before sizes were tracked have size 0
+        stored = object_sizes([item.file.name for item in page if not item.size])
+        original_bytes = sum(item.size or stored.get(item.file.name, 0) for item in page)
+
+        edge = settings.RENDITION_SIZES[options['size']]
+        rendition_bytes, timings, failed = 0, [], 0
+        for item in page:
+            started = time.perf_counter()
+            try:
+                with item.file.open('rb') as fh:
+                    content, _, _ = render_image(fh, edge)
+            except (OSError, ValueError):
+                failed += 1
+                continue
+            timings.append(time.perf_counter() - started)
+            rendition_bytes += len(content)
+
+        rendered = len(page) - failed
+        self.stdout.write(f'{len(page)} tiles ({failed} undecodable): originals {original_bytes / 1024 / 1024:.1f} MB, '
+                          f'{options["size"]} renditions {rendition_bytes / 1024 / 1024:.2f} MB'
+                          + (f' ({original_bytes / rendition_bytes:.0f}x lighter)' if rendition_bytes else ''))
+        if rendered:
+            self.stdout.write(f'Render time per tile: {format_seconds(percentiles(timings))}; '
+                              f'whole page {sum(timings):.2f}s')
@@ -0,0 +1,73 @@
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ._bench import format_seconds, percentiles, request
+
+
+class Command(BaseCommand):
+    help = ('Load the public share endpoint of running servers with concurrent anonymous clients and report '
+            'requests per second, latency percentiles and errors. Mix in --unknown random tokens to see how '
+            'token-scanning traffic is answered. Pass --url twice to compare a checkout from before a change '
+            'with one after it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', help='Base URL of a server; repeat to compare several.')
+        parser.add_argument('--share', required=True, help='Token of a share link (the same on every server).')
+        parser.add_argument('--async', dest='use_async', action='store_true',
+                            help='Use the async share endpoint (ASGI deployments).')
+        parser.add_argument('--clients', type=int, default=16, help='Concurrent clients.')
+        parser.add_argument('--seconds', type=float, default=20, help='How long to load each server.')
+        parser.add_argument('--unknown', type=float, default=0.0,
+                            help='Fraction of requests that use a random token no link has.')
+
+    def handle(self, *args, **options):
+        urls = options['url'] or ['http://127.0.0.1:8000']
+        path = ('/api/api/async/' if options['use_async'] else '/api/api/') + 'shares/public_access/?token='
+        for url in urls:
+            code, _, _, _ = request(url, 'GET', path + options['share'])
+            if code != 200:
+                raise CommandError(f'{url}: the share link answered HTTP {code}')
+            samples = self.load(url, path, options)
+            total = sum(len(results) for results in samples.values())
+            self.stdout.write(f'{url}: {options["clients"]} clients for {options["seconds"]:.0f}s, '
+                              f'{total / options["seconds"]:.0f} requests/s')
+            for kind in ('valid', 'unknown'):
+                results = samples[kind]
+                if not results:
+                    continue
+                # unknown tokens are meant to be refused
+                expected = 200 if kind == 'valid' else 404
+                ok = [seconds for code, seconds in results if code == expected]
+                errors = Counter(code for code, _ in results if code != expected)
+                self.stdout.write(f'  {kind} tokens: {len(ok) / options["seconds"]:.0f}/s answered {expected}, '
+                                  f'{format_seconds(percentiles(ok))}'
+                                  + (f'; unexpected {dict(errors)}' if errors else ''))
+
+    def load(self, url, path, options):
+        """Run the clients against ``url``: {'valid'|'unknown': [(status, seconds)]}."""
+        samples = defaultdict(list)
+        lock = threading.Lock()
+        # a small pool of unknown tokens, so the server can answer repeats from its negative cache
+        unknown = [str(uuid.uuid4()) for _ in range(100)]
+        deadline = time.monotonic() + options['seconds']
+
+        def client(number):
+            rng = random.Random(number)
+            while time.monotonic() < deadline:
+                if rng.random() < options['unknown']:
+                    kind, token = 'unknown', rng.choice(unknown)
+                else:
+                    kind, token = 'valid', options['share']
+                code, _, _, seconds = request(url, 'GET', path + token)
+                with lock:
+                    samples[kind].append((code, seconds))
+
+        with ThreadPoolExecutor(max_workers=options['clients']) as pool:
+            list(pool.map(client, range(options['clients'])))
+        return samples
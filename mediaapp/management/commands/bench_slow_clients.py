@@ -0,0 +1,132 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ._bench import auth_headers, connection, format_seconds, percentiles, request
+
+TRICKLE_BLOCK = 4096
+
+
+class Command(BaseCommand):
+    help = ('Measure how slow clients (trickled downloads or chunk uploads) starve a running server: probe '
+            'API latency alone, then while --slow clients hold connections open. Compare the WSGI deployment '
+            '(gunicorn sync workers, default endpoints) with the ASGI one (uvicorn, --async endpoints).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server.')
+        parser.add_argument('--async', dest='use_async', action='store_true',
+                            help='Send the slow clients to the async endpoints (ASGI deployments).')
+        parser.add_argument('--mode', choices=['download', 'upload'], default='download',
+                            help='Slow clients download --media, or upload chunks to --project.')
+        parser.add_argument('--media', type=int, help='File the slow clients download (preferably a large one).')
+        parser.add_argument('--project', type=int, help='Project the slow uploads go to.')
+        parser.add_argument('--slow', type=int, default=20, help='Concurrent slow clients.')
+        parser.add_argument('--rate', type=int, default=32, help='KB/s each slow client reads or sends.')
+        parser.add_argument('--seconds', type=float, default=20, help='How long the slow clients stay connected.')
+        parser.add_argument('--probe-interval', type=float, default=0.25, help='Seconds between API probes.')
+        parser.add_argument('--probe-timeout', type=float, default=10, help='A probe slower than this failed.')
+        parser.add_argument('--token', help='JWT access token, if the server requires one.')
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'download' and not options['media']:
+            raise CommandError('--mode download needs --media.')
+        if options['mode'] == 'upload' and not options['project']:
+            raise CommandError('--mode upload needs --project.')
+        self.options, self.headers = options, auth_headers(options['token'])
+        self.prefix = '/api/api/async/' if options['use_async'] else '/api/api/'
+
+        baseline = self.probe(time.monotonic() + min(options['seconds'], 5))
+        self.report('Alone', baseline)
+
+        deadline = time.monotonic() + options['seconds']
+        slow = self.slow_download if options['mode'] == 'download' else self.slow_upload
+        with ThreadPoolExecutor(max_workers=options['slow'] + 1) as pool:
+            clients = [pool.submit(slow, deadline) for _ in range(options['slow'])]
+            # let the slow clients take their connections before probing
+            time.sleep(min(1.0, options['seconds'] / 4))
+            loaded = pool.submit(self.probe, deadline).result()
+            served = [client.result() for client in clients]
+        self.report(f'With {options["slow"]} slow {options["mode"]}s at {options["rate"]} KB/s', loaded)
+        moved = sum(served)
+        self.stdout.write(f'Slow clients moved {moved / 1024 / 1024:.1f} MB '
+                          f'({moved / options["seconds"] / 1024 / max(options["slow"], 1):.0f} KB/s each); '
+                          f'{sum(1 for n in served if not n)} got nothing through')
+
+    def probe(self, deadline):
+        """Cheap API requests until ``deadline``: a list of seconds per request, None for each failure."""
+        results = []
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                code, _, _, seconds = request(self.options['url'], 'GET', '/api/api/media/?fields=id',
+                                              headers=self.headers, timeout=self.options['probe_timeout'])
+                results.append(seconds if code == 200 else None)
+            except OSError:
+                results.append(None)
+            time.sleep(max(0.0, self.options['probe_interval'] - (time.monotonic() - started)))
+        return results
+
+    def report(self, label, results):
+        ok = [seconds for seconds in results if seconds is not None]
+        failed = len(results) - len(ok)
+        self.stdout.write(f'{label}: {len(results)} probes, {format_seconds(percentiles(ok)) or "none answered"}'
+                          + (f'; {failed} failed or timed out' if failed else ''))
+
+    def pace(self, started, moved):
+        """Sleep so that ``moved`` bytes since ``started`` keep to --rate."""
+        time.sleep(max(0.0, moved / (self.options['rate'] * 1024) - (time.monotonic() - started)))
+
+    def slow_download(self, deadline):
+        """Read the file at --rate until ``deadline``, starting over at its end; returns the bytes read."""
+        path = f"{self.prefix}media/{self.options['media']}/download/"
+        received = 0
+        while time.monotonic() < deadline:
+            conn, base = connection(self.options['url'], timeout=self.options['seconds'] + 30)
+            try:
+                conn.request('GET', base + path, headers=self.headers)
+                response = conn.getresponse()
+                started, moved = time.monotonic(), 0
+                while time.monotonic() < deadline:
+                    block = response.read(TRICKLE_BLOCK)
+                    if not block:
+                        break
+                    moved += len(block)
+                    self.pace(started, moved)
+                received += moved
+            except OSError:
+                return received
+            finally:
+                conn.close()
+        return received
+
+    def slow_upload(self, deadline):
+        """Send one chunk of a resumable upload at --rate until ``deadline``; returns the bytes sent."""
+        total = int(self.options['rate'] * 1024 * (self.options['seconds'] + 5))
+        code, _, content, _ = request(self.options['url'], 'POST', '/api/api/uploads/', json.dumps({
+            'project': self.options['project'], 'filename': 'bench-slow.bin', 'media_type': 'video',
+            'total_size': total}), {**self.headers, 'Content-Type': 'application/json'}, collect=True)
+        if code != 201:
+            raise CommandError(f'creating an upload session failed with HTTP {code}: {content[:500]!r}')
+        session = json.loads(content)['id']
+        conn, base = connection(self.options['url'], timeout=self.options['seconds'] + 30)
+        started, sent = time.monotonic(), 0
+        try:
+            conn.putrequest('PUT', f'{base}{self.prefix}uploads/{session}/')
+            for name, value in {**self.headers, 'Content-Type': 'application/offset+octet-stream',
+                                'Upload-Offset': '0', 'Content-Length': str(total)}.items():
+                conn.putheader(name, value)
+            conn.endheaders()
+            block = b'\0' * TRICKLE_BLOCK
+            while time.monotonic() < deadline and sent < total:
+                conn.send(block[:total - sent])
+                sent += min(TRICKLE_BLOCK, total - sent)
+                self.pace(started, sent)
+        except OSError:
+            pass
+        finally:
+            # hanging up mid-chunk leaves the session to be cancelled
+            conn.close()
+            request(self.options['url'], 'DELETE', f'/api/api/uploads/{session}/', headers=self.headers)
+        return sent
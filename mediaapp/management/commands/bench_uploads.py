@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ._bench import auth_headers, format_seconds, multipart_upload, percentiles, request
+
+
+class Command(BaseCommand):
+    help = ('Time media uploads of the given sizes against a running server and report latency percentiles. '
+            'Run it against a checkout from before a change and one after, each served like production '
+            '(gunicorn, a Celery worker) on the same storage, to compare.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the server.')
+        parser.add_argument('--project', type=int, required=True, help='Project the test files are uploaded to.')
+        parser.add_argument('--sizes', default='100,500,2000', help='Comma-separated upload sizes in MB.')
+        parser.add_argument('--runs', type=int, default=5, help='Uploads per size.')
+        parser.add_argument('--token', help='JWT access token, if the server requires one.')
+        parser.add_argument('--keep', action='store_true', help='Keep the uploads instead of soft-deleting them.')
+
+    def handle(self, *args, **options):
+        sizes = [int(float(mb) * 1024 * 1024) for mb in options['sizes'].split(',') if mb]
+        headers = auth_headers(options['token'])
+        for size in sizes:
+            latencies = []
+            for run in range(options['runs']):
+                body, form_headers = multipart_upload({'project': options['project'], 'media_type': 'video'},
+                                                      'file', f'bench-{run}.bin', size)
+                code, _, content, seconds = request(options['url'], 'POST', '/api/api/media/', body,
+                                                    {**headers, **form_headers}, collect=True)
+                if code != 201:
+                    raise CommandError(f'upload of {size} bytes failed with HTTP {code}: {content[:500]!r}')
+                latencies.append(seconds)
+                if not options['keep']:
+                    request(options['url'], 'DELETE', f"/api/api/media/{json.loads(content)['id']}/", headers=headers)
+            self.stdout.write(f'{size / 1024 / 1024:.0f} MB x {len(latencies)}: {format_seconds(percentiles(latencies))}')
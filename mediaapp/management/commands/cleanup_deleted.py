@@ -1,23 +1,20 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from mediaapp.models import DeletedFile
+from mediaapp.purge import purge_expired
 
 
 class Command(BaseCommand):
     help = 'Permanently delete expired DeletedFile entries and remove files from storage.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Expired entries purged per batch.')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent storage deletes (local storage).')
+
     def handle(self, *args, **options):
-        now = timezone.now()
-        expired = DeletedFile.objects.filter(expiry__lte=now)
-        count = 0
-        for entry in expired:
-            media = entry.media
-            try:
-                storage = media.file.storage
-                if media.file.name and storage.exists(media.file.name):
-                    storage.delete(media.file.name)
-            except Exception as e:
-                self.stdout.write(self.style.WARNING(f'Failed to delete file: {e}'))
-            media.delete()
-            count += 1
-        self.stdout.write(self.style.SUCCESS(f'Permanently deleted {count} expired media files.'))
+        stats = purge_expired(batch_size=options['batch_size'], workers=options['workers'])
+        if stats['failed']:
+            self.stdout.write(self.style.WARNING(
+                f"{stats['failed']} media files could not be removed from storage; they will be retried on the next run."))
+        self.stdout.write(self.style.SUCCESS(
+            f"Permanently deleted {stats['deleted']} expired media files "
+            f"({stats['files_removed']} stored files, {stats['blobs_removed']} unreferenced blobs, {stats['batches']} batches) "
+            f"in {stats['seconds']}s ({stats['per_second']}/s)."))
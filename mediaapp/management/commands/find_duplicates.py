@@ -1,24 +1,124 @@
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+import django
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from mediaapp.models import MediaFile
-from django.db.models import Count, Q
+from django.db import connections
+from mediaapp.models import MediaFile, hash_stored_file
+from django.db.models import Count
+
+
+def hash_one(item):
+    """``(media_id, name, digest, error)``: one unreadable file must not abort the whole backfill."""
+    media_id, name = item
+    try:
+        return media_id, name, hash_stored_file(name), None
+    except Exception as e:
+        # any backend's error (OSError locally, botocore's ClientError on S3), reported as text
+        # because not every storage exception survives the trip back from the worker process
+        return media_id, name, None, f'{type(e).__name__}: {e}'
 
 
 class Command(BaseCommand):
     help = 'Scan for duplicate media files by hash.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['text', 'json', 'csv'], default='text',
+                            help='text (default), json (one JSON object per group per line) or csv (one row per file).')
+        parser.add_argument('--project', type=int, help='Only scan media in this project.')
+        parser.add_argument('--client', type=int, help='Only scan media belonging to this client.')
+        parser.add_argument('--backfill', action='store_true',
+                            help='Hash media with a missing file_hash before scanning.')
+        parser.add_argument('--workers', type=int, default=4, help='Processes used by --backfill.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows fetched per round trip.')
+
+    def scoped(self, options):
+        media = MediaFile.objects.filter(is_deleted=False)
+        if options['project']:
+            media = media.filter(project_id=options['project'])
+        if options['client']:
+            media = media.filter(project__client_id=options['client'])
+        return media
+
+    def report(self, options, message):
+        # keep machine-readable output clean: timings go to stderr unless printing text
+        stream = self.stdout if options['format'] == 'text' else self.stderr
+        stream.write(message)
+
+    def backfill(self, media, options):
+        missing = media.filter(file_hash__isnull=True).exclude(file='').values_list('id', 'file')
+        started = time.monotonic()
+        updated = failed = 0
+        pending = []
+        # forked workers must not reuse the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for media_id, name, digest, error in pool.map(
+                    hash_one, missing.iterator(chunk_size=options['batch_size']), chunksize=16):
+                if digest is None:
+                    self.stderr.write(f'Could not hash media {media_id} ({name}): {error}')
+                    failed += 1
+                    continue
+                pending.append(MediaFile(id=media_id, file=name, file_hash=digest, hash_status='complete'))
+                if len(pending) >= options['batch_size']:
+                    updated += self.save_hashes(pending)
+                    pending = []
+        if pending:
+            updated += self.save_hashes(pending)
+        self.report(options, f'Backfilled {updated} hashes ({failed} unreadable) in {time.monotonic() - started:.2f}s.')
+
+    def save_hashes(self, media):
+        """Record backfilled hashes and, like compute_media_hash, fold the files into the blob store."""
+        MediaFile.objects.bulk_update(media, ['file_hash', 'hash_status'])
+        if settings.CONTENT_ADDRESSED_STORAGE:
+            for item in media:
+                try:
+                    item.move_to_blob_store()
+                except Exception as e:
+                    # the hash is recorded either way; the file just keeps its own name
+                    self.stderr.write(f'Could not move media {item.id} to the blob store: {type(e).__name__}: {e}')
+        return len(media)
+
     def handle(self, *args, **options):
-        # Find exact duplicates (same file_hash)
-        dupes = MediaFile.objects.filter(is_deleted=False).values('file_hash').annotate(
-            count=Count('id')
-        ).filter(count__gt=1, file_hash__isnull=False)
-        
-        total_duplicates = 0
-        for dupe in dupes:
-            files = MediaFile.objects.filter(file_hash=dupe['file_hash'], is_deleted=False)
-            self.stdout.write(f"\nDuplicate group (hash: {dupe['file_hash'][:16]}...):")
-            for f in files:
-                self.stdout.write(f"  - {f.id}: {f.file.name}")
-            total_duplicates += files.count() - 1
-        
-        self.stdout.write(self.style.SUCCESS(f'\nFound {total_duplicates} duplicate files.'))
-        self.stdout.write(self.style.WARNING('Tip: Use /api/media/{id}/duplicates/ endpoint to find dupes for a specific file.'))
+        media = self.scoped(options)
+        if options['backfill']:
+            self.backfill(media, options)
+
+        started = time.monotonic()
+        duplicate_hashes = (media.filter(file_hash__isnull=False).values('file_hash')
+                            .annotate(count=Count('id')).filter(count__gt=1).values('file_hash'))
+        # one query, streamed with a server-side cursor and grouped on the fly
+        rows = (media.filter(file_hash__in=duplicate_hashes)
+                .order_by('file_hash', 'id')
+                .values_list('file_hash', 'id', 'file', 'project_id', 'project__client_id')
+                .iterator(chunk_size=options['batch_size']))
+
+        writer = csv.writer(self.stdout) if options['format'] == 'csv' else None
+        if writer:
+            writer.writerow(['file_hash', 'id', 'file', 'project', 'client'])
+
+        groups = total_duplicates = 0
+        for file_hash, group in groupby(rows, key=lambda row: row[0]):
+            files = [{'id': m_id, 'file': name, 'project': project_id, 'client': client_id}
+                     for _, m_id, name, project_id, client_id in group]
+            groups += 1
+            total_duplicates += len(files) - 1
+            if options['format'] == 'json':
+                self.stdout.write(json.dumps({'file_hash': file_hash, 'count': len(files), 'files': files}))
+            elif writer:
+                for f in files:
+                    writer.writerow([file_hash, f['id'], f['file'], f['project'], f['client']])
+            else:
+                self.stdout.write(f"\nDuplicate group (hash: {file_hash[:16]}...):")
+                for f in files:
+                    self.stdout.write(f"  - {f['id']}: {f['file']}")
+
+        elapsed = time.monotonic() - started
+        if options['format'] == 'text':
+            self.stdout.write(self.style.SUCCESS(f'\nFound {total_duplicates} duplicate files.'))
+            self.stdout.write(self.style.WARNING('Tip: Use /api/media/{id}/duplicates/ endpoint to find dupes for a specific file.'))
+        self.report(options, f'Scanned {groups} duplicate groups ({total_duplicates} duplicate files) in {elapsed:.2f}s.')
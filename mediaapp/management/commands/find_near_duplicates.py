@@ -0,0 +1,79 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mediaapp.models import MediaFile
+from mediaapp.phash import BKTree, compute_perceptual_hash
+
+
+class Command(BaseCommand):
+    help = 'Cluster visually similar media files by perceptual hash.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-distance', type=int, default=settings.NEAR_DUPLICATE_MAX_DISTANCE,
+                            help='Largest Hamming distance (of 64 bits) treated as a near-duplicate.')
+        parser.add_argument('--project', type=int, help='Only scan media in this project.')
+        parser.add_argument('--client', type=int, help='Only scan media belonging to this client.')
+        parser.add_argument('--format', choices=['text', 'json'], default='text',
+                            help='text (default) or json (one JSON object per cluster per line).')
+        parser.add_argument('--backfill', action='store_true',
+                            help='Compute missing perceptual hashes before clustering.')
+
+    def handle(self, *args, **options):
+        media = MediaFile.objects.filter(is_deleted=False)
+        if options['project']:
+            media = media.filter(project_id=options['project'])
+        if options['client']:
+            media = media.filter(project__client_id=options['client'])
+        report = self.stdout if options['format'] == 'text' else self.stderr
+
+        if options['backfill']:
+            started = time.monotonic()
+            count = failed = 0
+            for item in media.filter(phash__isnull=True).iterator():
+                try:
+                    compute_perceptual_hash(item)
+                    count += 1
+                except Exception:
+                    failed += 1
+            report.write(f'Backfilled {count} perceptual hashes ({failed} failed) in {time.monotonic() - started:.2f}s.')
+
+        started = time.monotonic()
+        tree = BKTree()
+        entries = list(media.filter(phash__isnull=False).values_list('id', 'file', 'phash'))
+        for media_id, name, phash in entries:
+            tree.add(phash, media_id)
+
+        # union-find over BK-tree neighbourhoods instead of comparing every pair
+        parent = {media_id: media_id for media_id, _, _ in entries}
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for media_id, _, phash in entries:
+            for other_id, _ in tree.search(phash, options['max_distance']):
+                root_a, root_b = find(media_id), find(other_id)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+
+        names = {media_id: name for media_id, name, _ in entries}
+        clusters = {}
+        for media_id in parent:
+            clusters.setdefault(find(media_id), []).append(media_id)
+        clusters = [sorted(ids) for ids in clusters.values() if len(ids) > 1]
+        clusters.sort()
+
+        for ids in clusters:
+            if options['format'] == 'json':
+                self.stdout.write(json.dumps({'count': len(ids), 'files': [{'id': i, 'file': names[i]} for i in ids]}))
+            else:
+                self.stdout.write(f'\nNear-duplicate cluster ({len(ids)} files):')
+                for i in ids:
+                    self.stdout.write(f'  - {i}: {names[i]}')
+
+        elapsed = time.monotonic() - started
+        report.write(f'Found {len(clusters)} clusters among {len(entries)} hashed files in {elapsed:.2f}s.')
@@ -0,0 +1,80 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from mediaapp.models import Blob, FileVersion, MediaFile, hash_stored_file
+from mediaapp.purge import collect_orphan_blobs
+from mediaapp.storage import BLOB_PREFIX, adopt_stored_file
+
+
+class Command(BaseCommand):
+    help = 'Fold media and version files stored under their own names into the content-addressed blob store.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows fetched per round trip.')
+        parser.add_argument('--recount', action='store_true',
+                            help='Only rebuild blob reference counts from MediaFile and FileVersion files and version chunks '
+                                 '(run while no uploads are in flight).')
+
+    def fold(self, model, batch_size):
+        """Adopt every legacy file of ``model``; returns (folded, deduplicated, bytes saved, failed)."""
+        folded = deduplicated = saved = failed = 0
+        legacy = model.objects.exclude(file='').exclude(file__startswith=BLOB_PREFIX).order_by('id')
+        last_id = 0
+        while True:
+            batch = list(legacy.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for item in batch:
+                name = item.file.name
+                try:
+                    digest = getattr(item, 'file_hash', None) or hash_stored_file(name)
+                    already_stored = Blob.objects.filter(pk=digest).exists()
+                    size = item.file.size
+                    with transaction.atomic():
+                        item.file.name = adopt_stored_file(name, digest)
+                        item.save(update_fields=['file'])
+                except OSError as e:
+                    self.stderr.write(f'{model.__name__} {item.id}: {name}: {e}')
+                    failed += 1
+                    continue
+                folded += 1
+                if already_stored:
+                    deduplicated += 1
+                    saved += size
+        return folded, deduplicated, saved, failed
+
+    def recount(self):
+        counts = {}
+        for model in (MediaFile, FileVersion):
+            for name, count in (model.objects.filter(file__startswith=BLOB_PREFIX)
+                                .values_list('file').annotate(count=Count('id')).order_by()):
+                counts[name] = counts.get(name, 0) + count
+        for chunks in FileVersion.objects.exclude(chunks=[]).values_list('chunks', flat=True).iterator():
+            for name, _ in chunks:
+                counts[name] = counts.get(name, 0) + 1
+        blobs = list(Blob.objects.all())
+        for blob in blobs:
+            blob.ref_count = counts.get(blob.name, 0)
+        Blob.objects.bulk_update(blobs, ['ref_count'], batch_size=1000)
+        return len(blobs)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['recount']:
+            total = self.recount()
+            removed, _ = collect_orphan_blobs()
+            self.stdout.write(self.style.SUCCESS(
+                f'Recounted {total} blobs and removed {removed} unreferenced ones in {time.monotonic() - started:.2f}s.'))
+            return
+
+        for model in (MediaFile, FileVersion):
+            folded, deduplicated, saved, failed = self.fold(model, options['batch_size'])
+            if failed:
+                self.stdout.write(self.style.WARNING(f'{failed} {model.__name__} files could not be read; rerun to retry.'))
+            self.stdout.write(
+                f'{model.__name__}: folded {folded} files, {deduplicated} duplicates '
+                f'({saved / (1024 * 1024):.1f} MB freed).')
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.monotonic() - started:.2f}s.'))
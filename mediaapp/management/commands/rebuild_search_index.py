@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from mediaapp.search import backend, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the media search index from the MediaFile, Project, Client and User tables.'
+
+    def handle(self, *args, **options):
+        if backend() is None:
+            self.stdout.write(self.style.WARNING('This database has no search index; searches use LIKE instead.'))
+            return
+        with transaction.atomic():
+            count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} media files.'))
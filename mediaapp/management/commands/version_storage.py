@@ -0,0 +1,59 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from mediaapp.models import FileVersion
+
+
+class Command(BaseCommand):
+    help = 'Report logical vs. stored bytes per version chain (and optionally chunk existing versions).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--media', type=int, help='Only report the chain of this media file.')
+        parser.add_argument('--chunk-existing', action='store_true',
+                            help='First re-store versions that are still whole files as shared chunks.')
+        parser.add_argument('--format', choices=['text', 'json'], default='text',
+                            help='text (default) or json (one JSON object per chain per line).')
+
+    def handle(self, *args, **options):
+        versions = FileVersion.objects.order_by('media_id', 'version_number')
+        if options['media']:
+            versions = versions.filter(media_id=options['media'])
+
+        if options['chunk_existing']:
+            started = time.monotonic()
+            count = written = 0
+            for version in versions.filter(chunks=[]).exclude(file='').iterator():
+                written += version.store_as_chunks()
+                count += 1
+            self.stderr.write(f'Chunked {count} versions ({written} new bytes) in {time.monotonic() - started:.2f}s.')
+
+        chains = {}
+        for media_id, name, size, chunks in versions.values_list('media_id', 'file', 'size', 'chunks').iterator():
+            chain = chains.setdefault(media_id, {'versions': 0, 'logical': 0, 'stored': {}})
+            chain['versions'] += 1
+            if chunks:
+                chain['logical'] += sum(chunk_size for _, chunk_size in chunks)
+                chain['stored'].update(chunks)
+            else:
+                size = size or FileVersion._meta.get_field('file').storage.size(name)
+                chain['logical'] += size
+                chain['stored'][name] = size
+
+        total_logical = total_stored = 0
+        for media_id, chain in chains.items():
+            stored = sum(chain['stored'].values())
+            total_logical += chain['logical']
+            total_stored += stored
+            row = {'media': media_id, 'versions': chain['versions'], 'logical_bytes': chain['logical'],
+                   'stored_bytes': stored, 'ratio': round(stored / chain['logical'], 3) if chain['logical'] else 1.0}
+            if options['format'] == 'json':
+                self.stdout.write(json.dumps(row))
+            else:
+                self.stdout.write(
+                    f"media {media_id}: {row['versions']} versions, {row['logical_bytes'] / 1048576:.1f} MB logical, "
+                    f"{row['stored_bytes'] / 1048576:.1f} MB stored ({row['ratio']:.0%})")
+        if options['format'] == 'text' and total_logical:
+            self.stdout.write(self.style.SUCCESS(
+                f'{len(chains)} chains: {total_logical / 1048576:.1f} MB logical, '
+                f'{total_stored / 1048576:.1f} MB stored ({total_stored / total_logical:.0%}).'))
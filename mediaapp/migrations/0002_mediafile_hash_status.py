@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+def mark_hashed_complete(apps, schema_editor):
+    MediaFile = apps.get_model('mediaapp', 'MediaFile')
+    MediaFile.objects.exclude(file_hash__isnull=True).exclude(file_hash='').update(hash_status='complete')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafile',
+            name='hash_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('complete', 'Complete'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.RunPython(mark_hashed_complete, migrations.RunPython.noop),
+    ]
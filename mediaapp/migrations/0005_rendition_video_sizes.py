@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0004_rendition'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rendition',
+            name='size',
+            field=models.CharField(choices=[('thumb', 'Thumbnail'), ('preview', 'Preview'), ('poster', 'Video poster frame'), ('proxy', 'Video streaming proxy')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0005_rendition_video_sizes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafile',
+            name='phash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='phash_0',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='phash_1',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='phash_2',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='phash_3',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:07
+
+import os
+
+import mediaapp.storage
+from django.db import migrations, models
+
+
+def fill_original_filenames(apps, schema_editor):
+    # existing files are still stored under their upload names
+    for model_name in ('MediaFile', 'FileVersion'):
+        model = apps.get_model('mediaapp', model_name)
+        rows = list(model.objects.only('id', 'file'))
+        for row in rows:
+            row.original_filename = os.path.basename(row.file.name)[:255]
+        model.objects.bulk_update(rows, ['original_filename'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0006_mediafile_phash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(db_index=True, default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fileversion',
+            name='original_filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='original_filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='fileversion',
+            name='file',
+            field=models.FileField(storage=mediaapp.storage.media_storage, upload_to='versions/%Y/%m/%d'),
+        ),
+        migrations.AlterField(
+            model_name='mediafile',
+            name='file',
+            field=models.FileField(storage=mediaapp.storage.media_storage, upload_to='uploads/%Y/%m/%d'),
+        ),
+        migrations.RunPython(fill_original_filenames, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:11
+
+import mediaapp.storage
+from django.db import migrations, models
+
+
+def number_versions(apps, schema_editor):
+    """Renumber chains that the old count()-based numbering gave duplicate numbers, and seed the counters."""
+    FileVersion = apps.get_model('mediaapp', 'FileVersion')
+    MediaFile = apps.get_model('mediaapp', 'MediaFile')
+    chains = {}
+    for version in FileVersion.objects.order_by('media_id', 'version_number', 'created_at', 'id'):
+        chains.setdefault(version.media_id, []).append(version)
+    renumbered = []
+    counters = []
+    for media_id, versions in chains.items():
+        numbers = [v.version_number for v in versions]
+        if len(set(numbers)) != len(numbers):
+            for number, version in enumerate(versions, start=1):
+                version.version_number = number
+            renumbered.extend(versions)
+        counters.append(MediaFile(id=media_id, version_counter=versions[-1].version_number))
+    FileVersion.objects.bulk_update(renumbered, ['version_number'], batch_size=1000)
+    MediaFile.objects.bulk_update(counters, ['version_counter'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0007_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileversion',
+            name='chunks',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='fileversion',
+            name='file_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='fileversion',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='version_counter',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='fileversion',
+            name='file',
+            field=models.FileField(blank=True, storage=mediaapp.storage.media_storage, upload_to='versions/%Y/%m/%d'),
+        ),
+        migrations.RunPython(number_versions, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='fileversion',
+            unique_together={('media', 'version_number')},
+        ),
+    ]
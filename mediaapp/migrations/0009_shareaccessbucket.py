@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0008_version_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShareAccessBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access_buckets', to='mediaapp.sharelink')),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'unique_together': {('link', 'bucket_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0009_shareaccessbucket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deletedfile',
+            name='expiry',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='deletedfile',
+            index=models.Index(fields=['-deleted_at', '-id'], name='vault_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediafile',
+            index=models.Index(fields=['project', 'is_deleted', '-created_at', '-id'], name='media_project_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediafile',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['-created_at', '-id'], name='media_live_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediafile',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['file_hash'], name='media_live_hash_idx'),
+        ),
+    ]
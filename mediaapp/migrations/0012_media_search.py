@@ -0,0 +1,57 @@
+import re
+
+from django.db import migrations
+
+SEARCH_TABLE = 'mediaapp_media_search'
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5 table on SQLite, tsvector + GIN on PostgreSQL (other databases search with LIKE); then fill it."""
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute(f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(document, tokenize='unicode61 remove_diacritics 2')")
+            except Exception:
+                return  # SQLite built without FTS5
+            insert = f'INSERT INTO {SEARCH_TABLE} (rowid, document) VALUES (%s, %s)'
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f'CREATE TABLE {SEARCH_TABLE} ('
+                f'media_id bigint PRIMARY KEY REFERENCES mediaapp_mediafile (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+                f'document tsvector NOT NULL)')
+            cursor.execute(f'CREATE INDEX {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)')
+            insert = f"INSERT INTO {SEARCH_TABLE} (media_id, document) VALUES (%s, to_tsvector('simple', %s))"
+        else:
+            return
+
+        MediaFile = apps.get_model('mediaapp', 'MediaFile')
+        rows = MediaFile.objects.values_list('id', 'original_filename', 'file', 'project__name',
+                                             'project__client__name', 'uploaded_by__username')
+        batch = []
+        for media_id, original_filename, name, project, client, uploader in rows.iterator():
+            text = ' '.join(part or '' for part in (original_filename or name.rsplit('/', 1)[-1], project, client, uploader))
+            batch.append((media_id, ' '.join(WORD_RE.findall(text.lower()))))
+            if len(batch) >= 500:
+                cursor.executemany(insert, batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0011_uploadbatch'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0012_media_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileversion',
+            name='rehydrated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fileversion',
+            name='storage_tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('warm', 'Warm'), ('cold', 'Cold')], default='hot', max_length=4),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='rehydrated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='storage_tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('warm', 'Warm'), ('cold', 'Cold')], default='hot', max_length=4),
+        ),
+        migrations.CreateModel(
+            name='StorageTierRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(blank=True, choices=[('raw', 'Raw'), ('edited', 'Edited'), ('final', 'Final')], max_length=10)),
+                ('min_age_days', models.PositiveIntegerField()),
+                ('tier', models.CharField(choices=[('hot', 'Hot'), ('warm', 'Warm'), ('cold', 'Cold')], max_length=4)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tier_rules', to='mediaapp.client')),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tier_rules', to='mediaapp.project')),
+            ],
+        ),
+    ]
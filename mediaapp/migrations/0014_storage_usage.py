@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0013_storage_tiers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='bytes_used',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='quota_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='vault_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='bytes_used',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='quota_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='vault_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
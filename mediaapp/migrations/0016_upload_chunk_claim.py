@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0015_image_transforms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='chunk_claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
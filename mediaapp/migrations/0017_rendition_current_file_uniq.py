@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:06
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def drop_duplicate_renditions(apps, schema_editor):
+    """Keep the newest of any renditions of the same current file and size rendered concurrently."""
+    Rendition = apps.get_model('mediaapp', 'Rendition')
+    current = Rendition.objects.filter(version__isnull=True)
+    for group in current.values('media_id', 'size').annotate(keep=Max('id')).order_by():
+        duplicates = current.filter(media_id=group['media_id'], size=group['size']).exclude(pk=group['keep'])
+        for name in duplicates.exclude(file='').values_list('file', flat=True):
+            default_storage.delete(name)
+        duplicates.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0016_upload_chunk_claim'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_renditions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rendition',
+            constraint=models.UniqueConstraint(condition=models.Q(('version__isnull', True)), fields=('media', 'size'), name='rendition_current_file_size_uniq'),
+        ),
+    ]
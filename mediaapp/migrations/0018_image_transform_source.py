@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0017_rendition_current_file_uniq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagetransform',
+            name='source',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
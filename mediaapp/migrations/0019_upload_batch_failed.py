@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0018_image_transform_source'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadbatch',
+            name='status',
+            field=models.CharField(choices=[('receiving', 'Receiving'), ('processing', 'Processing'), ('complete', 'Complete'), ('failed', 'Failed')], default='receiving', max_length=10),
+        ),
+    ]
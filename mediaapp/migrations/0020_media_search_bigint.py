@@ -0,0 +1,27 @@
+from django.db import migrations
+
+SEARCH_TABLE = 'mediaapp_media_search'
+
+
+def widen_media_id(apps, schema_editor):
+    """MediaFile ids are bigint; databases that ran 0012 before it said so have an integer column."""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s',
+                       [SEARCH_TABLE, 'media_id'])
+        row = cursor.fetchone()
+        if row is not None and row[0] == 'integer':
+            cursor.execute(f'ALTER TABLE {SEARCH_TABLE} ALTER COLUMN media_id TYPE bigint')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0019_upload_batch_failed'),
+    ]
+
+    operations = [
+        migrations.RunPython(widen_media_id, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediaapp', '0021_upload_session_finalizing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafile',
+            name='replaced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
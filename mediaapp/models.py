@@ -1,13 +1,24 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
+import os
 import uuid
-import hashlib
+
+from .deltas import ReconstructedFile, store_chunks
+from .share_access import record_share_access
+from .signals import media_restored, media_soft_deleted
+from .storage import adopt_stored_file, is_blob_name, media_storage
+from .storage_io import hash_object, open_object
 
 User = get_user_model()
 
 
+def hash_stored_file(name):
+    """SHA256 of a file already in storage (parallel ranged reads on S3)."""
+    return hash_object(name)
+
+
 def generate_share_token():
     return str(uuid.uuid4())
 
@@ -15,6 +26,10 @@ def generate_share_token():
 class Client(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='clients')
     name = models.CharField(max_length=255)
+    # running totals of file and version sizes (see usage.py); quota_bytes null means no limit
+    bytes_used = models.BigIntegerField(default=0)
+    vault_bytes = models.BigIntegerField(default=0)
+    quota_bytes = models.BigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -24,26 +39,85 @@ class Client(models.Model):
 class Project(models.Model):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='projects')
     name = models.CharField(max_length=255)
+    bytes_used = models.BigIntegerField(default=0)
+    vault_bytes = models.BigIntegerField(default=0)
+    quota_bytes = models.BigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.client.name} / {self.name}"
 
 
+class Blob(models.Model):
+    """One stored copy of some bytes, shared by every MediaFile and FileVersion with the same SHA256."""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0, db_index=True)  # 0 means unreferenced and awaiting collection
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} x{self.ref_count}"
+
+
 class MediaFile(models.Model):
     MEDIA_TYPES = (('image', 'Image'), ('video', 'Video'))
     STATUS_CHOICES = (('raw', 'Raw'), ('edited', 'Edited'), ('final', 'Final'))
+    HASH_STATUS_CHOICES = (('pending', 'Pending'), ('complete', 'Complete'), ('failed', 'Failed'))
+    TIER_CHOICES = (('hot', 'Hot'), ('warm', 'Warm'), ('cold', 'Cold'))
 
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='media')
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
-    file = models.FileField(upload_to='uploads/%Y/%m/%d')
+    file = models.FileField(upload_to='uploads/%Y/%m/%d', storage=media_storage)
+    original_filename = models.CharField(max_length=255, blank=True)  # blob names only carry the hash
+    size = models.BigIntegerField(default=0)  # bytes; 0 until known for files stored before it was recorded
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPES)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='raw')
     is_deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
     file_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)  # SHA256 for duplicate detection
+    hash_status = models.CharField(max_length=10, choices=HASH_STATUS_CHOICES, default='pending')
+    # 64-bit perceptual (difference) hash for near-duplicate detection, plus its four
+    # 16-bit bands, each indexed for multi-index Hamming search (see phash.py)
+    phash = models.BigIntegerField(null=True, blank=True)
+    phash_0 = models.IntegerField(null=True, blank=True, db_index=True)
+    phash_1 = models.IntegerField(null=True, blank=True, db_index=True)
+    phash_2 = models.IntegerField(null=True, blank=True, db_index=True)
+    phash_3 = models.IntegerField(null=True, blank=True, db_index=True)
+    version_counter = models.IntegerField(default=0)  # last FileVersion number handed out
+    upload_batch = models.ForeignKey('UploadBatch', on_delete=models.SET_NULL, null=True, blank=True, related_name='media')
+    # where the bytes live (see tiering.py); rehydrated_at restarts the age the tier rules look at
+    storage_tier = models.CharField(max_length=4, choices=TIER_CHOICES, default='hot')
+    rehydrated_at = models.DateTimeField(null=True, blank=True)
+    replaced_at = models.DateTimeField(null=True, blank=True)  # when an update last stored new bytes
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # a project's live files, newest first
+            models.Index(fields=['project', 'is_deleted', '-created_at', '-id'], name='media_project_live_idx'),
+            # the live-media listing and its keyset pagination
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_deleted=False),
+                         name='media_live_recent_idx'),
+            # exact-duplicate lookups only consider live files
+            models.Index(fields=['file_hash'], condition=models.Q(is_deleted=False), name='media_live_hash_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:
+            self.original_filename = os.path.basename(self.file.name)
+            self.size = self.file.size
+        super().save(*args, **kwargs)
+
+    @property
+    def display_name(self):
+        return self.original_filename or os.path.basename(self.file.name)
+
+    @property
+    def modified_at(self):
+        """When the current bytes were stored: the Last-Modified of downloads."""
+        return self.replaced_at or self.created_at
+
     def soft_delete(self, retention_days=60):
         if self.is_deleted:
             return
@@ -51,6 +125,7 @@ class MediaFile(models.Model):
         self.deleted_at = timezone.now()
         self.save(update_fields=['is_deleted', 'deleted_at'])
         DeletedFile.objects.create(media=self, expiry=self.deleted_at + timedelta(days=retention_days))
+        media_soft_deleted.send(sender=MediaFile, instance=self)
 
     def restore(self):
         if not self.is_deleted:
@@ -58,16 +133,32 @@ class MediaFile(models.Model):
         self.is_deleted = False
         self.deleted_at = None
         self.save(update_fields=['is_deleted', 'deleted_at'])
+        vault_entries, _ = DeletedFile.objects.filter(media=self).delete()
+        media_restored.send(sender=MediaFile, instance=self, vault_entries=vault_entries)
 
     def compute_file_hash(self):
         """Compute SHA256 hash of the file for duplicate detection."""
         if self.file:
-            sha256_hash = hashlib.sha256()
-            self.file.seek(0)
-            for byte_block in iter(lambda: self.file.read(4096), b''):
-                sha256_hash.update(byte_block)
-            self.file_hash = sha256_hash.hexdigest()
-            self.save(update_fields=['file_hash'])
+            self.file_hash = hash_stored_file(self.file.name)
+            self.hash_status = 'complete'
+            self.save(update_fields=['file_hash', 'hash_status'])
+
+    def next_version_number(self):
+        """Reserve the next version number; call inside the transaction that creates the version.
+
+        The UPDATE holds the row lock until commit, so concurrent uploads get distinct numbers.
+        """
+        MediaFile.objects.filter(pk=self.pk).update(version_counter=models.F('version_counter') + 1)
+        self.version_counter = MediaFile.objects.values_list('version_counter', flat=True).get(pk=self.pk)
+        return self.version_counter
+
+    def move_to_blob_store(self):
+        """Fold a file stored under its own name into the shared blob store."""
+        if not self.file_hash or not self.file or is_blob_name(self.file.name):
+            return
+        with transaction.atomic():
+            self.file.name = adopt_stored_file(self.file.name, self.file_hash)
+            self.save(update_fields=['file'])
 
     def __str__(self):
         return f"{self.project} - {self.file.name}"
@@ -76,7 +167,13 @@ class MediaFile(models.Model):
 class DeletedFile(models.Model):
     media = models.OneToOneField(MediaFile, on_delete=models.CASCADE, related_name='deleted_entry')
     deleted_at = models.DateTimeField(auto_now_add=True)
-    expiry = models.DateTimeField()
+    expiry = models.DateTimeField(db_index=True)  # the purge scans for expired entries
+
+    class Meta:
+        indexes = [
+            # the vault listing's keyset pagination
+            models.Index(fields=['-deleted_at', '-id'], name='vault_recent_idx'),
+        ]
 
     def is_expired(self):
         return timezone.now() >= self.expiry
@@ -86,21 +183,107 @@ class DeletedFile(models.Model):
 
 
 class FileVersion(models.Model):
-    """Track multiple versions of the same logical file."""
+    """Track multiple versions of the same logical file.
+
+    A new version is stored whole, then split into content-defined chunks shared
+    with earlier versions (see deltas.py); ``file`` is empty once ``chunks`` is set.
+    """
     media = models.ForeignKey(MediaFile, on_delete=models.CASCADE, related_name='versions')
-    file = models.FileField(upload_to='versions/%Y/%m/%d')
+    file = models.FileField(upload_to='versions/%Y/%m/%d', storage=media_storage, blank=True)
+    original_filename = models.CharField(max_length=255, blank=True)
+    file_hash = models.CharField(max_length=64, blank=True)
+    size = models.BigIntegerField(default=0)
+    chunks = models.JSONField(default=list, blank=True)  # [[blob name, size], ...] in file order
     version_number = models.IntegerField(default=1)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     note = models.CharField(max_length=255, blank=True)
+    storage_tier = models.CharField(max_length=4, choices=MediaFile.TIER_CHOICES, default='hot')  # chunked versions stay hot
+    rehydrated_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-version_number']
+        unique_together = ('media', 'version_number')
+
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:
+            self.original_filename = os.path.basename(self.file.name)
+        super().save(*args, **kwargs)
+
+    @property
+    def display_name(self):
+        return self.original_filename or os.path.basename(self.file.name)
+
+    @property
+    def content(self):
+        """The version's bytes: the stored file, or a lazy reassembly of its chunks."""
+        if self.chunks:
+            return ReconstructedFile(self.chunks, self.display_name, self.size)
+        return self.file
+
+    def store_as_chunks(self):
+        """Replace the whole stored file with chunks shared across versions; returns new bytes written."""
+        if self.chunks or not self.file:
+            return 0
+        with open_object(self.file.name) as fh:
+            manifest, digest, written = store_chunks(fh)
+        old_file = self.file.name
+        storage = self.file.storage
+        with transaction.atomic():
+            self.chunks = manifest
+            self.file_hash = digest
+            self.size = sum(size for _, size in manifest)
+            self.file = ''
+            self.save(update_fields=['chunks', 'file_hash', 'size', 'file'])
+            transaction.on_commit(lambda: storage.delete(old_file))
+        return written
 
     def __str__(self):
         return f"{self.media.file.name} v{self.version_number}"
 
 
+class Rendition(models.Model):
+    """A downscaled copy of a MediaFile (or one of its versions) used for grids and previews."""
+    SIZE_CHOICES = (('thumb', 'Thumbnail'), ('preview', 'Preview'),
+                    ('poster', 'Video poster frame'), ('proxy', 'Video streaming proxy'))
+
+    media = models.ForeignKey(MediaFile, on_delete=models.CASCADE, related_name='renditions')
+    version = models.ForeignKey(FileVersion, on_delete=models.CASCADE, null=True, blank=True, related_name='renditions')
+    size = models.CharField(max_length=10, choices=SIZE_CHOICES)
+    file = models.FileField(upload_to='renditions/%Y/%m/%d')
+    width = models.IntegerField(default=0)  # 0 when unknown (video proxies)
+    height = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    last_accessed = models.DateTimeField(default=timezone.now, db_index=True)  # drives LRU eviction
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('media', 'version', 'size')
+        constraints = [
+            # NULLs never collide in unique_together, so renditions of the current file need their own
+            models.UniqueConstraint(fields=['media', 'size'], condition=models.Q(version__isnull=True),
+                                    name='rendition_current_file_size_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.media.file.name} [{self.size}]"
+
+
+class ImageTransform(models.Model):
+    """A cached output of the transform endpoint, shared by every file with the same bytes (see transforms.py)."""
+    key = models.CharField(max_length=64, primary_key=True)  # SHA256 of the source's hash and the parameters
+    source = models.CharField(max_length=255, blank=True, db_index=True)  # source_key() it was rendered from
+    file = models.FileField(upload_to='transforms/')
+    width = models.IntegerField(default=0)
+    height = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    last_accessed = models.DateTimeField(default=timezone.now, db_index=True)  # drives LRU eviction
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.file.name
+
+
 class ShareLink(models.Model):
     PERMISSION_CHOICES = (('view', 'View Only'), ('download', 'Download'))
     
@@ -118,8 +301,117 @@ class ShareLink(models.Model):
         return True
 
     def record_access(self):
-        self.access_count += 1
-        self.save(update_fields=['access_count'])
+        """Count a public hit; buffered and added to access_count by the flush_share_access task."""
+        record_share_access(self.pk)
 
     def __str__(self):
         return f"Share: {self.media.file.name} ({self.token[:8]}...)"
+
+
+class ShareAccessBucket(models.Model):
+    """Hits on a share link within one SHARE_ACCESS_BUCKET_SECONDS window."""
+    link = models.ForeignKey(ShareLink, on_delete=models.CASCADE, related_name='access_buckets')
+    bucket_start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('link', 'bucket_start')
+        ordering = ['bucket_start']
+
+    def __str__(self):
+        return f"{self.link_id} @ {self.bucket_start:%Y-%m-%d %H:%M}: {self.count}"
+
+
+class UploadSession(models.Model):
+    """A resumable, chunked upload that is finalized into a MediaFile."""
+    STATUS_CHOICES = (('active', 'Active'), ('finalizing', 'Finalizing'), ('complete', 'Complete'),
+                      ('aborted', 'Aborted'))  # finalizing: claimed by one finalize request
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='upload_sessions')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    filename = models.CharField(max_length=255)
+    media_type = models.CharField(max_length=10, choices=MediaFile.MEDIA_TYPES)
+    media_status = models.CharField(max_length=10, choices=MediaFile.STATUS_CHOICES, default='raw')
+    total_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    storage_name = models.CharField(max_length=255, blank=True)  # where chunks are assembled, then the final name
+    s3_upload_id = models.CharField(max_length=255, blank=True)
+    parts = models.JSONField(default=list, blank=True)  # S3 multipart parts [{'PartNumber', 'ETag'}]
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
+    # set while one request writes the chunk at ``offset``, so a concurrent one cannot write it too
+    chunk_claimed_until = models.DateTimeField(null=True, blank=True)
+    media = models.OneToOneField(MediaFile, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_session')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def is_complete(self):
+        return self.offset >= self.total_size
+
+    def __str__(self):
+        return f"Upload {self.filename} ({self.offset}/{self.total_size})"
+
+
+class UploadBatch(models.Model):
+    """Many files uploaded at once (or an archive); their post-processing runs in parallel as a Celery group."""
+    STATUS_CHOICES = (('receiving', 'Receiving'), ('processing', 'Processing'), ('complete', 'Complete'),
+                      ('failed', 'Failed'))  # failed: receiving stopped on an error, see batch_uploads.ingest
+    MAX_ERRORS = 100
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='upload_batches')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    media_status = models.CharField(max_length=10, choices=MediaFile.STATUS_CHOICES, default='raw')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='receiving')
+    received = models.IntegerField(default=0)  # files stored and inserted
+    skipped = models.IntegerField(default=0)  # members not imported: not images or videos, or over quota
+    processed = models.IntegerField(default=0)  # files whose post-processing finished
+    failed = models.IntegerField(default=0)  # files whose post-processing raised
+    errors = models.JSONField(default=list, blank=True)  # [{'name', 'detail'}], the first MAX_ERRORS
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def progress(self):
+        if self.status == 'receiving':
+            return 0.0
+        return round((self.processed + self.failed) / self.received, 3) if self.received else 1.0
+
+    def mark_received(self):
+        """Receiving is over; complete at once if the workers already caught up."""
+        UploadBatch.objects.filter(pk=self.pk).update(status='processing', updated_at=timezone.now())
+        UploadBatch.complete_if_done(self.pk)
+        self.refresh_from_db()
+
+    @staticmethod
+    def record_processed(batch_id, ok=True):
+        counter = 'processed' if ok else 'failed'
+        UploadBatch.objects.filter(pk=batch_id).update(**{counter: models.F(counter) + 1, 'updated_at': timezone.now()})
+        UploadBatch.complete_if_done(batch_id)
+
+    @staticmethod
+    def complete_if_done(batch_id):
+        (UploadBatch.objects.filter(pk=batch_id, status='processing',
+                                    received__lte=models.F('processed') + models.F('failed'))
+         .update(status='complete', updated_at=timezone.now()))
+
+    def __str__(self):
+        return f"Batch {self.pk} ({self.received} files, {self.status})"
+
+
+class StorageTierRule(models.Model):
+    """Move files older than ``min_age_days`` (optionally only those with ``status``) to ``tier``.
+
+    Rules belong to a project, a client or (neither) everyone; a file follows the rules of the
+    most specific scope that has any, and of those the coldest that matches wins.
+    """
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, null=True, blank=True, related_name='tier_rules')
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True, blank=True, related_name='tier_rules')
+    status = models.CharField(max_length=10, choices=MediaFile.STATUS_CHOICES, blank=True)  # blank matches any
+    min_age_days = models.PositiveIntegerField()
+    tier = models.CharField(max_length=4, choices=MediaFile.TIER_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        scope = self.project or self.client or 'all files'
+        return f"{scope}: {self.status or 'any'} after {self.min_age_days}d -> {self.tier}"
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """Keyset pagination, newest first, with id as the tie-breaker."""
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class DeletedAtCursorPagination(CreatedAtCursorPagination):
+    ordering = ('-deleted_at', '-id')
@@ -0,0 +1,134 @@
+import io
+from itertools import combinations
+
+from django.db.models import Q
+from PIL import Image
+
+from .renditions import extract_frame
+
+# 64-bit difference hash, stored as a signed BIGINT plus four indexed 16-bit bands
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+# keeps the per-band probe lists small (radius 3: 697 values per band)
+MAX_SEARCH_DISTANCE = 15
+
+
+def dhash(img):
+    """Difference hash: compare adjacent pixels of a 9x8 greyscale thumbnail."""
+    img.draft('L', (64, 64))
+    small = img.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def to_signed(value):
+    return value - (1 << HASH_BITS) if value >= (1 << (HASH_BITS - 1)) else value
+
+
+def to_unsigned(value):
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def bands(value):
+    value = to_unsigned(value)
+    return [(value >> (i * BAND_BITS)) & BAND_MASK for i in range(BANDS)]
+
+
+def hamming(a, b):
+    return (to_unsigned(a) ^ to_unsigned(b)).bit_count()
+
+
+def band_neighbours(band, radius):
+    """All 16-bit values within ``radius`` bits of ``band``."""
+    values = [band]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), r):
+            flipped = band
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def candidates_q(value, max_distance):
+    """Multi-index hashing lookup.
+
+    If two hashes differ in at most ``max_distance`` bits, then by pigeonhole at
+    least one of the four bands differs in at most ``max_distance // 4`` bits, so
+    probing each band's index with its near neighbours finds every match
+    without scanning the table.
+    """
+    radius = max_distance // BANDS
+    q = Q()
+    for i, band in enumerate(bands(value)):
+        q |= Q(**{f'phash_{i}__in': band_neighbours(band, radius)})
+    return q
+
+
+def hash_image_file(fp):
+    return dhash(Image.open(fp))
+
+
+def compute_perceptual_hash(media):
+    """Hash an image, or a frame sampled from a video, and store it on the MediaFile."""
+    if media.media_type == 'video':
+        value = hash_image_file(io.BytesIO(extract_frame(media.file)))
+    else:
+        media.file.open('rb')
+        try:
+            value = hash_image_file(media.file)
+        finally:
+            media.file.close()
+    media.phash = to_signed(value)
+    for i, band in enumerate(bands(value)):
+        setattr(media, f'phash_{i}', band)
+    media.save(update_fields=['phash', 'phash_0', 'phash_1', 'phash_2', 'phash_3'])
+    return value
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance for whole-library clustering."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        node = [value, [item], {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value, radius):
+        """Yield (item, distance) for every stored hash within ``radius`` bits."""
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                for item in items:
+                    yield item, distance
+            # triangle inequality: only subtrees in [d - r, d + r] can hold matches
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
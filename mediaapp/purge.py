@@ -0,0 +1,113 @@
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .caching import adjust_counts, bump_listing
+from .models import Blob, DeletedFile, FileVersion, MediaFile, Rendition
+from .search import remove_media as remove_from_search
+from .storage import is_blob_name, release_blobs
+from .storage_io import delete_objects
+from .usage import tracking_usage
+
+
+def purge_batch(media_ids, workers, now):
+    """Remove the stored files and database rows for one batch of expired media.
+
+    The rows are claimed first: only files still deleted with a vault entry expired at
+    ``now`` are purged, and the claim's write makes a concurrent restore wait for this
+    transaction. Storage goes before the rows: if the process dies in between, the rows
+    are still there and the next run deletes the (already missing) files again harmlessly.
+    Shared blobs are only released here; collect_orphan_blobs removes the ones nothing
+    references any more. Returns (purged, files removed, files kept for a retry).
+    """
+    expired = {'is_deleted': True, 'deleted_entry__expiry__lte': now}
+    with transaction.atomic():
+        # a restore that got in first cleared is_deleted (and the vault entry)
+        claimed = list(MediaFile.objects.select_for_update().filter(id__in=media_ids, **expired)
+                       .values_list('id', flat=True))
+        # claim with a write: it takes the row locks (the database lock on SQLite) for the whole purge
+        MediaFile.objects.filter(id__in=claimed).update(is_deleted=True)
+
+        files_by_media = defaultdict(list)
+        blobs_by_media = defaultdict(list)
+        for media_id, name in MediaFile.objects.filter(id__in=claimed).values_list('id', 'file'):
+            (blobs_by_media if is_blob_name(name) else files_by_media)[media_id].append(name)
+        for model in (FileVersion, Rendition):
+            for media_id, name in model.objects.filter(media_id__in=claimed).values_list('media_id', 'file'):
+                (blobs_by_media if is_blob_name(name) else files_by_media)[media_id].append(name)
+        versions = FileVersion.objects.filter(media_id__in=claimed).exclude(chunks=[])
+        for media_id, chunks in versions.values_list('media_id', 'chunks'):
+            blobs_by_media[media_id].extend(name for name, _ in chunks)
+
+        all_names = [name for names in files_by_media.values() for name in names]
+        failed = delete_objects(all_names, workers)
+        # keep rows whose files could not be removed so a later run retries them
+        purgeable = [media_id for media_id in claimed
+                     if not failed.intersection(files_by_media.get(media_id, []))]
+
+        vault_entries = (DeletedFile.objects.filter(media_id__in=purgeable).order_by()
+                         .values_list('media__project__client__owner_id').annotate(count=Count('id')))
+        for owner_id, count in vault_entries:
+            adjust_counts(owner_id, deleted=-count)
+        # one set-based delete; cascades to DeletedFile, FileVersion, ShareLink and Rendition rows
+        with tracking_usage(purgeable):
+            MediaFile.objects.filter(id__in=purgeable, **expired).delete()
+        remove_from_search(purgeable)
+        bump_listing('projects')
+        release_blobs([name for media_id in purgeable for name in blobs_by_media.get(media_id, [])])
+    return len(purgeable), len(all_names) - len(failed), len(claimed) - len(purgeable)
+
+
+def collect_orphan_blobs(batch_size=1000, workers=8):
+    """Delete the bytes and rows of blobs nothing references any more; returns (removed, failed)."""
+    removed = failed = 0
+    while True:
+        with transaction.atomic():
+            digests = list(Blob.objects.select_for_update().filter(ref_count__lte=0)
+                           .values_list('sha256', flat=True)[:batch_size])
+            if not digests:
+                break
+            # claim with a write before touching storage: it takes the row locks (the
+            # database lock on SQLite), so an upload re-referencing one of these blobs
+            # waits for this transaction rather than racing the delete
+            Blob.objects.filter(pk__in=digests, ref_count__lte=0).update(ref_count=-1)
+            claimed = dict(Blob.objects.filter(pk__in=digests, ref_count=-1).values_list('sha256', 'name'))
+            failed_names = delete_objects(list(claimed.values()), workers)
+            Blob.objects.filter(pk__in=[d for d, name in claimed.items() if name not in failed_names]).delete()
+            # back to 0 so the next run retries them
+            Blob.objects.filter(pk__in=[d for d, name in claimed.items() if name in failed_names]).update(ref_count=0)
+        removed += len(claimed) - len(failed_names)
+        failed += len(failed_names)
+        if failed_names or len(digests) < batch_size:
+            break
+    return removed, failed
+
+
+def purge_expired(batch_size=500, workers=8, now=None):
+    """Permanently delete expired Recovery Vault entries in keyset-paginated batches."""
+    now = now or timezone.now()
+    started = time.monotonic()
+    last_id = 0
+    stats = {'deleted': 0, 'files_removed': 0, 'failed': 0, 'batches': 0}
+    while True:
+        batch = list(
+            DeletedFile.objects.filter(expiry__lte=now, id__gt=last_id)
+            .order_by('id').values_list('id', 'media_id')[:batch_size]
+        )
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        deleted, files_removed, failed = purge_batch([media_id for _, media_id in batch], workers, now)
+        stats['deleted'] += deleted
+        stats['files_removed'] += files_removed
+        stats['failed'] += failed
+        stats['batches'] += 1
+
+    stats['blobs_removed'], stats['blobs_failed'] = collect_orphan_blobs(workers=workers)
+    elapsed = time.monotonic() - started
+    stats['seconds'] = round(elapsed, 3)
+    stats['per_second'] = round(stats['deleted'] / elapsed, 1) if elapsed else 0.0
+    return stats
@@ -0,0 +1,91 @@
+"""Keep the cached dashboard counters, listing fragments and share links (see caching.py), the
+search index (see search.py) and the storage totals (see usage.py) in step with writes."""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import adjust_counts, bump_listing, invalidate_counts, invalidate_share, owner_of_project
+from .models import Client, DeletedFile, FileVersion, MediaFile, Project, ShareLink
+from .search import index_media, index_related
+from .signals import media_restored, media_soft_deleted
+from .usage import adjust_usage, media_bytes
+
+# MediaFile fields that feed the search index
+SEARCH_FIELDS = {'file', 'original_filename', 'project', 'uploaded_by'}
+
+
+@receiver(post_save, sender=Client)
+def client_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_counts(instance.owner_id, clients=1)
+    else:
+        index_related(project__client=instance)
+    bump_listing('media', 'projects')
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_counts(owner_of_project(instance.pk), projects=1)
+    else:
+        index_related(project=instance)
+    bump_listing('media', 'projects')
+
+
+@receiver(post_delete, sender=Client)
+def client_deleted(sender, instance, **kwargs):
+    # the cascade takes projects and media with it, so recount rather than adjust
+    invalidate_counts([instance.owner_id])
+    bump_listing('media', 'projects')
+
+
+@receiver(post_delete, sender=Project)
+def project_deleted(sender, instance, **kwargs):
+    invalidate_counts([Client.objects.filter(pk=instance.client_id).values_list('owner_id', flat=True).first()])
+    bump_listing('media', 'projects')
+
+
+@receiver(post_save, sender=MediaFile)
+def media_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or SEARCH_FIELDS.intersection(update_fields):
+        index_media([instance.pk])
+    if created:
+        if not instance.is_deleted:
+            adjust_counts(owner_of_project(instance.project_id), media=1)
+        adjust_usage({instance.project_id: (0, instance.size) if instance.is_deleted else (instance.size, 0)})
+        bump_listing('media', 'projects')
+    else:
+        bump_listing('media')
+
+
+@receiver(post_save, sender=FileVersion)
+def version_saved(sender, instance, created, **kwargs):
+    if created:
+        project_id, is_deleted = MediaFile.objects.values_list('project_id', 'is_deleted').get(pk=instance.media_id)
+        adjust_usage({project_id: (0, instance.size) if is_deleted else (instance.size, 0)})
+
+
+@receiver(media_soft_deleted)
+def media_moved_to_vault(sender, instance, **kwargs):
+    adjust_counts(owner_of_project(instance.project_id), media=-1)
+    size = media_bytes(instance.pk)
+    adjust_usage({instance.project_id: (-size, size)})
+
+
+@receiver(media_restored)
+def media_restored_from_vault(sender, instance, vault_entries=0, **kwargs):
+    adjust_counts(owner_of_project(instance.project_id), media=1, deleted=-vault_entries)
+    size = media_bytes(instance.pk)
+    adjust_usage({instance.project_id: (size, -size)})
+
+
+@receiver(post_save, sender=DeletedFile)
+def vault_entry_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_counts(owner_of_project(instance.media.project_id), deleted=1)
+
+
+@receiver(post_save, sender=ShareLink)
+@receiver(post_delete, sender=ShareLink)
+def share_link_changed(sender, instance, **kwargs):
+    invalidate_share(instance.token)
@@ -0,0 +1,200 @@
+import io
+import os
+import subprocess
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Rendition
+
+# last_accessed is only rewritten when older than this, so cache hits rarely write
+TOUCH_INTERVAL = timedelta(hours=1)
+
+# renditions that only exist for videos, on top of the RENDITION_SIZES stills
+VIDEO_SIZES = ('poster', 'proxy')
+
+
+def available_sizes(media_type):
+    sizes = list(settings.RENDITION_SIZES)
+    if media_type == 'video':
+        sizes += VIDEO_SIZES
+    return sizes
+
+
+def render_image(fp, max_edge):
+    """Downscale an image to fit ``max_edge`` and return (jpeg bytes, width, height)."""
+    img = Image.open(fp)
+    # JPEG draft mode decodes at 1/2, 1/4 or 1/8 scale, far cheaper than a full decode
+    img.draft('RGB', (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=3.0)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=settings.RENDITION_QUALITY, optimize=True, progressive=True)
+    return out.getvalue(), img.width, img.height
+
+
+def run_ffmpeg(*args):
+    subprocess.run(
+        [settings.FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y', *args],
+        check=True, timeout=settings.FFMPEG_TIMEOUT,
+    )
+
+
+def source_location(field_file):
+    """A path ffmpeg can read: the local file, or the (presigned) URL for remote storage."""
+    try:
+        return field_file.path
+    except NotImplementedError:
+        return field_file.url
+
+
+def extract_frame(source):
+    """Grab one full-resolution JPEG frame from a video, a little way in to skip black leaders."""
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'frame.jpg')
+        for offset in (settings.VIDEO_POSTER_OFFSET, 0):
+            run_ffmpeg('-ss', str(offset), '-i', source_location(source), '-frames:v', '1', '-q:v', '2', out)
+            # seeking past the end of a short clip produces no frame; retry from the start
+            if os.path.exists(out) and os.path.getsize(out):
+                with open(out, 'rb') as fh:
+                    return fh.read()
+    raise ValueError(f'could not extract a frame from {source.name}')
+
+
+def transcode_proxy(source, out_path):
+    """Encode a low-bitrate H.264 proxy with the moov atom up front, so playback starts at once."""
+    run_ffmpeg(
+        '-i', source_location(source),
+        '-vf', f"scale=-2:'min({settings.VIDEO_PROXY_HEIGHT},ih)'",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(settings.VIDEO_PROXY_CRF),
+        '-maxrate', settings.VIDEO_PROXY_MAXRATE, '-bufsize', settings.VIDEO_PROXY_BUFSIZE,
+        '-c:a', 'aac', '-b:a', '96k',
+        '-movflags', '+faststart',
+        out_path,
+    )
+
+
+def save_rendition(media, version, size, content, ext, width=0, height=0):
+    """Store a rendition, unless a concurrent request or worker stored the same one first."""
+    rendition = Rendition.objects.filter(media=media, version=version, size=size).first()
+    if rendition is not None and rendition.file:
+        return rendition
+    if rendition is None:
+        rendition = Rendition(media=media, version=version, size=size)
+    name = f"{media.pk}_{version.pk if version else 0}_{size}.{ext}"
+    rendition.bytes = content.size
+    rendition.file.save(name, content, save=False)
+    rendition.width = width
+    rendition.height = height
+    rendition.last_accessed = timezone.now()
+    try:
+        with transaction.atomic():
+            rendition.save()
+    except IntegrityError:
+        # a concurrent request stored this rendition first: keep its copy
+        rendition.file.delete(save=False)
+        return Rendition.objects.get(media=media, version=version, size=size)
+    return rendition
+
+
+def still_edge(size):
+    if size == 'poster':
+        return settings.VIDEO_POSTER_SIZE
+    return settings.RENDITION_SIZES[size]
+
+
+def generate_rendition(media, size, version=None):
+    """Render one rendition and store it."""
+    source = version.content if version else media.file
+    if size == 'proxy':
+        return generate_proxy(media, version)
+    if media.media_type == 'video':
+        content, width, height = render_image(io.BytesIO(extract_frame(source)), still_edge(size))
+    else:
+        source.open('rb')
+        try:
+            content, width, height = render_image(source, still_edge(size))
+        finally:
+            source.close()
+    return save_rendition(media, version, size, ContentFile(content), 'jpg', width, height)
+
+
+def generate_proxy(media, version=None):
+    source = version.content if version else media.file
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'proxy.mp4')
+        transcode_proxy(source, out)
+        with open(out, 'rb') as fh:
+            return save_rendition(media, version, 'proxy', File(fh), 'mp4')
+
+
+def generate_all_renditions(media, version=None):
+    """Render every rendition for a file, decoding the source only once per kind of output."""
+    source = version.content if version else media.file
+    if media.media_type == 'video':
+        frame = extract_frame(source)
+        stills = {size: render_image(io.BytesIO(frame), still_edge(size))
+                  for size in list(settings.RENDITION_SIZES) + ['poster']}
+    else:
+        stills = {}
+        for size in settings.RENDITION_SIZES:
+            source.open('rb')
+            try:
+                stills[size] = render_image(source, still_edge(size))
+            finally:
+                source.close()
+    generated = [save_rendition(media, version, size, ContentFile(content), 'jpg', width, height)
+                 for size, (content, width, height) in stills.items()]
+    if media.media_type == 'video':
+        generated.append(generate_proxy(media, version))
+    return generated
+
+
+def get_rendition(media, size, version=None, generate=True):
+    """Return a stored rendition, regenerating it if it is missing or was evicted.
+
+    With ``generate=False`` a miss returns None instead of rendering inline.
+    """
+    rendition = Rendition.objects.filter(media=media, version=version, size=size).first()
+    if rendition is None or not rendition.file:
+        return generate_rendition(media, size, version) if generate else None
+    now = timezone.now()
+    if now - rendition.last_accessed > TOUCH_INTERVAL:
+        Rendition.objects.filter(pk=rendition.pk).update(last_accessed=now)
+    return rendition
+
+
+def drop_renditions(media):
+    """Delete the renditions of a file's current bytes, e.g. before they are replaced."""
+    for rendition in Rendition.objects.filter(media=media, version__isnull=True):
+        if rendition.file:
+            transaction.on_commit(lambda file=rendition.file: file.delete(save=False))
+        rendition.delete()
+
+
+def evict_renditions(max_bytes=None):
+    """Delete least-recently-used renditions until the total size fits the budget."""
+    if max_bytes is None:
+        max_bytes = settings.RENDITION_CACHE_MAX_BYTES
+    total = Rendition.objects.aggregate(total=Sum('bytes'))['total'] or 0
+    evicted = freed = 0
+    if total <= max_bytes:
+        return {'evicted': 0, 'freed_bytes': 0, 'total_bytes': total}
+    for rendition in Rendition.objects.order_by('last_accessed').iterator():
+        if total - freed <= max_bytes:
+            break
+        if rendition.file:
+            rendition.file.delete(save=False)
+        rendition.delete()
+        freed += rendition.bytes
+        evicted += 1
+    return {'evicted': evicted, 'freed_bytes': freed, 'total_bytes': total - freed}
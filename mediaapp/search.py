@@ -0,0 +1,163 @@
+"""Full-text and faceted search over media.
+
+The searchable text of each file (its name, project, client and uploader) lives in
+SEARCH_TABLE, keyed by MediaFile id: an FTS5 table on SQLite, a tsvector column with a
+GIN index on PostgreSQL. Other databases, or SQLite built without FTS5, fall back to
+LIKE over the joined columns. Rows are written by the receivers and by the bulk paths
+(index_media), and can be rebuilt with ``manage.py rebuild_search_index``.
+"""
+import re
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.expressions import RawSQL
+
+from .models import MediaFile
+
+SEARCH_TABLE = 'mediaapp_media_search'
+INDEX_BATCH_SIZE = 500
+MAX_QUERY_TERMS = 10
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def words(text):
+    """Letters and digits only, so IMG_2041.jpg is found by "img", "2041" or "jpg" on every backend."""
+    return WORD_RE.findall((text or '').lower())
+
+
+def document_text(name, project, client, uploader):
+    return ' '.join(words(' '.join(part or '' for part in (name, project, client, uploader))))
+
+
+_backends = {}
+
+
+def backend():
+    """'postgresql', 'sqlite' (FTS5) or None (LIKE fallback) for the default database."""
+    key = (connection.vendor, connection.settings_dict['NAME'])
+    if key not in _backends:
+        if connection.vendor == 'postgresql':
+            _backends[key] = 'postgresql'
+        elif connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names():
+            _backends[key] = 'sqlite'
+        else:
+            return None  # not cached: the table may not have been migrated yet
+    return _backends[key]
+
+
+def document_rows(media_ids):
+    rows = (MediaFile.objects.filter(pk__in=media_ids)
+            .values_list('id', 'original_filename', 'file', 'project__name', 'project__client__name',
+                         'uploaded_by__username'))
+    for media_id, original_filename, name, project, client, uploader in rows:
+        name = original_filename or name.rsplit('/', 1)[-1]
+        yield media_id, document_text(name, project, client, uploader)
+
+
+def index_media(media_ids):
+    """(Re)write the search rows of these files; call inside the transaction that changed them."""
+    engine = backend()
+    if engine is None:
+        return
+    media_ids = list(media_ids)
+    for i in range(0, len(media_ids), INDEX_BATCH_SIZE):
+        rows = list(document_rows(media_ids[i:i + INDEX_BATCH_SIZE]))
+        if not rows:
+            continue
+        with connection.cursor() as cursor:
+            if engine == 'sqlite':
+                # FTS5 has no upsert
+                cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(rows))})",
+                               [media_id for media_id, _ in rows])
+                cursor.executemany(f'INSERT INTO {SEARCH_TABLE} (rowid, document) VALUES (%s, %s)', rows)
+            else:
+                cursor.executemany(
+                    f"INSERT INTO {SEARCH_TABLE} (media_id, document) VALUES (%s, to_tsvector('simple', %s)) "
+                    f"ON CONFLICT (media_id) DO UPDATE SET document = EXCLUDED.document", rows)
+
+
+def index_related(**filters):
+    """Reindex every file matching ``filters``, e.g. after a project or client is renamed."""
+    index_media(MediaFile.objects.filter(**filters).values_list('pk', flat=True))
+
+
+def remove_media(media_ids):
+    # PostgreSQL rows go with their MediaFile (ON DELETE CASCADE); FTS5 tables have no foreign keys
+    if backend() != 'sqlite':
+        return
+    media_ids = list(media_ids)
+    with connection.cursor() as cursor:
+        for i in range(0, len(media_ids), INDEX_BATCH_SIZE):
+            batch = media_ids[i:i + INDEX_BATCH_SIZE]
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(batch))})", batch)
+
+
+def rebuild():
+    """Rewrite the whole index; returns the number of files indexed."""
+    engine = backend()
+    if engine is None:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+    media_ids = list(MediaFile.objects.order_by('pk').values_list('pk', flat=True))
+    index_media(media_ids)
+    return len(media_ids)
+
+
+def text_q(text):
+    """Files whose name, project, client or uploader contain words starting with each word of ``text``."""
+    terms = words(text)[:MAX_QUERY_TERMS]
+    if not terms:
+        return Q()
+    engine = backend()
+    if engine == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return Q(pk__in=RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match]))
+    if engine == 'postgresql':
+        query = ' & '.join(f'{term}:*' for term in terms)
+        return Q(pk__in=RawSQL(f"SELECT media_id FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('simple', %s)", [query]))
+    q = Q()
+    for term in terms:
+        q &= (Q(original_filename__icontains=term) | Q(file__icontains=term) | Q(project__name__icontains=term)
+              | Q(project__client__name__icontains=term) | Q(uploaded_by__username__icontains=term))
+    return q
+
+
+def search_media(q='', client=None, project=None, status=None, media_type=None, uploaded_by=None,
+                 created_after=None, created_before=None):
+    """Live files matching the search text and every given filter, newest first."""
+    media = MediaFile.objects.filter(is_deleted=False).filter(text_q(q))
+    filters = {
+        'project__client_id': client, 'project_id': project, 'status': status, 'media_type': media_type,
+        'uploaded_by_id': uploaded_by, 'created_at__gte': created_after, 'created_at__lt': created_before,
+    }
+    media = media.filter(**{lookup: value for lookup, value in filters.items() if value not in (None, '')})
+    return media.order_by('-created_at', '-id')
+
+
+def facet_counts(media):
+    """Counts per status, media type, client and project over ``media``, from one grouped query."""
+    rows = (media.order_by()
+            .values('status', 'media_type', 'project_id', 'project__name', 'project__client_id', 'project__client__name')
+            .annotate(count=Count('id')))
+    statuses, media_types, projects, clients = Counter(), Counter(), Counter(), Counter()
+    names = {}
+    total = 0
+    for row in rows:
+        count = row['count']
+        total += count
+        statuses[row['status']] += count
+        media_types[row['media_type']] += count
+        projects[row['project_id']] += count
+        clients[row['project__client_id']] += count
+        names[('project', row['project_id'])] = row['project__name']
+        names[('client', row['project__client_id'])] = row['project__client__name']
+    return {
+        'total': total,
+        'status': dict(statuses),
+        'media_type': dict(media_types),
+        'client': [{'id': pk, 'name': names[('client', pk)], 'count': n} for pk, n in clients.most_common()],
+        'project': [{'id': pk, 'name': names[('project', pk)], 'count': n} for pk, n in projects.most_common()],
+    }
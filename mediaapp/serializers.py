@@ -1,24 +1,52 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import models
+from django.urls import reverse
+from django.utils.http import urlencode
 from rest_framework import serializers
-from .models import Client, Project, MediaFile, DeletedFile, FileVersion, ShareLink
+from .renditions import available_sizes
+from .transforms import CROP_PATTERN, FORMATS, format_available
+from .models import (Client, Project, MediaFile, DeletedFile, FileVersion, ShareLink, StorageTierRule, UploadBatch,
+                     UploadSession)
 
 
 class ClientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Client
-        fields = ['id', 'name', 'created_at']
+        fields = ['id', 'name', 'bytes_used', 'vault_bytes', 'quota_bytes', 'created_at']
+        read_only_fields = ['bytes_used', 'vault_bytes']
 
 
 class ProjectSerializer(serializers.ModelSerializer):
     class Meta:
         model = Project
-        fields = ['id', 'client', 'name', 'created_at']
+        fields = ['id', 'client', 'name', 'bytes_used', 'vault_bytes', 'quota_bytes', 'created_at']
+        read_only_fields = ['bytes_used', 'vault_bytes']
 
 
 class FileVersionSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
     class Meta:
         model = FileVersion
-        fields = ['id', 'media', 'file', 'version_number', 'created_by', 'note', 'created_at']
-        read_only_fields = ['version_number', 'created_at']
+        fields = ['id', 'media', 'file', 'original_filename', 'download_url', 'file_hash', 'size',
+                  'version_number', 'created_by', 'note', 'created_at']
+        read_only_fields = ['original_filename', 'file_hash', 'size', 'version_number', 'created_at']
+        # version_number is allocated atomically on save, not checked up front
+        validators = []
+
+    def get_download_url(self, obj):
+        url = reverse('mediafile-download', args=[obj.media_id]) + '?' + urlencode({'version': obj.id})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # chunked versions have no single stored file; point older clients at the download
+        if not data.get('file'):
+            data['file'] = data['download_url']
+        return data
 
 
 class ShareLinkSerializer(serializers.ModelSerializer):
@@ -33,23 +61,107 @@ class ShareLinkSerializer(serializers.ModelSerializer):
         return obj.is_valid()
 
 
-class MediaFileSerializer(serializers.ModelSerializer):
+def build_duplicate_groups(media_items):
+    """Map each file_hash on a page to its non-deleted files, in a single query."""
+    hashes = {m.file_hash for m in media_items if m is not None and m.file_hash}
+    groups = defaultdict(list)
+    if hashes:
+        rows = MediaFile.objects.filter(file_hash__in=hashes, is_deleted=False).values_list('file_hash', 'id', 'file')
+        for file_hash, media_id, name in rows:
+            groups[file_hash].append({'id': media_id, 'file': name})
+    return groups
+
+
+class DuplicateGroupsListSerializer(serializers.ListSerializer):
+    """Resolve duplicate groups for the whole page up front instead of once per row."""
+
+    def get_media_items(self, items):
+        return items
+
+    def wants_duplicates(self):
+        return 'duplicates' in self.child.fields
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if self.wants_duplicates():
+            self.context['duplicate_groups'] = build_duplicate_groups(self.get_media_items(items))
+        return super().to_representation(items)
+
+
+class SparseFieldsMixin:
+    """Trim GET responses with ``?fields=a,b`` and ``?expand=nested,...``.
+
+    ``fields`` keeps only the listed fields. ``expand`` lists which of the
+    serializer's ``expandable_fields`` (nested data) to include; an empty
+    ``expand=`` drops all of them.
+    """
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        params = request.query_params
+        expand = params.get('expand')
+        expanded = {name for name in (expand or '').split(',') if name}
+        if params.get('fields'):
+            allowed = {name for name in params['fields'].split(',') if name} | expanded
+            for name in set(self.fields) - allowed:
+                self.fields.pop(name)
+        if expand is not None:
+            for name in self.expandable_fields:
+                if name not in expanded:
+                    self.fields.pop(name, None)
+
+
+class MediaFileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = ('versions', 'share_links', 'duplicates')
     versions = FileVersionSerializer(many=True, read_only=True)
     share_links = ShareLinkSerializer(many=True, read_only=True)
     duplicates = serializers.SerializerMethodField()
+    renditions = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
 
     class Meta:
         model = MediaFile
-        fields = ['id', 'project', 'uploaded_by', 'file', 'media_type', 'status', 'is_deleted', 'file_hash', 'versions', 'share_links', 'duplicates', 'created_at']
-        read_only_fields = ['is_deleted', 'file_hash', 'created_at']
+        fields = ['id', 'project', 'uploaded_by', 'file', 'original_filename', 'download_url', 'size', 'media_type', 'status', 'storage_tier', 'is_deleted', 'file_hash', 'hash_status', 'renditions', 'versions', 'share_links', 'duplicates', 'created_at']
+        read_only_fields = ['original_filename', 'size', 'storage_tier', 'is_deleted', 'file_hash', 'hash_status', 'created_at']
+        list_serializer_class = DuplicateGroupsListSerializer
 
     def get_duplicates(self, obj):
         """Find exact duplicates (same file_hash)."""
         if not obj.file_hash:
             return []
+        groups = self.context.get('duplicate_groups')
+        if groups is not None:
+            return [d for d in groups.get(obj.file_hash, []) if d['id'] != obj.id]
         duplicates = MediaFile.objects.filter(file_hash=obj.file_hash, is_deleted=False).exclude(id=obj.id)
         return [{'id': d.id, 'file': d.file.name} for d in duplicates]
 
+    def get_download_url(self, obj):
+        """Streaming download with Range and ETag (file_hash) support."""
+        url = reverse('mediafile-download', args=[obj.id])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_renditions(self, obj):
+        """URLs of the renditions: stills for every file, plus poster and proxy for videos."""
+        request = self.context.get('request')
+        urls = {}
+        for size in available_sizes(obj.media_type):
+            url = reverse('media_rendition', args=[obj.id, size])
+            urls[size] = request.build_absolute_uri(url) if request else url
+        return urls
+
+
+class DeletedFileListSerializer(DuplicateGroupsListSerializer):
+    def get_media_items(self, items):
+        return [entry.media for entry in items]
+
+    def wants_duplicates(self):
+        return 'media' in self.child.fields
+
 
 class DeletedFileSerializer(serializers.ModelSerializer):
     media = MediaFileSerializer(read_only=True)
@@ -57,3 +169,134 @@ class DeletedFileSerializer(serializers.ModelSerializer):
     class Meta:
         model = DeletedFile
         fields = ['id', 'media', 'deleted_at', 'expiry']
+        list_serializer_class = DeletedFileListSerializer
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'project', 'filename', 'media_type', 'media_status', 'total_size', 'offset', 'status', 'media', 'created_at']
+        read_only_fields = ['offset', 'status', 'media', 'created_at']
+
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('total_size must be positive')
+        return value
+
+
+class UploadBatchSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = UploadBatch
+        fields = ['id', 'project', 'media_status', 'status', 'received', 'skipped', 'processed', 'failed',
+                  'progress', 'errors', 'created_at', 'updated_at']
+        read_only_fields = ['status', 'received', 'skipped', 'processed', 'failed', 'errors', 'created_at', 'updated_at']
+
+
+class StorageTierRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StorageTierRule
+        fields = ['id', 'client', 'project', 'status', 'min_age_days', 'tier', 'created_at']
+        read_only_fields = ['created_at']
+
+    def validate(self, attrs):
+        scope = {field: attrs.get(field, getattr(self.instance, field, None)) for field in ('client', 'project')}
+        if scope['client'] and scope['project']:
+            raise serializers.ValidationError('A rule applies to a client or a project, not both.')
+        return attrs
+
+
+class BulkFilterSerializer(serializers.Serializer):
+    """The ``filter`` of a bulk request: files matching every given field (see bulk.FILTER_FIELDS)."""
+    project = serializers.IntegerField(required=False)
+    client = serializers.IntegerField(required=False)
+    status = serializers.ChoiceField(choices=MediaFile.STATUS_CHOICES, required=False)
+    media_type = serializers.ChoiceField(choices=MediaFile.MEDIA_TYPES, required=False)
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict):
+            unknown = set(data) - set(self.fields)
+            if unknown:
+                raise serializers.ValidationError(f"unknown filter fields: {', '.join(sorted(unknown))}")
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError('give at least one filter field')
+        return attrs
+
+
+class BulkMediaSerializer(serializers.Serializer):
+    """Select files for a bulk operation by ``ids`` or by ``filter`` (project, client, status, media_type)."""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    filter = BulkFilterSerializer(required=False)
+
+    def validate_ids(self, value):
+        if len(value) > settings.BULK_MAX_ITEMS:
+            raise serializers.ValidationError(f'at most {settings.BULK_MAX_ITEMS} ids per request')
+        return list(dict.fromkeys(value))
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError('give either ids or filter')
+        return attrs
+
+
+class BulkDeleteSerializer(BulkMediaSerializer):
+    retention_days = serializers.IntegerField(min_value=1, default=60)
+
+
+class BulkStatusSerializer(BulkMediaSerializer):
+    status = serializers.ChoiceField(choices=MediaFile.STATUS_CHOICES)
+
+
+class BulkMoveSerializer(BulkMediaSerializer):
+    project = serializers.PrimaryKeyRelatedField(queryset=Project.objects.select_related('client'))
+
+
+class BulkShareSerializer(BulkMediaSerializer):
+    permission = serializers.ChoiceField(choices=ShareLink.PERMISSION_CHOICES, default='view')
+    expires_in_days = serializers.IntegerField(min_value=0, default=7)
+
+
+class MediaSearchSerializer(serializers.Serializer):
+    """Query parameters of the media search: free text plus exact filters."""
+    q = serializers.CharField(required=False, allow_blank=True, max_length=200)
+    client = serializers.IntegerField(required=False)
+    project = serializers.IntegerField(required=False)
+    status = serializers.ChoiceField(choices=MediaFile.STATUS_CHOICES, required=False)
+    media_type = serializers.ChoiceField(choices=MediaFile.MEDIA_TYPES, required=False)
+    uploaded_by = serializers.IntegerField(required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+
+class DuplicateSearchSerializer(serializers.Serializer):
+    """Query parameters of a file's duplicate lookup."""
+    max_distance = serializers.IntegerField(min_value=0, default=settings.NEAR_DUPLICATE_MAX_DISTANCE)
+
+
+class ImageTransformSerializer(serializers.Serializer):
+    """Parameters of an image transform (see transforms.py): output size, crop, format and quality."""
+    w = serializers.IntegerField(required=False, min_value=1, max_value=settings.TRANSFORM_MAX_EDGE)
+    h = serializers.IntegerField(required=False, min_value=1, max_value=settings.TRANSFORM_MAX_EDGE)
+    fit = serializers.ChoiceField(choices=['contain', 'cover'], default='contain')
+    crop = serializers.RegexField(CROP_PATTERN, required=False,
+                                  error_messages={'invalid': 'crop must be "x,y,width,height" in pixels'})
+    fmt = serializers.ChoiceField(choices=list(FORMATS), default='jpeg')
+    q = serializers.IntegerField(min_value=1, max_value=100, default=settings.RENDITION_QUALITY)
+    version = serializers.IntegerField(required=False)
+    # for URLs handed out through share links: they stop working with the link, and at its expiry (unix time)
+    token = serializers.CharField(required=False, max_length=64)
+    expires = serializers.IntegerField(required=False)
+
+    def validate_crop(self, value):
+        if 0 in map(int, value.split(',')[2:]):
+            raise serializers.ValidationError('crop width and height must be positive')
+        return value
+
+    def validate_fmt(self, value):
+        if not format_available(value):
+            raise serializers.ValidationError(f'{value} output is not available on this server')
+        return value
@@ -0,0 +1,155 @@
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+PENDING_KEY = 'share-access:pending'
+FLUSHING_PREFIX = 'share-access:flushing:'
+
+
+def bucket_start(ts):
+    """Start (epoch seconds) of the SHARE_ACCESS_BUCKET_SECONDS bucket containing ``ts``."""
+    return int(ts) // settings.SHARE_ACCESS_BUCKET_SECONDS * settings.SHARE_ACCESS_BUCKET_SECONDS
+
+
+class LocalAccessBuffer:
+    """Counts hits in process memory; each process writes its own counts back every flush interval.
+
+    Enough for a single web process (development); with several processes use Redis so the
+    beat task sees every hit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = Counter()
+        self._last_flush = time.monotonic()
+
+    def record(self, link_id, ts):
+        with self._lock:
+            self._hits[(link_id, bucket_start(ts))] += 1
+            due = time.monotonic() - self._last_flush >= settings.SHARE_ACCESS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            hits, self._hits = self._hits, Counter()
+            self._last_flush = time.monotonic()
+        try:
+            write_hits(hits)
+        except Exception:
+            with self._lock:
+                self._hits.update(hits)  # keep them for the next flush
+            raise
+        return sum(hits.values())
+
+
+class RedisAccessBuffer:
+    """Counts hits with HINCRBY in one Redis hash shared by every web process.
+
+    A flush renames the hash away (atomic), so hits that arrive meanwhile start a new one;
+    a renamed hash is only deleted after its counts are committed, and is retried otherwise.
+    """
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    def record(self, link_id, ts):
+        self._redis.hincrby(PENDING_KEY, f'{link_id}:{bucket_start(ts)}', 1)
+
+    def flush(self):
+        import redis
+
+        try:
+            self._redis.rename(PENDING_KEY, f'{FLUSHING_PREFIX}{uuid.uuid4().hex}')
+        except redis.ResponseError:
+            pass  # no hits since the last flush
+        flushed = 0
+        # one flusher at a time, or two could both count a renamed hash
+        with self._redis.lock('share-access:flush-lock', timeout=settings.SHARE_ACCESS_FLUSH_INTERVAL * 5):
+            for key in self._redis.scan_iter(match=f'{FLUSHING_PREFIX}*'):
+                hits = Counter()
+                for field, count in self._redis.hgetall(key).items():
+                    link_id, start = field.decode().split(':')
+                    hits[(int(link_id), int(start))] += int(count)
+                write_hits(hits)
+                self._redis.delete(key)
+                flushed += sum(hits.values())
+        return flushed
+
+
+def write_hits(hits):
+    """Add buffered ``{(link_id, bucket_start): hits}`` to ShareLink.access_count and the access log.
+
+    One UPDATE per distinct increment and one per existing bucket row; new buckets are
+    bulk-inserted. Hits for links deleted since are dropped.
+    """
+    if not hits:
+        return
+    ShareLink = apps.get_model('mediaapp', 'ShareLink')
+    ShareAccessBucket = apps.get_model('mediaapp', 'ShareAccessBucket')
+    live = set(ShareLink.objects.filter(pk__in={link_id for link_id, _ in hits}).values_list('pk', flat=True))
+    hits = {(link_id, datetime.fromtimestamp(start, dt_timezone.utc)): count
+            for (link_id, start), count in hits.items() if link_id in live}
+    if not hits:
+        return
+
+    totals = Counter()
+    for (link_id, _), count in hits.items():
+        totals[link_id] += count
+    with transaction.atomic():
+        for delta, link_ids in group_by_delta(totals).items():
+            ShareLink.objects.filter(pk__in=link_ids).update(access_count=F('access_count') + delta)
+
+        existing = Counter()
+        rows = ShareAccessBucket.objects.filter(
+            link_id__in=totals, bucket_start__gte=min(start for _, start in hits),
+        ).values_list('pk', 'link_id', 'bucket_start')
+        for bucket_id, link_id, start in rows.iterator():
+            if (link_id, start) in hits:
+                existing[bucket_id] = hits.pop((link_id, start))
+        for delta, bucket_ids in group_by_delta(existing).items():
+            ShareAccessBucket.objects.filter(pk__in=bucket_ids).update(count=F('count') + delta)
+        ShareAccessBucket.objects.bulk_create(
+            [ShareAccessBucket(link_id=link_id, bucket_start=start, count=count)
+             for (link_id, start), count in hits.items()],
+            batch_size=500,
+        )
+
+
+def group_by_delta(counts):
+    groups = defaultdict(list)
+    for key, delta in counts.items():
+        groups[delta].append(key)
+    return groups
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_access_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            if settings.SHARE_ACCESS_BUFFER == 'redis':
+                _buffer = RedisAccessBuffer(settings.SHARE_ACCESS_REDIS_URL)
+            else:
+                _buffer = LocalAccessBuffer()
+        return _buffer
+
+
+def record_share_access(link_id):
+    get_access_buffer().record(link_id, time.time())
+
+
+def flush_share_access():
+    """Write buffered hits to the database; returns how many were written."""
+    return get_access_buffer().flush()
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# sent by MediaFile.soft_delete() and restore(); restore also passes vault_entries,
+# the number of DeletedFile rows it removed
+media_soft_deleted = Signal()
+media_restored = Signal()
@@ -0,0 +1,239 @@
+import hashlib
+import os
+import shutil
+import uuid
+from collections import Counter, defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, Storage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils._os import safe_join
+
+from .storage_io import copy_object, upload_object
+
+BLOB_PREFIX = 'blobs/'
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+STORAGE_TIERS = ('hot', 'warm', 'cold')
+
+
+def blob_model():
+    # looked up lazily: MediaFile's storage is created while mediaapp.models is still importing
+    return apps.get_model('mediaapp', 'Blob')
+
+
+def blob_name(digest, ext=''):
+    """Storage name for a blob, fanned out over two directory levels; the extension keeps content types guessable."""
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+
+
+def is_blob_name(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+def hash_content(content):
+    sha256_hash = hashlib.sha256()
+    for block in content.chunks(HASH_BLOCK_SIZE):
+        sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+
+def write_blob(name, content):
+    """Write ``content`` to exactly ``name``, replacing any previous (identical) bytes."""
+    if settings.USE_S3:
+        # S3 overwrites keys in place, so the object lands at ``name``
+        upload_object(name, content)
+        return
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if hasattr(content, 'temporary_file_path'):
+        # large uploads are already on disk: move them into place instead of copying
+        file_move_safe(content.temporary_file_path(), path, allow_overwrite=True)
+    else:
+        # write beside the target and rename, so concurrent writers of the same blob never expose a partial file
+        tmp_path = os.path.join(os.path.dirname(path), f'.tmp-{uuid.uuid4().hex}')
+        try:
+            with open(tmp_path, 'xb') as fh:
+                for block in content.chunks():
+                    fh.write(block)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    if default_storage.file_permissions_mode is not None:
+        os.chmod(path, default_storage.file_permissions_mode)
+
+
+def copy_stored_object(source, target):
+    """Copy a stored file to ``target`` without streaming it through this process."""
+    if settings.USE_S3:
+        copy_object(source, target)
+        return
+    path = default_storage.path(target)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(path), f'.tmp-{uuid.uuid4().hex}')
+    try:
+        # a hard link shares the inode, so no bytes are copied on the same filesystem
+        os.link(default_storage.path(source), tmp_path)
+    except OSError:
+        shutil.copyfile(default_storage.path(source), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def reference_blob(digest, ext, size, put):
+    """Take one reference on the blob for ``digest``, calling ``put(name)`` only if its bytes are not stored yet.
+
+    Returns (blob name, whether ``put`` ran). The row lock orders this against
+    purge.collect_orphan_blobs, which claims orphans before deleting their bytes.
+    """
+    Blob = blob_model()
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=digest).first()
+        # an orphan (ref_count 0) may already have lost its bytes to an interrupted collection
+        if blob is not None and (blob.ref_count > 0 or default_storage.exists(blob.name)):
+            Blob.objects.filter(pk=digest).update(ref_count=F('ref_count') + 1)
+            return blob.name, False
+        name = blob.name if blob is not None else blob_name(digest, ext)
+        put(name)
+        if blob is None:
+            try:
+                with transaction.atomic():
+                    Blob.objects.create(sha256=digest, name=name, size=size, ref_count=1)
+                return name, True
+            except IntegrityError:
+                # a concurrent upload of the same bytes created the row first
+                pass
+        Blob.objects.filter(pk=digest).update(ref_count=F('ref_count') + 1)
+        return name, True
+
+
+def store_blob(content, digest=None, ext=''):
+    """Store ``content`` once per SHA256 and return the shared blob name."""
+    digest = digest or hash_content(content)
+    name, _ = reference_blob(digest, ext, content.size, lambda target: write_blob(target, content))
+    return name
+
+
+def adopt_stored_file(name, digest):
+    """Fold a file stored under its own name into the blob store and return the blob name.
+
+    Call this inside the transaction that repoints the row at the returned name;
+    the original file is only deleted once that transaction commits.
+    """
+    if is_blob_name(name):
+        return name
+    target, _ = reference_blob(digest, os.path.splitext(name)[1], default_storage.size(name),
+                               lambda target: copy_stored_object(name, target))
+    transaction.on_commit(lambda: default_storage.delete(name))
+    return target
+
+
+def release_blobs(names):
+    """Drop one reference per occurrence of each blob name; unreferenced blobs wait for collect_orphan_blobs."""
+    Blob = blob_model()
+    by_count = defaultdict(list)
+    for name, count in Counter(name for name in names if is_blob_name(name)).items():
+        by_count[count].append(name)
+    # one UPDATE per distinct decrement, which is almost always just one
+    for count, blob_names in by_count.items():
+        Blob.objects.filter(name__in=blob_names).update(ref_count=Greatest(F('ref_count') - count, 0))
+
+
+class TieredFileSystemStorage(FileSystemStorage):
+    """Local storage with one directory per tier: MEDIA_ROOT is hot, STORAGE_TIER_ROOTS hold warm and cold.
+
+    A name resolves to whichever directory holds it, so opening, sizing and deleting a file work
+    wherever tiering.py moved it, and names never change. New files are written to hot.
+    """
+
+    def tier_path(self, name, tier):
+        if tier == 'hot':
+            return super().path(name)
+        return safe_join(settings.STORAGE_TIER_ROOTS[tier], name)
+
+    def tier(self, name):
+        """The tier holding ``name``, or None if no tier does."""
+        for tier in STORAGE_TIERS:
+            if os.path.lexists(self.tier_path(name, tier)):
+                return tier
+        return None
+
+    def path(self, name):
+        return self.tier_path(name, self.tier(name) or 'hot')
+
+
+def tier_of(name):
+    """The tier a local file is in; always 'hot' unless the default storage is tiered."""
+    tier = getattr(default_storage, 'tier', None)
+    return (tier(name) or 'hot') if tier else 'hot'
+
+
+class ContentAddressedStorage(Storage):
+    """Stores MediaFile and FileVersion bytes once per SHA256, shared by every row that references them.
+
+    Saving returns the blob's name, so a duplicate upload costs neither space nor a
+    write. Deleting only drops a reference. Names outside blobs/ (files stored before
+    the switch) are read straight from the default storage.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        # the hashing upload handlers already digested the upload while it streamed in
+        return store_blob(content, getattr(content, 'sha256', None), os.path.splitext(name)[1])
+
+    def delete(self, name):
+        if is_blob_name(name):
+            release_blobs([name])
+        else:
+            default_storage.delete(name)
+
+    def _open(self, name, mode='rb'):
+        return default_storage.open(name, mode)
+
+    def exists(self, name):
+        return default_storage.exists(name)
+
+    def size(self, name):
+        return default_storage.size(name)
+
+    def url(self, name, *args, **kwargs):
+        return default_storage.url(name, *args, **kwargs)
+
+    def path(self, name):
+        return default_storage.path(name)
+
+    def listdir(self, path):
+        return default_storage.listdir(path)
+
+    def get_accessed_time(self, name):
+        return default_storage.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return default_storage.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return default_storage.get_modified_time(name)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        # backend specifics (bucket_name, connection, ...) come from the default storage
+        return getattr(default_storage, attr)
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+def media_storage():
+    """Storage for MediaFile and FileVersion bytes (see CONTENT_ADDRESSED_STORAGE)."""
+    if settings.CONTENT_ADDRESSED_STORAGE:
+        return content_addressed_storage
+    return default_storage
@@ -0,0 +1,227 @@
+"""Whole-object and batch storage I/O, shared by the models, tasks and the purge.
+
+Local storage goes straight to the filesystem, with threads for batches. On S3 every thread
+shares one boto3 client per process, its connection pool sized by S3_MAX_POOL_CONNECTIONS
+(django-storages opens a session per thread, and downloads a whole object to a temporary file
+before the first read). Objects are read with parallel ranged GETs of S3_TRANSFER_PART_SIZE,
+written with multipart PUTs, checked with parallel HEADs and deleted with DeleteObjects.
+"""
+import hashlib
+import io
+import itertools
+import mimetypes
+import os
+import shutil
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+READ_BLOCK_SIZE = 8 * 1024 * 1024
+# S3 DeleteObjects accepts at most 1,000 keys per request
+S3_DELETE_BATCH = 1000
+
+_clients = {}
+
+
+def s3_client():
+    """The process's S3 client: botocore clients are thread-safe, but must not cross a fork."""
+    client = _clients.get(os.getpid())
+    if client is None:
+        storage = default_storage
+        client = storage._create_session().client(
+            's3', region_name=storage.region_name, use_ssl=storage.use_ssl, endpoint_url=storage.endpoint_url,
+            config=storage.client_config, verify=storage.verify)
+        _clients[os.getpid()] = client
+    return client
+
+
+def s3_key(name):
+    from storages.utils import clean_name
+    return default_storage._normalize_name(clean_name(name))
+
+
+def in_parallel(function, items, workers):
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(function, items))
+
+
+def iter_object(name, block_size=READ_BLOCK_SIZE):
+    """The bytes of a stored file, in order; on S3, up to S3_TRANSFER_CONCURRENCY ranges are fetched at once."""
+    if not settings.USE_S3:
+        with default_storage.open(name, 'rb') as fh:
+            yield from iter(lambda: fh.read(block_size), b'')
+        return
+    client, bucket, key = s3_client(), default_storage.bucket_name, s3_key(name)
+    size = client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    part = settings.S3_TRANSFER_PART_SIZE
+
+    def fetch(start):
+        end = min(start + part, size) - 1
+        return client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}')['Body'].read()
+
+    # a bounded window of ranges in flight: memory stays at concurrency x part size
+    starts = iter(range(0, size, part))
+    with ThreadPoolExecutor(max_workers=settings.S3_TRANSFER_CONCURRENCY) as pool:
+        window = deque(pool.submit(fetch, start) for start in itertools.islice(starts, settings.S3_TRANSFER_CONCURRENCY))
+        while window:
+            block = window.popleft().result()
+            start = next(starts, None)
+            if start is not None:
+                window.append(pool.submit(fetch, start))
+            yield block
+
+
+class ObjectReader(io.RawIOBase):
+    """Read-only file object over iter_object, for code that wants ``read(n)``."""
+
+    def __init__(self, name):
+        self.blocks = iter_object(name)
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self.buffer:
+            block = next(self.blocks, None)
+            if block is None:
+                return 0
+            self.buffer = block
+        n = min(len(target), len(self.buffer))
+        target[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+    def close(self):
+        self.blocks.close()
+        super().close()
+
+
+def open_object(name):
+    return io.BufferedReader(ObjectReader(name), READ_BLOCK_SIZE)
+
+
+def hash_object(name):
+    """SHA256 hex digest of a stored file."""
+    sha256_hash = hashlib.sha256()
+    for block in iter_object(name):
+        sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+
+def upload_object(name, content):
+    """Write ``content`` to the S3 key for ``name`` (multipart past S3_TRANSFER_PART_SIZE), overwriting it."""
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    extra = {'ContentType': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+    s3_client().upload_fileobj(content, default_storage.bucket_name, s3_key(name), ExtraArgs=extra,
+                               Config=default_storage.transfer_config)
+
+
+def copy_object(source, target):
+    """Server-side S3 copy (multipart for large objects)."""
+    bucket = default_storage.bucket_name
+    s3_client().copy({'Bucket': bucket, 'Key': s3_key(source)}, bucket, s3_key(target),
+                     Config=default_storage.transfer_config)
+
+
+def set_object_tier(name, tier):
+    """Move a stored file to ``tier`` under the same name; returns the bytes moved (0 if it was already there).
+
+    Locally the file moves to that tier's directory; on S3 the object is copied onto itself
+    with the tier's storage class (STORAGE_TIER_S3_CLASSES).
+    """
+    if settings.USE_S3:
+        client, bucket, key = s3_client(), default_storage.bucket_name, s3_key(name)
+        head = client.head_object(Bucket=bucket, Key=key)
+        storage_class = settings.STORAGE_TIER_S3_CLASSES[tier]
+        if head.get('StorageClass', 'STANDARD') == storage_class:
+            return 0
+        client.copy({'Bucket': bucket, 'Key': key}, bucket, key, Config=default_storage.transfer_config,
+                    ExtraArgs={'StorageClass': storage_class, 'MetadataDirective': 'COPY'})
+        return head['ContentLength']
+    source = default_storage.path(name)
+    target = default_storage.tier_path(name, tier)
+    size = os.path.getsize(source)
+    if source == target:
+        return 0
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # tiers are usually separate filesystems: copy beside the target, rename, then drop the source
+    tmp_path = os.path.join(os.path.dirname(target), f'.tmp-{uuid.uuid4().hex}')
+    try:
+        shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.remove(source)
+    return size
+
+
+def object_sizes(names, workers=8):
+    """``{name: size}`` for the names that exist in storage; missing files are left out."""
+    if settings.USE_S3:
+        client, bucket = s3_client(), default_storage.bucket_name
+
+        def size(name):
+            try:
+                return client.head_object(Bucket=bucket, Key=s3_key(name))['ContentLength']
+            except client.exceptions.ClientError as e:
+                if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                    return None
+                raise
+    else:
+        def size(name):
+            try:
+                return os.path.getsize(default_storage.path(name))
+            except FileNotFoundError:
+                return None
+
+    names = list(dict.fromkeys(name for name in names if name))
+    workers = min(workers, settings.S3_MAX_POOL_CONNECTIONS) if settings.USE_S3 else workers
+    return {name: n for name, n in zip(names, in_parallel(size, names, workers)) if n is not None}
+
+
+def existing_objects(names, workers=8):
+    """The subset of ``names`` present in storage."""
+    return set(object_sizes(names, workers))
+
+
+def delete_local_objects(names, workers):
+    def delete(name):
+        try:
+            default_storage.delete(name)  # a missing file is not an error
+            return None
+        except OSError:
+            return name
+
+    return {name for name in in_parallel(delete, names, workers) if name}
+
+
+def delete_s3_objects(names):
+    client = s3_client()
+    keys = {s3_key(name): name for name in names}
+    failed = set()
+    key_list = list(keys)
+    for i in range(0, len(key_list), S3_DELETE_BATCH):
+        chunk = key_list[i:i + S3_DELETE_BATCH]
+        response = client.delete_objects(
+            Bucket=default_storage.bucket_name,
+            Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True},
+        )
+        failed.update(keys[error['Key']] for error in response.get('Errors', []))
+    return failed
+
+
+def delete_objects(names, workers=8):
+    """Delete stored files (DeleteObjects batches on S3, concurrent unlinks locally); returns the names that failed."""
+    names = [name for name in names if name]
+    if not names:
+        return set()
+    if settings.USE_S3:
+        return delete_s3_objects(names)
+    return delete_local_objects(names, workers)
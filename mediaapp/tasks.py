@@ -1,24 +1,162 @@
-from celery import shared_task
+import logging
+from datetime import timedelta
+from celery import chain, shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
-from .models import DeletedFile, MediaFile
+from .models import MediaFile, FileVersion, UploadBatch, UploadSession
+from .purge import purge_expired
+from .chunked_uploads import get_chunk_store, forget_running_hash
+from . import renditions, tiering, transforms
+from .phash import compute_perceptual_hash as compute_phash
+from .share_access import flush_share_access as flush_access_buffer
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
-def cleanup_expired_deleted_files():
+def cleanup_expired_deleted_files(batch_size=500, workers=8):
     """Permanently delete expired DeletedFile entries and remove underlying files."""
-    now = timezone.now()
-    expired = DeletedFile.objects.filter(expiry__lte=now)
-    deleted_count = 0
-    for entry in expired:
-        media = entry.media
-        # delete file from storage
+    return purge_expired(batch_size=batch_size, workers=workers)
+
+
+@shared_task
+def compute_media_hash(media_id):
+    """Hash a stored media file in the background and record the result."""
+    media = MediaFile.objects.filter(pk=media_id).first()
+    if media is None:
+        return {'hashed': False}
+    try:
+        media.compute_file_hash()
+    except Exception:
+        MediaFile.objects.filter(pk=media_id).update(hash_status='failed')
+        raise
+    if settings.CONTENT_ADDRESSED_STORAGE:
+        media.move_to_blob_store()
+    return {'hashed': True, 'file_hash': media.file_hash}
+
+
+@shared_task
+def cleanup_stale_upload_sessions(max_age_hours=48):
+    """Abort resumable uploads that have not received a chunk recently."""
+    cutoff = timezone.now() - timedelta(hours=max_age_hours)
+    store = get_chunk_store()
+    aborted = failed = 0
+    for session in UploadSession.objects.filter(status='active', updated_at__lt=cutoff):
+        try:
+            store.abort(session)
+        except Exception:
+            # left active, so the next run tries again
+            logger.exception('Aborting stale upload session %s failed', session.pk)
+            failed += 1
+            continue
+        forget_running_hash(session)
+        session.status = 'aborted'
+        session.save(update_fields=['status', 'updated_at'])
+        aborted += 1
+    return {'aborted': aborted, 'failed': failed}
+
+
+@shared_task
+def generate_renditions(media_id, version_id=None):
+    """Render thumbnails and previews (plus poster frame and proxy for videos) after an upload."""
+    media = MediaFile.objects.filter(pk=media_id).first()
+    if media is None:
+        return {'generated': 0}
+    version = FileVersion.objects.filter(pk=version_id).first() if version_id else None
+    generated = renditions.generate_all_renditions(media, version)
+    return {'generated': len(generated)}
+
+
+@shared_task
+def evict_renditions():
+    """Keep rendition storage under RENDITION_CACHE_MAX_BYTES by evicting the least recently used."""
+    return renditions.evict_renditions()
+
+
+@shared_task
+def evict_transforms():
+    """Keep transform storage under TRANSFORM_CACHE_MAX_BYTES by evicting the least recently used."""
+    return transforms.evict_transforms()
+
+
+@shared_task
+def process_batch_item(batch_id, media_id):
+    """Post-process one file of an upload batch and count it towards the batch's progress."""
+    media = MediaFile.objects.filter(pk=media_id).first()
+    ok = media is not None
+    if ok:
         try:
-            storage = media.file.storage
-            if media.file.name and storage.exists(media.file.name):
-                storage.delete(media.file.name)
+            if media.hash_status != 'complete':
+                compute_media_hash(media_id)
+            generate_renditions(media_id)
+            compute_perceptual_hash(media_id)
         except Exception:
-            pass
-        # delete media row (cascades to DeletedFile)
-        media.delete()
-        deleted_count += 1
-    return {'deleted': deleted_count}
+            logger.exception('Post-processing media %s of upload batch %s failed', media_id, batch_id)
+            ok = False
+    UploadBatch.record_processed(batch_id, ok)
+    return {'processed': ok}
+
+
+@shared_task
+def flush_share_access():
+    """Write buffered public share-link hits to access_count and the per-link access log."""
+    return {'flushed': flush_access_buffer()}
+
+
+@shared_task
+def compute_perceptual_hash(media_id):
+    """Compute the near-duplicate fingerprint of an image (or a video frame)."""
+    media = MediaFile.objects.filter(pk=media_id).first()
+    if media is None:
+        return {'hashed': False}
+    compute_phash(media)
+    return {'hashed': True, 'phash': media.phash}
+
+
+@shared_task
+def store_version_delta(version_id):
+    """Re-store a new version as content-defined chunks shared with earlier versions."""
+    version = FileVersion.objects.filter(pk=version_id).first()
+    if version is None:
+        return {'written': 0}
+    written = version.store_as_chunks()
+    return {'written': written, 'size': version.size}
+
+
+def process_new_version(media_id, version_id):
+    """Chunk a new version, then render its previews.
+
+    In that order, so a version whose previews cannot be rendered is still chunked,
+    and rendering never reads a whole file that the chunking is about to delete.
+    """
+    if settings.VERSION_DELTA_STORAGE:
+        chain(store_version_delta.si(version_id), generate_renditions.si(media_id, version_id)).delay()
+    else:
+        generate_renditions.delay(media_id, version_id)
+
+
+@shared_task
+def apply_storage_tiers(dry_run=False):
+    """Move media between the hot, warm and cold tiers according to the StorageTierRules."""
+    return tiering.apply_tier_policy(dry_run=dry_run)
+
+
+@shared_task
+def rehydrate_file(name):
+    """Bring a stored file back to the hot tier after it was read from a colder one."""
+    return {'name': name, 'bytes_moved': tiering.rehydrate(name)}
+
+
+def rehydrate_on_access(obj):
+    """Queue rehydrate_file for a MediaFile or FileVersion being read from warm or cold storage.
+
+    Queued at most once per STORAGE_TIER_REHYDRATE_DEBOUNCE seconds per file; the read itself
+    is served from where the file is.
+    """
+    if obj.storage_tier == 'hot' or not obj.file:
+        return
+    name = obj.file.name
+    if cache.add(f'rehydrate:{name}', 1, settings.STORAGE_TIER_REHYDRATE_DEBOUNCE):
+        transaction.on_commit(lambda: rehydrate_file.delay(name))
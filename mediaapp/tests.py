@@ -0,0 +1,1122 @@
+"""Query counts of the API: a page or a detail response costs the same number of queries however
+many rows (or nested versions, share links and duplicates) it carries, so an N+1 regression in a
+viewset or serializer fails here. Then the write paths that must keep derived state in step:
+dashboard counters, the share cache and buffered share access counts, bulk operations, batch and
+resumable uploads, the hash backfill, the vault purge, version deltas, storage tiers, file
+replacement and share-issued transforms; and storage_io against moto's S3 (skipped when moto is
+not installed).
+
+Run with ``python manage.py test mediaapp``.
+"""
+import base64
+import hashlib
+import io
+import itertools
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto is only needed for the S3 tests
+    mock_aws = None
+
+from mediaapp import storage_io, transforms
+from mediaapp.batch_uploads import ARCHIVE_ERRORS, SNIFF_BYTES, ingest, iter_tar, sniff_media_type, store_member
+from mediaapp.caching import count_from_db, get_counts
+from mediaapp.chunked_uploads import S3_MIN_PART_SIZE, get_chunk_store
+from mediaapp.deltas import iter_chunks
+from mediaapp.exports import export_entries
+from mediaapp.management.commands import find_duplicates
+from mediaapp.models import (Blob, Client, DeletedFile, FileVersion, ImageTransform, MediaFile, Project, Rendition,
+                             ShareAccessBucket, ShareLink, StorageTierRule, UploadBatch, UploadSession)
+from mediaapp.purge import purge_batch, purge_expired
+from mediaapp.serializers import ImageTransformSerializer
+from mediaapp.share_access import LocalAccessBuffer, flush_share_access
+from mediaapp.tasks import cleanup_stale_upload_sessions
+from mediaapp.tiering import apply_tier_policy
+
+# the router is mounted under the app's own api/ prefix (see picha_yangu/urls.py)
+API = '/api/api/'
+
+
+class QueryCountTestCase(APITestCase):
+    serial = itertools.count()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='owner')
+        cls.owner = Client.objects.create(owner=cls.user, name='Client')
+        cls.project = Project.objects.create(client=cls.owner, name='Project')
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url)
+        return len(queries)
+
+    def assertConstantQueries(self, url, add_rows, few=2, many=10):
+        """``url`` costs as many queries after ``add_rows(many)`` as after ``add_rows(few)``."""
+        add_rows(few)
+        expected = self.count_queries(url)
+        add_rows(many - few)
+        with self.assertNumQueries(expected):
+            return self.get(url)
+
+    def add_media(self, count, media_type='image', duplicate_of=None, **fields):
+        """Files with two versions and two share links each; with ``duplicate_of``, copies of its hash."""
+        created = []
+        for _ in range(count):
+            n = next(self.serial)
+            media = MediaFile.objects.create(
+                project=self.project, file=f'uploads/test/{n}.jpg', media_type=media_type,
+                file_hash=duplicate_of.file_hash if duplicate_of else f'{n:064x}', hash_status='complete', **fields)
+            self.add_versions(media, 2)
+            self.add_shares(media, 2)
+            created.append(media)
+        return created
+
+    def add_versions(self, media, count):
+        for _ in range(count):
+            n = next(self.serial)
+            FileVersion.objects.create(media=media, file=f'versions/test/{n}.jpg', file_hash=f'{n:064x}',
+                                       version_number=media.next_version_number(), created_by=self.user)
+
+    def add_shares(self, media, count):
+        for _ in range(count):
+            ShareLink.objects.create(media=media, created_by=self.user)
+
+
+class ListQueryCountTests(QueryCountTestCase):
+    def test_clients(self):
+        self.assertConstantQueries(API + 'clients/', lambda n: [
+            Client.objects.create(owner=self.user, name=f'Client {i}') for i in range(n)])
+
+    def test_projects(self):
+        self.assertConstantQueries(API + 'projects/', lambda n: [
+            Project.objects.create(client=self.owner, name=f'Project {i}') for i in range(n)])
+
+    def test_media(self):
+        response = self.assertConstantQueries(API + 'media/', self.add_media)
+        self.assertEqual(len(response.json()['results']), 10)
+        self.assertEqual(len(response.json()['results'][0]['versions']), 2)
+
+    def test_media_sparse_fields(self):
+        for query in ('?fields=id,file', '?fields=id,versions', '?expand=', '?expand=versions',
+                      '?expand=share_links,duplicates', '?fields=id,status&expand=duplicates'):
+            with self.subTest(query=query):
+                MediaFile.objects.all().delete()
+                self.assertConstantQueries(API + 'media/' + query, self.add_media)
+
+    def test_media_nested_relations_load_only_when_included(self):
+        self.add_media(3)
+        everything = self.count_queries(API + 'media/')
+        # versions, share links and the duplicate groups are one query each
+        self.assertEqual(self.count_queries(API + 'media/?expand='), everything - 3)
+        self.assertEqual(self.count_queries(API + 'media/?expand=versions'), everything - 2)
+        self.assertEqual(self.count_queries(API + 'media/?fields=id'), everything - 3)
+
+    def test_media_duplicate_groups(self):
+        original = self.add_media(1)[0]
+        self.assertConstantQueries(API + 'media/?expand=duplicates',
+                                   lambda n: self.add_media(n, duplicate_of=original))
+        # the duplicate groups of a whole page are one grouped lookup
+        with_groups = self.count_queries(API + 'media/?expand=duplicates')
+        self.assertEqual(self.count_queries(API + 'media/?expand='), with_groups - 1)
+        results = self.get(API + 'media/?expand=duplicates').json()['results']
+        for item in results:
+            self.assertEqual(len(item['duplicates']), len(results) - 1)
+            self.assertNotIn(item['id'], {duplicate['id'] for duplicate in item['duplicates']})
+
+    def test_media_search(self):
+        self.assertConstantQueries(API + 'media/search/?status=raw', self.add_media)
+
+    def test_versions(self):
+        media = self.add_media(1)[0]
+        self.assertConstantQueries(API + 'versions/', lambda n: self.add_versions(media, n))
+
+    def test_shares(self):
+        media = self.add_media(1)[0]
+        self.assertConstantQueries(API + 'shares/', lambda n: self.add_shares(media, n))
+
+    def test_media_versions_and_shares_actions(self):
+        media = self.add_media(1)[0]
+        self.assertConstantQueries(API + f'media/{media.pk}/versions/', lambda n: self.add_versions(media, n))
+        self.assertConstantQueries(API + f'media/{media.pk}/shares/', lambda n: self.add_shares(media, n))
+
+    def test_deleted(self):
+        def delete_media(n):
+            for media in self.add_media(n):
+                media.soft_delete()
+
+        response = self.assertConstantQueries(API + 'deleted/', delete_media)
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_deleted_with_duplicates(self):
+        original = self.add_media(1)[0]
+
+        def delete_copies(n):
+            for media in self.add_media(n, duplicate_of=original):
+                media.soft_delete()
+
+        self.assertConstantQueries(API + 'deleted/', delete_copies)
+
+    def test_tier_rules(self):
+        self.assertConstantQueries(API + 'tier_rules/', lambda n: [
+            StorageTierRule.objects.create(project=self.project, min_age_days=30 + i, tier='warm') for i in range(n)])
+
+
+class DetailQueryCountTests(QueryCountTestCase):
+    def test_media_duplicates(self):
+        media = self.add_media(1, phash=0)[0]
+        self.assertConstantQueries(API + f'media/{media.pk}/duplicates/?max_distance=4',
+                                   lambda n: self.add_media(n, duplicate_of=media, phash=1))
+        for bad in ('abc', '-1'):
+            with self.subTest(max_distance=bad):
+                response = self.client.get(API + f'media/{media.pk}/duplicates/?max_distance={bad}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('max_distance', response.json())
+
+    def test_client(self):
+        self.assertConstantQueries(API + f'clients/{self.owner.pk}/', lambda n: [
+            Project.objects.create(client=self.owner, name=f'Project {i}') for i in range(n)])
+
+    def test_project(self):
+        self.assertConstantQueries(API + f'projects/{self.project.pk}/', self.add_media)
+
+    def test_media(self):
+        media = self.add_media(1)[0]
+
+        def grow(n):
+            self.add_versions(media, n)
+            self.add_shares(media, n)
+            self.add_media(n, duplicate_of=media)
+
+        response = self.assertConstantQueries(API + f'media/{media.pk}/', grow)
+        self.assertEqual(len(response.json()['duplicates']), 10)
+
+    def test_media_sparse_fields(self):
+        media = self.add_media(1)[0]
+        for query in ('?fields=id,file', '?expand=', '?expand=versions,duplicates'):
+            with self.subTest(query=query):
+                self.assertConstantQueries(API + f'media/{media.pk}/{query}',
+                                           lambda n: self.add_versions(media, n))
+
+    def test_media_action_skips_the_nested_relations(self):
+        media = self.add_media(1)[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.get(API + f'media/{media.pk}/transform_url/?w=64')
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn(FileVersion._meta.db_table, tables)
+        self.assertNotIn(ShareLink._meta.db_table, tables)
+
+    def test_version(self):
+        media = self.add_media(1)[0]
+        version = media.versions.first()
+        self.assertConstantQueries(API + f'versions/{version.pk}/', lambda n: self.add_versions(media, n))
+
+    def test_share(self):
+        media = self.add_media(1)[0]
+        share = media.share_links.first()
+        self.assertConstantQueries(API + f'shares/{share.pk}/', lambda n: self.add_shares(media, n))
+
+    def test_deleted(self):
+        media = self.add_media(1)[0]
+        media.soft_delete()
+        entry = DeletedFile.objects.get(media=media)
+
+        def grow(n):
+            self.add_versions(media, n)
+            self.add_shares(media, n)
+
+        self.assertConstantQueries(API + f'deleted/{entry.pk}/', grow)
+
+    def test_tier_rule(self):
+        rule = StorageTierRule.objects.create(project=self.project, min_age_days=30, tier='warm')
+        with self.assertNumQueries(1):
+            self.get(API + f'tier_rules/{rule.pk}/')
+
+    def test_upload_session(self):
+        session = UploadSession.objects.create(project=self.project, filename='clip.mp4', media_type='video',
+                                               total_size=1024)
+        with self.assertNumQueries(1):
+            self.get(API + f'uploads/{session.pk}/')
+
+    def test_upload_batch(self):
+        batch = UploadBatch.objects.create(project=self.project)
+        with self.assertNumQueries(1):
+            self.get(API + f'upload_batches/{batch.pk}/')
+
+
+class BulkTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = Client.objects.create(owner=User.objects.create(username='owner'), name='Client')
+        cls.source = Project.objects.create(client=owner, name='Source')
+        cls.target = Project.objects.create(client=owner, name='Target', quota_bytes=1000)
+        cls.media = [MediaFile.objects.create(project=cls.source, file=f'uploads/test/{n}.jpg', media_type='image',
+                                              size=400) for n in range(2)]
+
+    def test_filter_is_validated(self):
+        for bad in ({'project': 'abc'}, {'status': 'lost'}, {'owner': 1}, {}, ['project']):
+            with self.subTest(filter=bad):
+                response = self.client.post(API + 'media/bulk_status/', {'filter': bad, 'status': 'final'},
+                                            format='json')
+                self.assertEqual(response.status_code, 400, response.content[:500])
+                self.assertIn('filter', response.json())
+
+    def test_filter_selects(self):
+        response = self.client.post(API + 'media/bulk_status/',
+                                    {'filter': {'project': self.source.pk, 'media_type': 'image'}, 'status': 'final'},
+                                    format='json')
+        self.assertEqual(response.json()['counts'], {'ok': 2})
+
+    def test_move_within_quota(self):
+        response = self.client.post(API + 'media/bulk_move/', {'ids': [m.pk for m in self.media],
+                                                                'project': self.target.pk}, format='json')
+        self.assertEqual(response.json()['counts'], {'ok': 2})
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.bytes_used, 800)
+
+    def test_move_over_quota_moves_nothing(self):
+        FileVersion.objects.create(media=self.media[0], file='versions/test/0.jpg', version_number=1, size=300)
+        response = self.client.post(API + 'media/bulk_move/', {'filter': {'project': self.source.pk},
+                                                                'project': self.target.pk}, format='json')
+        self.assertEqual(response.status_code, 507, response.content[:500])
+        self.assertFalse(MediaFile.objects.filter(project=self.target).exists())
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.bytes_used, 0)
+
+    def full_client_and_another(self):
+        """Fill the client; returns a file in another client's project."""
+        Client.objects.filter(pk=self.source.client_id).update(quota_bytes=800)
+        other = Project.objects.create(client=Client.objects.create(owner=User.objects.create(username='other'),
+                                                                    name='Other'), name='Other')
+        return MediaFile.objects.create(project=other, file='uploads/test/2.jpg', media_type='image', size=100)
+
+    def test_update_within_the_client_ignores_its_quota(self):
+        other = self.full_client_and_another()
+        # moving between its projects does not grow the client
+        response = self.client.patch(API + f'media/{self.media[1].pk}/', {'project': self.target.pk}, format='json')
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        response = self.client.patch(API + f'media/{other.pk}/', {'project': self.target.pk}, format='json')
+        self.assertEqual(response.status_code, 507, response.content[:500])
+
+    def test_bulk_move_within_the_client_ignores_its_quota(self):
+        other = self.full_client_and_another()
+        response = self.client.post(API + 'media/bulk_move/', {'ids': [m.pk for m in self.media],
+                                                                'project': self.target.pk}, format='json')
+        self.assertEqual(response.json()['counts'], {'ok': 2})
+        response = self.client.post(API + 'media/bulk_move/', {'ids': [other.pk], 'project': self.target.pk},
+                                    format='json')
+        self.assertEqual(response.status_code, 507, response.content[:500])
+
+
+def jpeg(size, color='red'):
+    out = io.BytesIO()
+    Image.new('RGB', size, color).save(out, 'JPEG')
+    return out.getvalue()
+
+
+class CountsCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create(username='owner')
+        self.project = Project.objects.create(client=Client.objects.create(owner=self.owner, name='Client'),
+                                              name='Project')
+
+    def assertCounts(self, media, deleted):
+        # read from the warm counters, and in step with the database
+        for scope in (self.owner.pk, None):
+            with self.assertNumQueries(0):
+                counts = get_counts(scope)
+            self.assertEqual((counts['media'], counts['deleted']), (media, deleted))
+            self.assertEqual(counts, count_from_db(scope))
+
+    def test_counters_follow_create_delete_and_restore(self):
+        with self.assertNumQueries(4):
+            get_counts(self.owner.pk)
+        get_counts()
+        with self.captureOnCommitCallbacks(execute=True):
+            media = MediaFile.objects.create(project=self.project, file='uploads/test/a.jpg', media_type='image')
+        self.assertCounts(media=1, deleted=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(API + f'media/{media.pk}/')
+        self.assertCounts(media=0, deleted=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(API + f'media/{media.pk}/restore/')
+        self.assertCounts(media=1, deleted=0)
+
+    def test_dropped_counters_are_recounted(self):
+        get_counts(self.owner.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.delete()
+        with self.assertNumQueries(4):
+            self.assertEqual(get_counts(self.owner.pk)['projects'], 0)
+
+
+@override_settings(SHARE_ACCESS_FLUSH_INTERVAL=3600)
+class ShareAccessTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        # a buffer of this test's own, flushed only when the test says so
+        buffer = mock.patch('mediaapp.share_access._buffer', LocalAccessBuffer())
+        buffer.start()
+        self.addCleanup(buffer.stop)
+        user = User.objects.create(username='owner')
+        project = Project.objects.create(client=Client.objects.create(owner=user, name='Client'), name='Project')
+        media = MediaFile.objects.create(project=project, file='uploads/test/a.jpg', media_type='image')
+        self.share = ShareLink.objects.create(media=media, created_by=user)
+
+    def hit(self):
+        self.assertEqual(self.client.get(API + f'shares/public_access/?token={self.share.token}').status_code, 200)
+
+    def test_hits_are_counted_by_the_flush(self):
+        self.hit()
+        # a hit on a resolved link does not touch the database
+        with self.assertNumQueries(0):
+            self.hit()
+            self.hit()
+        self.share.refresh_from_db()
+        self.assertEqual(self.share.access_count, 0)
+        self.assertEqual(flush_share_access(), 3)
+        self.hit()
+        self.assertEqual(flush_share_access(), 1)
+        self.share.refresh_from_db()
+        self.assertEqual(self.share.access_count, 4)
+        # one bucket row per link and SHARE_ACCESS_BUCKET_SECONDS
+        self.assertEqual(list(ShareAccessBucket.objects.values_list('count', flat=True)), [4])
+
+    def test_failed_flush_keeps_its_hits(self):
+        self.hit()
+        self.hit()
+        with mock.patch('mediaapp.share_access.write_hits', side_effect=OperationalError('database is locked')), \
+                self.assertRaises(OperationalError):
+            flush_share_access()
+        self.hit()
+        self.assertEqual(flush_share_access(), 3)
+        self.share.refresh_from_db()
+        self.assertEqual(self.share.access_count, 3)
+
+    def test_hits_on_deleted_links_are_dropped(self):
+        self.hit()
+        self.share.delete()
+        self.assertEqual(flush_share_access(), 1)
+        self.assertFalse(ShareAccessBucket.objects.exists())
+
+
+class ShareCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='owner')
+        project = Project.objects.create(client=Client.objects.create(owner=self.user, name='Client'), name='Project')
+        self.media = MediaFile.objects.create(project=project, file='uploads/test/a.jpg', media_type='image')
+
+    def access(self, token):
+        return self.client.get(API + f'shares/public_access/?token={token}').status_code
+
+    def test_unknown_tokens_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.access('no-such-token'), 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.access('no-such-token'), 404)
+        # creating the link replaces the negative entry
+        with self.captureOnCommitCallbacks(execute=True):
+            ShareLink.objects.create(media=self.media, created_by=self.user, token='no-such-token')
+        self.assertEqual(self.access('no-such-token'), 200)
+
+    @override_settings(SHARE_CACHE_TIMEOUT=300)
+    def test_entries_expire_with_their_link(self):
+        share = ShareLink.objects.create(media=self.media, created_by=self.user,
+                                         expires_at=timezone.now() + timedelta(seconds=30))
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.assertEqual(self.access(share.token), 200)
+        self.assertLessEqual(cache_set.call_args.args[2], 30)
+        # past its expiry a link is refused, even from the cache
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=31)), \
+                self.assertNumQueries(0):
+            self.assertEqual(self.access(share.token), 403)
+
+    def test_deleting_a_link_drops_its_entry(self):
+        share = ShareLink.objects.create(media=self.media, created_by=self.user)
+        self.assertEqual(self.access(share.token), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(API + f'shares/{share.pk}/').status_code, 204)
+        self.assertEqual(self.access(share.token), 404)
+
+
+class StoredFilesTestCase(APITestCase):
+    """Files are stored under a temporary MEDIA_ROOT and Celery tasks run inline."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, CELERY_TASK_ALWAYS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class ExportTests(StoredFilesTestCase):
+    def test_sizes_of_blobs_come_from_their_rows(self):
+        owner = Client.objects.create(owner=User.objects.create(username='owner'), name='Client')
+        project = Project.objects.create(client=owner, name='Project')
+        # rows from before sizes were recorded: only the blob rows know them, and no bytes are stored here
+        media = MediaFile.objects.create(project=project, file='blobs/aa/aa/a.jpg', media_type='image')
+        FileVersion.objects.create(media=media, file='blobs/bb/bb/b.jpg', version_number=1)
+        Blob.objects.create(sha256='a' * 64, name='blobs/aa/aa/a.jpg', size=1000, ref_count=1)
+        Blob.objects.create(sha256='b' * 64, name='blobs/bb/bb/b.jpg', size=2000, ref_count=1)
+        entries = MediaFile.objects.filter(pk=media.pk)
+        self.assertEqual([entry.size for entry in export_entries(entries)], [1000])
+        self.assertEqual([entry.size for entry in export_entries(entries, latest_version=True)], [2000])
+
+
+    def test_streamed_archive(self):
+        owner = Client.objects.create(owner=User.objects.create(username='owner'), name='Client')
+        alpha, beta = (Project.objects.create(client=owner, name=name) for name in ('Alpha', 'Beta'))
+
+        def add(project, content):
+            # one name throughout: the archive must tell the files apart
+            return MediaFile.objects.create(project=project, media_type='image', original_filename='a.jpg',
+                                            file=SimpleUploadedFile('a.jpg', content))
+
+        first = add(alpha, b'first')
+        add(alpha, b'second')
+        add(beta, b'third')
+        FileVersion.objects.create(media=first, file=SimpleUploadedFile('a-edited.jpg', b'first, edited'),
+                                   version_number=1, size=13)
+
+        def export(query=''):
+            response = self.client.get(API + f'clients/{owner.pk}/export/{query}')
+            self.assertEqual(response.status_code, 200)
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertIsNone(archive.testzip())
+            return {name: archive.read(name) for name in archive.namelist()}
+
+        self.assertEqual(export(), {'Alpha/a.jpg': b'first', 'Alpha/a (2).jpg': b'second', 'Beta/a.jpg': b'third'})
+        self.assertEqual(export('?version=latest'), {'Alpha/a-edited.jpg': b'first, edited',
+                                                     'Alpha/a.jpg': b'second', 'Beta/a.jpg': b'third'})
+
+
+class ShareTransformTests(StoredFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create(username='owner')
+        project = Project.objects.create(client=Client.objects.create(owner=user, name='Client'), name='Project')
+        self.media = MediaFile.objects.create(project=project, media_type='image',
+                                              file=SimpleUploadedFile('photo.jpg', jpeg((64, 48))))
+        self.share = ShareLink.objects.create(media=self.media, created_by=user)
+
+    def transform_url(self):
+        response = self.client.get(API + 'shares/transform_url/', {'token': self.share.token, 'w': 32})
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        return response.json()['url']
+
+    def test_url_works_while_the_link_does(self):
+        response = self.client.get(self.transform_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'max-age={settings.SHARE_CACHE_TIMEOUT}', response['Cache-Control'])
+
+    def test_deleted_link_stops_its_urls(self):
+        url = self.transform_url()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.share.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_expired_link_stops_urls_handed_out_before_it_had_an_expiry(self):
+        url = self.transform_url()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.share.expires_at = timezone.now() - timedelta(minutes=1)
+            self.share.save()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_token_is_signed(self):
+        other = ShareLink.objects.create(media=self.media, created_by=self.share.created_by)
+        url = self.transform_url().replace(self.share.token, other.token)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class ReplaceFileTests(StoredFilesTestCase):
+    """PATCHing a new file onto a MediaFile replaces everything derived from the old bytes."""
+
+    def setUp(self):
+        super().setUp()
+        owner = Client.objects.create(owner=User.objects.create(username='owner'), name='Client')
+        self.project = Project.objects.create(client=owner, name='Project')
+        self.old, self.new = jpeg((64, 48)), jpeg((320, 240), 'blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(API + 'media/', {'project': self.project.pk, 'media_type': 'image',
+                                                         'file': SimpleUploadedFile('old.jpg', self.old)})
+        self.assertEqual(response.status_code, 201, response.content[:500])
+        self.media = MediaFile.objects.get(pk=response.json()['id'])
+
+    def replace(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(API + f'media/{self.media.pk}/',
+                                         {'file': SimpleUploadedFile('new.jpg', self.new)}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content[:500])
+        self.media.refresh_from_db()
+
+    def test_hash_and_size_follow_the_new_bytes(self):
+        self.replace()
+        self.assertEqual(self.media.file_hash, hashlib.sha256(self.new).hexdigest())
+        self.assertEqual(self.media.size, len(self.new))
+        response = self.client.get(API + f'media/{self.media.pk}/download/',
+                                   HTTP_IF_NONE_MATCH=f'"{hashlib.sha256(self.old).hexdigest()}"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_last_modified_follows_the_new_bytes(self):
+        MediaFile.objects.filter(pk=self.media.pk).update(created_at=timezone.now() - timedelta(days=1))
+        before = self.client.get(API + f'media/{self.media.pk}/download/')['Last-Modified']
+        self.replace()
+        # a client holding only the date must not be told its copy of the old bytes is current
+        response = self.client.get(API + f'media/{self.media.pk}/download/', HTTP_IF_MODIFIED_SINCE=before)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['Last-Modified'], before)
+
+    def test_usage_and_quota_count_the_size_change(self):
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.bytes_used, len(self.old))
+        # room for the growth, not for a second copy of the file
+        Project.objects.filter(pk=self.project.pk).update(quota_bytes=len(self.new) + len(self.old) // 2)
+        self.replace()
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.bytes_used, len(self.new))
+        self.assertEqual(self.project.client.bytes_used, len(self.new))
+
+    def test_renditions_and_transforms_of_the_old_bytes_are_dropped(self):
+        old_rendition = Rendition.objects.get(media=self.media, size='thumb')
+        params = ImageTransformSerializer(data={'w': 32})
+        params.is_valid(raise_exception=True)
+        transforms.get_transform(self.media, params.validated_data)
+        self.replace()
+        self.assertFalse(Rendition.objects.filter(pk=old_rendition.pk).exists())
+        self.assertEqual(Rendition.objects.get(media=self.media, size='thumb').width, 320)
+        self.assertFalse(ImageTransform.objects.exists())
+
+    def test_old_blob_is_released(self):
+        old_name = self.media.file.name
+        self.replace()
+        self.assertNotEqual(self.media.file.name, old_name)
+        self.assertEqual(Blob.objects.get(name=old_name).ref_count, 0)
+        self.assertEqual(Blob.objects.get(name=self.media.file.name).ref_count, 1)
+
+    def test_same_bytes_keep_one_reference(self):
+        self.new = self.old
+        self.replace()
+        self.assertEqual(Blob.objects.get(name=self.media.file.name).ref_count, 1)
+
+    def test_old_file_stored_before_blobs_is_deleted(self):
+        old_name = default_storage.save('uploads/test/plain.jpg', SimpleUploadedFile('plain.jpg', self.old))
+        MediaFile.objects.filter(pk=self.media.pk).update(file=old_name)
+        self.media.refresh_from_db()
+        self.replace()
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertTrue(self.media.file.storage.exists(self.media.file.name))
+
+
+# the anchor pattern cannot cut more often than about every 64 KiB
+@override_settings(VERSION_CHUNK_SIZE=64 * 1024)
+class DeltaTests(StoredFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create(username='owner')
+        project = Project.objects.create(client=Client.objects.create(owner=user, name='Client'), name='Project')
+        self.client.force_authenticate(user)
+        self.content = random.Random(0).randbytes(1024 * 1024)
+        self.media = MediaFile.objects.create(project=project, media_type='video',
+                                              file=SimpleUploadedFile('clip.mp4', self.content))
+
+    def add_version(self, content):
+        version = FileVersion.objects.create(media=self.media, file=SimpleUploadedFile('clip.mp4', content),
+                                             version_number=self.media.next_version_number(), size=len(content),
+                                             file_hash=hashlib.sha256(content).hexdigest())
+        with self.captureOnCommitCallbacks(execute=True):
+            written = version.store_as_chunks()
+        version.refresh_from_db()
+        return version, written
+
+    def test_chunks_are_content_defined(self):
+        chunks = list(iter_chunks(io.BytesIO(self.content)))
+        self.assertEqual(b''.join(chunks), self.content)
+        self.assertTrue(all(16 * 1024 <= len(chunk) <= 256 * 1024 for chunk in chunks[:-1]))
+        # an insertion only changes the chunk around it
+        edited = self.content[:500000] + b'inserted' + self.content[500000:]
+        edited_chunks = list(iter_chunks(io.BytesIO(edited)))
+        self.assertEqual(len(set(chunks) - set(edited_chunks)), 1)
+
+    def test_version_is_stored_as_shared_chunks(self):
+        version, written = self.add_version(self.content)
+        self.assertEqual((version.file.name, version.size), ('', len(self.content)))
+        self.assertEqual(written, len(self.content))
+        self.assertEqual(version.file_hash, hashlib.sha256(self.content).hexdigest())
+        with version.content.open() as fh:
+            self.assertEqual(fh.read(), self.content)
+        # the next version only stores the chunks it changed
+        edited = self.content[:500000] + b'inserted' + self.content[500000:]
+        version, written = self.add_version(edited)
+        self.assertLessEqual(written, 256 * 1024)
+        with version.content.open() as fh:
+            self.assertEqual(fh.read(), edited)
+
+    def test_range_over_a_chunked_version(self):
+        version, _ = self.add_version(self.content)
+        self.assertGreater(len(version.chunks), 2)
+        start, end = version.chunks[0][1] - 10, version.chunks[0][1] + version.chunks[1][1] + 10
+        resp = self.client.get(API + f'media/{self.media.pk}/download/?version={version.pk}',
+                               HTTP_RANGE=f'bytes={start}-{end}')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp['Content-Range'], f'bytes {start}-{end}/{len(self.content)}')
+        self.assertEqual(b''.join(resp.streaming_content), self.content[start:end + 1])
+
+
+class TieringTests(StoredFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        roots = {tier: tempfile.mkdtemp() for tier in ('warm', 'cold')}
+        for root in roots.values():
+            self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings_override = override_settings(STORAGE_TIER_ROOTS=roots)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.project = Project.objects.create(client=Client.objects.create(owner=User.objects.create(username='owner'),
+                                                                           name='Client'), name='Project')
+        self.later = timezone.now() + timedelta(days=100)
+
+    def add(self, status, content):
+        return MediaFile.objects.create(project=self.project, media_type='image', status=status,
+                                        file=SimpleUploadedFile('photo.jpg', content))
+
+    def tier(self, media):
+        media.refresh_from_db()
+        self.assertEqual(default_storage.tier(media.file.name), media.storage_tier)
+        return media.storage_tier
+
+    def test_rules_of_the_most_specific_scope_move_files(self):
+        raw, final = self.add('raw', jpeg((8, 8))), self.add('final', jpeg((9, 9)))
+        StorageTierRule.objects.create(client=self.project.client, min_age_days=30, tier='warm')
+        StorageTierRule.objects.create(project=self.project, status='raw', min_age_days=30, tier='cold')
+        stats = apply_tier_policy(now=self.later)
+        self.assertEqual((stats['moved'], stats['bytes_moved']), ({'cold': 1}, {'cold': raw.size}))
+        self.assertEqual(stats['usage']['cold'], {'files': 1, 'bytes': raw.size})
+        # the project's rules replace the client's, and none of them matches the final file
+        self.assertEqual((self.tier(raw), self.tier(final)), ('cold', 'hot'))
+        with raw.file.open() as fh:
+            self.assertEqual(fh.read(), jpeg((8, 8)))
+        self.assertEqual(apply_tier_policy(now=self.later)['moved'], {})
+
+    def test_shared_blob_stays_as_hot_as_its_hottest_file(self):
+        raw, final = self.add('raw', jpeg((8, 8))), self.add('final', jpeg((8, 8)))
+        self.assertEqual(raw.file.name, final.file.name)
+        StorageTierRule.objects.create(status='raw', min_age_days=30, tier='cold')
+        apply_tier_policy(now=self.later)
+        self.assertEqual((self.tier(raw), self.tier(final)), ('hot', 'hot'))
+        final.delete()
+        apply_tier_policy(now=self.later)
+        self.assertEqual(self.tier(raw), 'cold')
+
+    def test_download_rehydrates(self):
+        media = self.add('raw', jpeg((8, 8)))
+        StorageTierRule.objects.create(min_age_days=30, tier='cold')
+        apply_tier_policy(now=self.later)
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.get(API + f'media/{media.pk}/download/')
+        self.assertEqual(b''.join(resp.streaming_content), jpeg((8, 8)))
+        self.assertEqual(self.tier(media), 'hot')
+        self.assertIsNotNone(media.rehydrated_at)
+        # its age restarts, so the rule only moves it again once it is old enough
+        self.assertEqual(apply_tier_policy(now=timezone.now() + timedelta(days=1))['moved'], {})
+
+
+class PurgeTests(StoredFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project.objects.create(client=Client.objects.create(owner=User.objects.create(username='owner'),
+                                                                           name='Client'), name='Project')
+        self.media = MediaFile.objects.create(project=self.project, media_type='image', file='uploads/test/a.jpg')
+        # a file from before blobs, which the purge deletes itself
+        self.name = default_storage.save('uploads/test/a.jpg', SimpleUploadedFile('a.jpg', jpeg((8, 8))))
+        MediaFile.objects.filter(pk=self.media.pk).update(file=self.name)
+        self.media.refresh_from_db()
+        self.media.soft_delete(retention_days=1)
+        self.later = timezone.now() + timedelta(days=2)
+
+    def test_purge_is_idempotent(self):
+        self.assertEqual(purge_expired(now=self.later)['deleted'], 1)
+        self.assertFalse(MediaFile.objects.filter(pk=self.media.pk).exists())
+        self.assertFalse(default_storage.exists(self.name))
+        self.assertEqual(purge_expired(now=self.later)['deleted'], 0)
+
+    def test_failed_delete_is_retried(self):
+        with mock.patch('mediaapp.purge.delete_objects', return_value={self.name}):
+            self.assertEqual(purge_expired(now=self.later)['failed'], 1)
+        self.assertTrue(DeletedFile.objects.filter(media=self.media).exists())
+        self.assertEqual(purge_expired(now=self.later)['deleted'], 1)
+
+    def test_restore_wins_over_a_purge_that_selected_the_file(self):
+        # restored (and deleted again, with a new expiry) after purge_expired picked the batch
+        self.media.restore()
+        self.assertEqual(purge_batch([self.media.pk], 1, self.later), (0, 0, 0))
+        self.media.soft_delete(retention_days=30)
+        self.assertEqual(purge_batch([self.media.pk], 1, self.later), (0, 0, 0))
+        self.assertTrue(default_storage.exists(self.name))
+        self.assertTrue(MediaFile.objects.filter(pk=self.media.pk).exists())
+
+    def test_restore_after_purge_is_not_found(self):
+        purge_expired(now=self.later)
+        self.assertEqual(self.client.post(API + f'media/{self.media.pk}/restore/').status_code, 404)
+
+
+class FindDuplicatesTests(StoredFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project.objects.create(client=Client.objects.create(owner=User.objects.create(username='owner'),
+                                                                           name='Client'), name='Project')
+        self.content = jpeg((8, 8))
+        self.media = []
+        for filename in ('a.jpg', 'b.jpg', 'c.jpg'):
+            name = default_storage.save(f'uploads/test/{filename}', SimpleUploadedFile(filename, self.content))
+            media = MediaFile.objects.create(project=self.project, media_type='image', file=name)
+            MediaFile.objects.filter(pk=media.pk).update(file_hash=None, hash_status='pending')
+            self.media.append(media)
+
+    def backfill(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('find_duplicates', '--backfill', '--workers', '1', stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_unreadable_file_is_reported_and_the_rest_hashed(self):
+        broken = self.media[0].file.name
+        hash_stored_file = find_duplicates.hash_stored_file
+
+        def fail_on_broken(name):
+            if name == broken:
+                # what botocore raises for an object the bucket refuses; not an OSError
+                raise RuntimeError('An error occurred (AccessDenied) when calling the GetObject operation')
+            return hash_stored_file(name)
+
+        with mock.patch.object(find_duplicates, 'hash_stored_file', fail_on_broken):
+            out, err = self.backfill()
+        self.assertIn(f'Could not hash media {self.media[0].pk}', err)
+        self.assertIn('Backfilled 2 hashes (1 unreadable)', out)
+        self.assertEqual(MediaFile.objects.filter(hash_status='complete').count(), 2)
+        self.assertIsNone(MediaFile.objects.get(pk=self.media[0].pk).file_hash)
+
+    @override_settings(CONTENT_ADDRESSED_STORAGE=True)
+    def test_backfilled_files_are_adopted_into_the_blob_store(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.backfill()
+        names = {media.file.name for media in MediaFile.objects.all()}
+        self.assertEqual(len(names), 1)
+        blob = Blob.objects.get(name=names.pop())
+        self.assertEqual(blob.ref_count, 3)
+        self.assertEqual(default_storage.listdir('uploads/test')[1], [])
+
+
+class ChunkedUploadTests(StoredFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = Project.objects.create(client=Client.objects.create(owner=User.objects.create(username='owner'),
+                                                                           name='Client'), name='Project')
+
+    def start(self, filename, total_size):
+        resp = self.client.post(API + 'uploads/', {'project': self.project.pk, 'filename': filename,
+                                                   'media_type': 'video', 'total_size': total_size}, format='json')
+        self.assertEqual(resp.status_code, 201)
+        return resp.data['id']
+
+    def send(self, session_id, offset, content, **headers):
+        return self.client.put(API + f'uploads/{session_id}/', content, content_type='application/offset+octet-stream',
+                               HTTP_UPLOAD_OFFSET=str(offset), **headers)
+
+    def finalize(self, session_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(API + f'uploads/{session_id}/finalize/')
+
+    def upload(self, filename, content):
+        session_id = self.start(filename, len(content))
+        self.assertEqual(self.send(session_id, 0, content).status_code, 200)
+        return session_id
+
+    def test_chunks_resume_from_the_session_offset(self):
+        part = max(get_chunk_store().min_chunk_size, 1000)
+        content = os.urandom(2 * part + 10)
+        session_id = self.start('clip.mp4', len(content))
+        self.assertEqual(self.send(session_id, 0, content[:part]).data['offset'], part)
+        # a retried (or stale) chunk learns where to resume
+        resp = self.send(session_id, 0, content[:part])
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual((resp.data['offset'], resp['Upload-Offset']), (part, str(part)))
+        self.assertEqual(self.client.get(API + f'uploads/{session_id}/')['Upload-Offset'], str(part))
+        resp = self.finalize(session_id)
+        self.assertEqual((resp.status_code, resp.data['detail']), (409, 'upload incomplete'))
+
+        self.assertEqual(self.send(session_id, part, content[part:2 * part]).status_code, 200)
+        self.assertEqual(self.send(session_id, 2 * part, content[2 * part:]).status_code, 200)
+        media = MediaFile.objects.get(pk=self.finalize(session_id).data['id'])
+        self.assertEqual((media.size, media.file_hash, media.hash_status),
+                         (len(content), hashlib.sha256(content).hexdigest(), 'complete'))
+        with default_storage.open(media.file.name) as fh:
+            self.assertEqual(fh.read(), content)
+        self.assertEqual(self.send(session_id, len(content), b'x').status_code, 409)
+
+    def test_claimed_offset_refuses_a_concurrent_chunk(self):
+        content = os.urandom(1000)
+        session_id = self.start('clip.mp4', len(content))
+        sessions = UploadSession.objects.filter(pk=session_id)
+        sessions.update(chunk_claimed_until=timezone.now() + timedelta(minutes=1))
+        resp = self.send(session_id, 0, content)
+        self.assertEqual((resp.status_code, resp.data['detail']), (409, 'concurrent chunk upload'))
+        # a claim outlives its request only until CHUNKED_UPLOAD_CLAIM_TIMEOUT
+        sessions.update(chunk_claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.send(session_id, 0, content).status_code, 200)
+        self.assertIsNone(sessions.get().chunk_claimed_until)
+
+    def test_chunk_checksum(self):
+        content = os.urandom(1000)
+        session_id = self.start('clip.mp4', len(content))
+        wrong = base64.b64encode(hashlib.sha256(b'other bytes').digest()).decode()
+        resp = self.send(session_id, 0, content, HTTP_UPLOAD_CHECKSUM=f'sha256 {wrong}')
+        self.assertEqual((resp.status_code, resp.data['offset']), (460, 0))
+        right = base64.b64encode(hashlib.sha256(content).digest()).decode()
+        resp = self.send(session_id, 0, content, HTTP_UPLOAD_CHECKSUM=f'sha256 {right}')
+        self.assertEqual((resp.status_code, resp.data['chunk_sha256']), (200, hashlib.sha256(content).hexdigest()))
+
+    def test_chunk_outside_the_upload_is_refused(self):
+        session_id = self.start('clip.mp4', 1000)
+        self.assertEqual(self.send(session_id, 0, os.urandom(1001)).status_code, 400)
+        self.assertEqual(UploadSession.objects.get(pk=session_id).offset, 0)
+
+    def test_same_named_uploads_keep_their_own_bytes(self):
+        for adopt in (True, False):
+            with self.subTest(content_addressed=adopt), override_settings(CONTENT_ADDRESSED_STORAGE=adopt):
+                contents = [os.urandom(1000), os.urandom(2000)]
+                # both sessions are open at once, so neither may take a name the other will use
+                sessions = [self.upload('clip.mp4', content) for content in contents]
+                media = [MediaFile.objects.get(pk=self.finalize(session_id).data['id']) for session_id in sessions]
+                self.assertNotEqual(media[0].file.name, media[1].file.name)
+                for item, content in zip(media, contents):
+                    with default_storage.open(item.file.name) as fh:
+                        self.assertEqual(fh.read(), content)
+                self.assertEqual(default_storage.listdir('uploads_partial')[1], [])
+
+    def test_concurrent_finalize_is_refused(self):
+        session_id = self.upload('clip.mp4', os.urandom(1000))
+        store_class = type(get_chunk_store())
+        complete = store_class.complete
+        responses = []
+
+        def complete_while_finalizing(store, session):
+            # a second finalize arrives while the first is assembling the file
+            responses.append(self.client.post(API + f'uploads/{session_id}/finalize/'))
+            return complete(store, session)
+
+        with mock.patch.object(store_class, 'complete', complete_while_finalizing):
+            self.assertEqual(self.finalize(session_id).status_code, 201)
+        self.assertEqual([resp.status_code for resp in responses], [409])
+        self.assertEqual(MediaFile.objects.count(), 1)
+        self.assertEqual(UploadSession.objects.get(pk=session_id).status, 'complete')
+
+    def test_stale_session_is_aborted_once_its_store_allows(self):
+        session_id = self.upload('clip.mp4', os.urandom(1000))
+        UploadSession.objects.filter(pk=session_id).update(updated_at=timezone.now() - timedelta(days=3))
+        with mock.patch.object(type(get_chunk_store()), 'abort', side_effect=OSError('unreachable')), \
+                self.assertLogs('mediaapp.tasks', 'ERROR'):
+            self.assertEqual(cleanup_stale_upload_sessions(), {'aborted': 0, 'failed': 1})
+        self.assertEqual(UploadSession.objects.get(pk=session_id).status, 'active')
+        self.assertEqual(cleanup_stale_upload_sessions(), {'aborted': 1, 'failed': 0})
+        self.assertEqual(UploadSession.objects.get(pk=session_id).status, 'aborted')
+        # aborting again finds nothing left to abort
+        get_chunk_store().abort(UploadSession.objects.get(pk=session_id))
+
+    def test_failed_finalize_can_be_retried(self):
+        session_id = self.upload('clip.mp4', os.urandom(1000))
+        with mock.patch.object(type(get_chunk_store()), 'complete', side_effect=OSError('disk full')), \
+                self.assertRaises(OSError):
+            self.finalize(session_id)
+        self.assertEqual(UploadSession.objects.get(pk=session_id).status, 'active')
+        self.assertEqual(self.finalize(session_id).status_code, 201)
+
+
+@skipIf(mock_aws is None, 'moto is not installed')
+@override_settings(USE_S3=True, STORAGES={
+    'default': {'BACKEND': 'storages.backends.s3.S3Storage',
+                'OPTIONS': {'bucket_name': 'media', 'region_name': 'us-east-1',
+                            'access_key': 'testing', 'secret_key': 'testing'}},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class S3ChunkedUploadTests(ChunkedUploadTests):
+    """The same uploads as multipart uploads to moto's S3, where storage names are never made unique."""
+
+    def setUp(self):
+        super().setUp()
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        clients = mock.patch.dict(storage_io._clients, clear=True)
+        clients.start()
+        self.addCleanup(clients.stop)
+        storage_io.s3_client().create_bucket(Bucket='media')
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_parts_are_streamed_from_a_spooled_file(self):
+        content = os.urandom(S3_MIN_PART_SIZE + 1000)
+        bodies = []
+        default_storage.connection.meta.client.meta.events.register(
+            'before-parameter-build.s3.UploadPart', lambda params, **kwargs: bodies.append(params['Body']))
+        session_id = self.start('clip.mp4', len(content))
+        self.assertEqual(self.send(session_id, 0, content[:S3_MIN_PART_SIZE]).status_code, 200)
+        self.assertEqual(self.send(session_id, S3_MIN_PART_SIZE, content[S3_MIN_PART_SIZE:]).status_code, 200)
+        media = MediaFile.objects.get(pk=self.finalize(session_id).data['id'])
+        with default_storage.open(media.file.name) as fh:
+            self.assertEqual(fh.read(), content)
+        self.assertEqual(len(bodies), 2)
+        self.assertFalse(any(isinstance(body, bytes) for body in bodies))
+
+
+@override_settings(UPLOAD_BATCH_INSERT_SIZE=2)
+class BatchIngestTests(StoredFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        owner = Client.objects.create(owner=User.objects.create(username='owner'), name='Client')
+        self.batch = UploadBatch.objects.create(project=Project.objects.create(client=owner, name='Project'))
+        self.files = [(f'{n}.jpg', io.BytesIO(jpeg((8 + n, 8)))) for n in range(5)]
+
+    def test_groups_are_saved(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest(self.batch, self.files)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.received, 5)
+        self.assertEqual(self.batch.status, 'complete')
+        self.assertEqual(MediaFile.objects.filter(upload_batch=self.batch).count(), 5)
+
+    @override_settings(UPLOAD_BATCH_MAX_FILES=3)
+    def test_files_past_the_limit_are_skipped(self):
+        ingest(self.batch, self.files)
+        self.batch.refresh_from_db()
+        self.assertEqual((self.batch.received, self.batch.skipped), (3, 2))
+        self.assertEqual([error['name'] for error in self.batch.errors], ['3.jpg'])
+
+    def test_bmp_is_sniffed_from_its_header(self):
+        bmp = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(bmp, 'BMP')
+        self.assertEqual(sniff_media_type(bmp.getvalue()[:SNIFF_BYTES]), 'image')
+        self.assertIsNone(sniff_media_type(b'BMW service record, 2024\n'[:SNIFF_BYTES]))
+
+    def test_error_marks_the_batch_failed_and_keeps_saved_groups(self):
+        def store(batch, name, fileobj, remaining=None):
+            if name == '3.jpg':
+                raise OSError('disk full')
+            return store_member(batch, name, fileobj, remaining)
+
+        with mock.patch('mediaapp.batch_uploads.store_member', store), self.assertRaises(OSError):
+            ingest(self.batch, self.files)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.status, 'failed')
+        self.assertEqual(self.batch.errors, [{'name': '', 'detail': 'import failed: disk full'}])
+        self.assertEqual(self.batch.received, 2)
+        # 2.jpg was stored in the group that failed, and released with it
+        self.assertEqual(Blob.objects.filter(ref_count__gt=0).count(), 2)
+
+    def test_damaged_archive_keeps_the_files_read_before_it(self):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for name, fileobj in self.files:
+                info = tarfile.TarInfo(name)
+                info.size = len(fileobj.getvalue())
+                tar.addfile(info, fileobj)
+        # cut inside the fourth file's data (each member is a 512-byte header and 1024 bytes of data)
+        truncated = io.BytesIO(archive.getvalue()[:3 * 1536 + 512 + 100])
+        with self.assertRaises(ARCHIVE_ERRORS):
+            ingest(self.batch, iter_tar(truncated, stream=True))
+        self.assertEqual(MediaFile.objects.filter(upload_batch=self.batch).count(), 3)
+
+
+@skipIf(mock_aws is None, 'moto is not installed')
+@override_settings(USE_S3=True, S3_TRANSFER_PART_SIZE=1024, S3_TRANSFER_CONCURRENCY=3, STORAGES={
+    'default': {'BACKEND': 'storages.backends.s3.S3Storage',
+                'OPTIONS': {'bucket_name': 'media', 'region_name': 'us-east-1',
+                            'access_key': 'testing', 'secret_key': 'testing'}},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class S3StorageIOTests(SimpleTestCase):
+    """storage_io against moto's in-process S3."""
+
+    def setUp(self):
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        # clients made outside this test's mock must not be reused
+        clients = mock.patch.dict(storage_io._clients, clear=True)
+        clients.start()
+        self.addCleanup(clients.stop)
+        storage_io.s3_client().create_bucket(Bucket='media')
+        self.calls = []
+
+    def record(self, operation):
+        storage_io.s3_client().meta.events.register(
+            f'before-parameter-build.s3.{operation}', lambda params, **kwargs: self.calls.append(params))
+
+    def put(self, name, content):
+        storage_io.upload_object(name, io.BytesIO(content))
+
+    def test_iter_object_reads_parallel_ranges_in_order(self):
+        content = os.urandom(10 * 1024 + 100)
+        self.put('uploads/a.bin', content)
+        self.record('GetObject')
+        self.assertEqual(b''.join(storage_io.iter_object('uploads/a.bin')), content)
+        self.assertEqual(sorted(call['Range'] for call in self.calls),
+                         sorted(f'bytes={start}-{min(start + 1024, len(content)) - 1}'
+                                for start in range(0, len(content), 1024)))
+        with storage_io.open_object('uploads/a.bin') as fh:
+            self.assertEqual(fh.read(), content)
+
+    def test_object_sizes_skips_missing_and_repeated_names(self):
+        self.put('uploads/a.bin', b'a' * 10)
+        self.put('uploads/b.bin', b'b' * 20)
+        self.record('HeadObject')
+        sizes = storage_io.object_sizes(['uploads/a.bin', 'uploads/b.bin', 'uploads/a.bin', 'uploads/gone.bin', ''])
+        self.assertEqual(sizes, {'uploads/a.bin': 10, 'uploads/b.bin': 20})
+        self.assertEqual(len(self.calls), 3)
+
+    def test_delete_objects_batches_requests(self):
+        names = [f'uploads/{n}.bin' for n in range(5)]
+        for name in names:
+            self.put(name, b'x')
+        self.record('DeleteObjects')
+        with mock.patch.object(storage_io, 'S3_DELETE_BATCH', 2):
+            self.assertEqual(storage_io.delete_objects(names + ['']), set())
+        self.assertEqual([len(call['Delete']['Objects']) for call in self.calls], [2, 2, 1])
+        self.assertEqual(storage_io.object_sizes(names), {})
+
+    def test_one_client_per_process(self):
+        client = storage_io.s3_client()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            self.assertEqual(set(pool.map(lambda _: storage_io.s3_client(), range(8))), {client})
+        # a forked worker has another pid, and must not use its parent's connections
+        with mock.patch('mediaapp.storage_io.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(storage_io.s3_client(), client)
+        self.assertIs(storage_io.s3_client(), client)
@@ -0,0 +1,163 @@
+"""Storage tiers: hot, warm and cold media, moved by StorageTierRule and brought back when read.
+
+A file's tier follows the rules of its project, else of its client, else the global ones; its
+age counts from upload, or from its last rehydration. apply_tier_policy (the apply_storage_tiers
+beat task) scans MediaFile and FileVersion rows in keyset batches and moves the files whose tier
+should change, STORAGE_TIER_WORKERS at a time. A blob shared by several rows goes no colder
+than the hottest of them wants. Files read the same from any tier; downloading one that is not
+hot queues rehydrate_file to move it back. Versions stored as chunks (deltas.py) stay hot.
+"""
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import Blob, FileVersion, MediaFile, StorageTierRule
+from .storage import BLOB_PREFIX, STORAGE_TIERS
+from .storage_io import in_parallel, object_sizes, set_object_tier
+
+logger = logging.getLogger(__name__)
+
+TIER_RANK = {tier: rank for rank, tier in enumerate(STORAGE_TIERS)}
+ROW_FIELDS = ('pk', 'file', 'storage_tier', 'created_at', 'rehydrated_at')
+TIERED_MODELS = (MediaFile, FileVersion)
+
+
+def load_rules():
+    """Rules by scope: ('project', id), ('client', id), or None for the global rules."""
+    rules = defaultdict(list)
+    for rule in StorageTierRule.objects.all():
+        if rule.project_id:
+            rules[('project', rule.project_id)].append(rule)
+        elif rule.client_id:
+            rules[('client', rule.client_id)].append(rule)
+        else:
+            rules[None].append(rule)
+    return rules
+
+
+def desired_tier(rules, row, now):
+    """The tier ``row`` (from tiered_rows) belongs in: the coldest matching rule of its most specific scope."""
+    scoped = rules.get(('project', row['project_id'])) or rules.get(('client', row['client_id'])) or rules.get(None, ())
+    age = now - max(row['created_at'], row['rehydrated_at'] or row['created_at'])
+    tier = 'hot'
+    for rule in scoped:
+        if rule.status and rule.status != row['status']:
+            continue
+        if age >= timedelta(days=rule.min_age_days) and TIER_RANK[rule.tier] > TIER_RANK[tier]:
+            tier = rule.tier
+    return tier
+
+
+def tiered_rows(model):
+    """Rows of ``model`` with a stored file, as dicts with the fields desired_tier needs."""
+    rows = model.objects.exclude(file='').order_by()
+    if model is MediaFile:
+        return rows.values(*ROW_FIELDS, 'status', 'project_id', client_id=F('project__client_id'))
+    return rows.values(*ROW_FIELDS, status=F('media__status'), project_id=F('media__project_id'),
+                       client_id=F('media__project__client_id'))
+
+
+def plan_moves(rules, names, now):
+    """``{name: tier}`` for the names some referencing row records in a tier other than the one they need."""
+    wanted, recorded = {}, defaultdict(set)
+    for model in TIERED_MODELS:
+        for row in tiered_rows(model).filter(file__in=names):
+            name, tier = row['file'], desired_tier(rules, row, now)
+            if name not in wanted or TIER_RANK[tier] < TIER_RANK[wanted[name]]:
+                wanted[name] = tier
+            recorded[name].add(row['storage_tier'])
+    return {name: tier for name, tier in wanted.items() if recorded[name] != {tier}}
+
+
+def record_tier(names, tier, **fields):
+    for model in TIERED_MODELS:
+        model.objects.filter(file__in=names).update(storage_tier=tier, **fields)
+
+
+def move_files(moves, workers, stats, dry_run=False):
+    """Move each ``{name: tier}`` and record the new tier on every row referencing it."""
+    if dry_run:
+        sizes = object_sizes(moves, workers)
+        for name, tier in moves.items():
+            stats['moved'][tier] += 1
+            stats['bytes_moved'][tier] += sizes.get(name, 0)
+        return
+
+    def move(item):
+        name, tier = item
+        try:
+            return name, tier, set_object_tier(name, tier)
+        except Exception:
+            logger.exception('Could not move %s to the %s tier', name, tier)
+            return name, tier, None
+
+    by_tier = defaultdict(list)
+    for name, tier, moved in in_parallel(move, moves.items(), workers):
+        if moved is None:
+            stats['failed'] += 1
+            continue
+        by_tier[tier].append(name)
+        stats['moved'][tier] += 1
+        stats['bytes_moved'][tier] += moved
+    for tier, names in by_tier.items():
+        record_tier(names, tier)
+
+
+def apply_tier_policy(batch_size=None, workers=None, dry_run=False, now=None):
+    """Move every tiered file to the tier its rules call for; returns counts, bytes moved and tier usage.
+
+    ``dry_run`` reports what would move (bytes as currently stored) without moving anything.
+    """
+    batch_size = batch_size or settings.STORAGE_TIER_BATCH_SIZE
+    workers = workers or settings.STORAGE_TIER_WORKERS
+    now = now or timezone.now()
+    started = time.monotonic()
+    rules = load_rules()
+    stats = {'scanned': 0, 'moved': Counter(), 'bytes_moved': Counter(), 'failed': 0}
+    settled = set()  # names already planned this run (shared blobs come up once per referencing row)
+    for model in TIERED_MODELS:
+        last_pk = 0
+        while True:
+            batch = list(tiered_rows(model).filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]['pk']
+            stats['scanned'] += len(batch)
+            stale = {row['file'] for row in batch if desired_tier(rules, row, now) != row['storage_tier']} - settled
+            if stale:
+                settled.update(stale)
+                move_files(plan_moves(rules, stale, now), workers, stats, dry_run)
+    stats['moved'] = dict(stats['moved'])
+    stats['bytes_moved'] = dict(stats['bytes_moved'])
+    stats['usage'] = tier_usage()
+    stats['seconds'] = round(time.monotonic() - started, 2)
+    return stats
+
+
+def tier_usage():
+    """Files and stored bytes per tier; a blob shared by several files is counted once."""
+    usage = {tier: {'files': 0, 'bytes': 0} for tier in STORAGE_TIERS}
+    for model in TIERED_MODELS:
+        rows = (model.objects.exclude(file='').order_by().values('storage_tier')
+                .annotate(files=Count('pk'), unshared=Sum('size', filter=~Q(file__startswith=BLOB_PREFIX))))
+        for row in rows:
+            usage[row['storage_tier']]['files'] += row['files']
+            usage[row['storage_tier']]['bytes'] += row['unshared'] or 0
+    for tier in STORAGE_TIERS:
+        names = Q()
+        for model in TIERED_MODELS:
+            names |= Q(name__in=model.objects.filter(storage_tier=tier).values('file'))
+        usage[tier]['bytes'] += Blob.objects.filter(names).aggregate(total=Sum('size'))['total'] or 0
+    return usage
+
+
+def rehydrate(name):
+    """Move a file back to hot and restart the age its rules see; returns the bytes moved."""
+    moved = set_object_tier(name, 'hot')
+    record_tier([name], 'hot', rehydrated_at=timezone.now())
+    return moved
@@ -0,0 +1,214 @@
+"""On-the-fly image transforms: resize, crop and re-encode (JPEG, PNG, WebP, AVIF) with signed URLs.
+
+A transform URL names a media file (or ``version``) and its parameters, plus a signature ``s``
+over both, so only URLs the API handed out (transform_url) are rendered; clients cannot make
+the server decode arbitrary sizes. URLs signed for a share link carry its expiry (``expires``). Sources are decoded at reduced scale where the format
+allows it (JPEG draft mode) and resampled with a reducing gap, so a small output from a large
+photo never decodes every pixel. Results are cached as ImageTransform rows keyed on the
+source's SHA256 and the parameters, so identical files share them, and evicted least
+recently used past TRANSFORM_CACHE_MAX_BYTES.
+"""
+import hashlib
+import io
+import math
+import re
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.signing import Signer
+from django.db.models import Sum
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.http import urlencode
+from PIL import ExifTags, Image, ImageOps, features
+
+from .models import ImageTransform
+from .storage import write_blob
+from .storage_io import delete_objects
+
+TRANSFORM_PREFIX = 'transforms/'
+SIGNING_SALT = 'mediaapp.transforms'
+# last_accessed is only rewritten when older than this, so cache hits rarely write
+TOUCH_INTERVAL = timedelta(hours=1)
+
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'png': ('PNG', 'png'),
+    'webp': ('WEBP', 'webp'),
+    'avif': ('AVIF', 'avif'),
+}
+CROP_PATTERN = re.compile(r'^(\d+),(\d+),(\d+),(\d+)$')
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class InvalidTransform(ValueError):
+    pass
+
+
+def format_available(fmt):
+    """Whether this Pillow build can write ``fmt``."""
+    return fmt in ('jpeg', 'png') or features.check(fmt)
+
+
+def query_items(params):
+    """The set parameters, sorted, so the same transform always signs the same."""
+    return sorted((key, value) for key, value in params.items() if value is not None)
+
+
+def signature(media_id, params):
+    return Signer(salt=SIGNING_SALT).signature(f'{media_id}?{urlencode(query_items(params))}')
+
+
+def signature_is_valid(media_id, params, candidate):
+    return bool(candidate) and constant_time_compare(signature(media_id, params), candidate)
+
+
+def is_expired(params):
+    return params.get('expires') is not None and params['expires'] < time.time()
+
+
+def transform_url(media_id, params):
+    """The signed path of a transform; ``params`` as validated by ImageTransformSerializer."""
+    query = query_items(params) + [('s', signature(media_id, params))]
+    return reverse('media_transform', args=[media_id]) + '?' + urlencode(query)
+
+
+def source_key(media, version=None):
+    """What identifies the source's bytes: its SHA256, or until it is hashed its stored name."""
+    if version is not None:
+        return version.file_hash or f'version:{version.pk}'
+    return media.file_hash or f'media:{media.pk}:{media.file.name}'
+
+
+def transform_key(media, version, params):
+    """The cache key: the source's bytes and what is done to them, not which file or URL asked."""
+    output = [(key, value) for key, value in query_items(params) if key not in ('version', 'token', 'expires')]
+    return hashlib.sha256(f'{source_key(media, version)}?{urlencode(output)}'.encode()).hexdigest()
+
+
+def crop_box(crop, width, height):
+    """``crop`` ("x,y,w,h" in pixels of the upright image) clipped to the image, or the whole image."""
+    if not crop:
+        return 0, 0, width, height
+    x, y, w, h = map(int, CROP_PATTERN.match(crop).groups())
+    box = min(x, width), min(y, height), min(x + w, width), min(y + h, height)
+    if box[2] <= box[0] or box[3] <= box[1]:
+        raise InvalidTransform('crop lies outside the image')
+    return box
+
+
+def output_geometry(box, params):
+    """The source box to sample and the output size: fit within w x h, or fill it for ``cover``; never upscaled."""
+    left, top, right, bottom = box
+    box_width, box_height = right - left, bottom - top
+    width, height = params.get('w'), params.get('h')
+    if width and height and params['fit'] == 'cover':
+        # trim the box to the output's aspect ratio, keeping its centre
+        if box_width * height > box_height * width:
+            trimmed = box_height * width / height
+            left += (box_width - trimmed) / 2
+            box_width = trimmed
+        else:
+            trimmed = box_width * height / width
+            top += (box_height - trimmed) / 2
+            box_height = trimmed
+    scales = [1, settings.TRANSFORM_MAX_EDGE / max(box_width, box_height)]
+    if width:
+        scales.append(width / box_width)
+    if height:
+        scales.append(height / box_height)
+    scale = min(scales)
+    size = max(1, round(box_width * scale)), max(1, round(box_height * scale))
+    return (left, top, left + box_width, top + box_height), size
+
+
+def render_transform(fp, params):
+    """Apply ``params`` to the image in ``fp``; returns (encoded bytes, width, height)."""
+    img = Image.open(fp)
+    orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+    upright = img.size[::-1] if orientation in TRANSPOSED_ORIENTATIONS else img.size
+    box, size = output_geometry(crop_box(params.get('crop'), *upright), params)
+    # JPEG draft mode decodes at 1/2, 1/4 or 1/8 scale, as far as the output (and crop) allow
+    scale = size[0] / (box[2] - box[0])
+    needed = (math.ceil(upright[0] * scale), math.ceil(upright[1] * scale))
+    full_width = upright[0]
+    img.draft('RGB', needed[::-1] if orientation in TRANSPOSED_ORIENTATIONS else needed)
+    img = ImageOps.exif_transpose(img)
+    reduced = img.width / full_width
+    box = tuple(edge * reduced for edge in box)
+    img = img.resize(size, Image.LANCZOS, box=box, reducing_gap=3.0)
+
+    pil_format, _ = FORMATS[params['fmt']]
+    if pil_format == 'JPEG' and img.mode != 'RGB':
+        img = img.convert('RGB')
+    elif img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        img = img.convert('RGBA' if img.mode in ('P', 'PA') or 'transparency' in img.info else 'RGB')
+    options = {'quality': params['q']}
+    if pil_format == 'JPEG':
+        options.update(optimize=True, progressive=True)
+    elif pil_format == 'PNG':
+        options = {'optimize': True}
+    out = io.BytesIO()
+    img.save(out, pil_format, **options)
+    return out.getvalue(), img.width, img.height
+
+
+def get_transform(media, params, version=None):
+    """The cached transform of a file (or version), rendering and storing it on a miss."""
+    key = transform_key(media, version, params)
+    transform = ImageTransform.objects.filter(pk=key).first()
+    now = timezone.now()
+    if transform is not None:
+        if now - transform.last_accessed > TOUCH_INTERVAL:
+            ImageTransform.objects.filter(pk=key).update(last_accessed=now)
+        return transform
+    source = version.content if version else media.file
+    source.open('rb')
+    try:
+        content, width, height = render_transform(source, params)
+    finally:
+        source.close()
+    name = f'{TRANSFORM_PREFIX}{key[:2]}/{key}.{FORMATS[params["fmt"]][1]}'
+    write_blob(name, ContentFile(content))
+    # concurrent misses render the same bytes to the same name; the first row wins
+    transform = ImageTransform(key=key, source=source_key(media, version), file=name, width=width, height=height,
+                               bytes=len(content), last_accessed=now)
+    ImageTransform.objects.bulk_create([transform], ignore_conflicts=True)
+    return transform
+
+
+def drop_transforms(source):
+    """Delete the transforms rendered from ``source`` (a source_key), e.g. once no file has those bytes."""
+    rows = list(ImageTransform.objects.filter(source=source).values_list('key', 'file'))
+    failed = delete_objects([name for _, name in rows])
+    ImageTransform.objects.filter(pk__in=[key for key, name in rows if name not in failed]).delete()
+
+
+def evict_transforms(max_bytes=None, batch_size=500):
+    """Delete least-recently-used transforms until the total size fits the budget."""
+    if max_bytes is None:
+        max_bytes = settings.TRANSFORM_CACHE_MAX_BYTES
+    total = ImageTransform.objects.aggregate(total=Sum('bytes'))['total'] or 0
+    evicted = freed = 0
+    while total - freed > max_bytes:
+        batch, over = [], total - freed - max_bytes
+        for row in ImageTransform.objects.order_by('last_accessed').values_list('key', 'file', 'bytes')[:batch_size]:
+            if over <= 0:
+                break
+            batch.append(row)
+            over -= row[2]
+        if not batch:
+            break
+        # rows go when their file did; one still in storage stays for the next run
+        failed = delete_objects([name for _, name, _ in batch])
+        batch = [(key, size) for key, name, size in batch if name not in failed]
+        if not batch:
+            break
+        ImageTransform.objects.filter(pk__in=[key for key, _ in batch]).delete()
+        evicted += len(batch)
+        freed += sum(size for _, size in batch)
+    return {'evicted': evicted, 'freed_bytes': freed, 'total_bytes': total - freed}
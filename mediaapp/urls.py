@@ -1,21 +1,31 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (ClientViewSet, ProjectViewSet, MediaFileViewSet, DeletedFileViewSet, 
-                    FileVersionViewSet, ShareLinkViewSet,
-                    landing_page, signup_view, dashboard, clients_view, projects_view, media_view, recovery_view, file_detail_view)
+                    FileVersionViewSet, ShareLinkViewSet, StorageTierRuleViewSet, UploadSessionViewSet, UploadBatchViewSet,
+                    landing_page, signup_view, dashboard, clients_view, projects_view, media_view, recovery_view, file_detail_view,
+                    rendition_view, transform_view)
 from .auth_views import AuthViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'auth', AuthViewSet, basename='auth')
 router.register(r'clients', ClientViewSet)
 router.register(r'projects', ProjectViewSet)
 router.register(r'media', MediaFileViewSet)
+router.register(r'uploads', UploadSessionViewSet)
+router.register(r'upload_batches', UploadBatchViewSet)
 router.register(r'versions', FileVersionViewSet)
 router.register(r'shares', ShareLinkViewSet)
 router.register(r'deleted', DeletedFileViewSet, basename='deleted')
+router.register(r'tier_rules', StorageTierRuleViewSet)
 
 urlpatterns = [
     path('api/', include(router.urls)),
+    # async transfer endpoints, for ASGI deployments (see async_views.py)
+    path('api/async/media/<int:pk>/download/', async_views.media_download, name='async_media_download'),
+    path('api/async/shares/public_access/', async_views.share_public_access, name='async_share_public_access'),
+    path('api/async/shares/download/', async_views.share_download, name='async_share_download'),
+    path('api/async/uploads/<uuid:pk>/', async_views.upload_chunk, name='async_upload_chunk'),
     path('', landing_page, name='landing'),
     path('signup/', signup_view, name='signup'),
     path('dashboard/', dashboard, name='dashboard'),
@@ -23,5 +33,7 @@ urlpatterns = [
     path('projects/', projects_view, name='projects'),
     path('media/', media_view, name='media'),
     path('media/<int:file_id>/', file_detail_view, name='file_detail'),
+    path('media/<int:file_id>/rendition/<str:size>/', rendition_view, name='media_rendition'),
+    path('media/<int:file_id>/transform/', transform_view, name='media_transform'),
     path('recovery/', recovery_view, name='recovery'),
 ]
@@ -0,0 +1,123 @@
+"""Storage used per project and client, kept as running totals, and the quotas checked against them.
+
+A file counts its size plus the sizes of its versions: logical bytes, so a blob shared by two
+files counts for both. Live files count in ``bytes_used``, files in the Recovery Vault in
+``vault_bytes`` until they are purged; quotas apply to ``bytes_used``. Totals move by
+set-based UPDATEs in the transaction that changed the files (the receivers, bulk.py,
+batch_uploads.py and purge.py), and recompute_usage rebuilds them from the rows.
+"""
+import itertools
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.models import F, Sum
+
+from .models import Client, FileVersion, MediaFile, Project
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def adjust_usage(deltas):
+    """Apply ``{project_id: (bytes_used delta, vault_bytes delta)}`` to the projects and their clients."""
+    deltas = {project_id: delta for project_id, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+    by_client = defaultdict(lambda: [0, 0])
+    # projects, then clients, each in id order, so concurrent adjustments lock rows in the same order
+    for project_id, client_id in Project.objects.filter(pk__in=deltas).order_by('pk').values_list('pk', 'client_id'):
+        used, vault = deltas[project_id]
+        Project.objects.filter(pk=project_id).update(bytes_used=F('bytes_used') + used,
+                                                     vault_bytes=F('vault_bytes') + vault)
+        by_client[client_id][0] += used
+        by_client[client_id][1] += vault
+    for client_id in sorted(by_client):
+        used, vault = by_client[client_id]
+        Client.objects.filter(pk=client_id).update(bytes_used=F('bytes_used') + used,
+                                                   vault_bytes=F('vault_bytes') + vault)
+
+
+def file_usage(media_ids):
+    """``{project_id: [live bytes, vault bytes]}`` of these files and their versions."""
+    totals = defaultdict(lambda: [0, 0])
+    rows = itertools.chain(
+        MediaFile.objects.filter(pk__in=media_ids).order_by()
+        .values_list('project_id', 'is_deleted').annotate(total=Sum('size')),
+        FileVersion.objects.filter(media_id__in=media_ids).order_by()
+        .values_list('media__project_id', 'media__is_deleted').annotate(total=Sum('size')),
+    )
+    for project_id, is_deleted, total in rows:
+        totals[project_id][is_deleted] += total or 0
+    return totals
+
+
+def media_bytes(media_id):
+    """A file's size plus its versions'."""
+    return sum(itertools.chain.from_iterable(file_usage([media_id]).values()))
+
+
+@contextmanager
+def tracking_usage(media_ids):
+    """Adjust the totals by however the writes in the block change these files' sizes, projects or deleted state.
+
+    Use inside the transaction, with the files locked (bulk.select_targets).
+    """
+    media_ids = list(media_ids)
+    before = file_usage(media_ids)
+    yield
+    after = file_usage(media_ids)
+    adjust_usage({project_id: (after[project_id][0] - before[project_id][0], after[project_id][1] - before[project_id][1])
+                  for project_id in before.keys() | after.keys()})
+
+
+def quota_headroom(project_id):
+    """(bytes the project can still take, bytes its client can still take); None where there is no quota."""
+    row = (Project.objects.filter(pk=project_id)
+           .values('bytes_used', 'quota_bytes', 'client__bytes_used', 'client__quota_bytes').first())
+    if row is None:
+        return None, None
+    return tuple(None if quota is None else max(quota - used, 0)
+                 for quota, used in ((row['quota_bytes'], row['bytes_used']),
+                                     (row['client__quota_bytes'], row['client__bytes_used'])))
+
+
+def remaining_quota(project_id):
+    """Bytes the project can still take before it or its client reaches its quota; None if neither has one."""
+    remaining = [headroom for headroom in quota_headroom(project_id) if headroom is not None]
+    return min(remaining) if remaining else None
+
+
+def check_quota(project_id, size, client_size=None):
+    """Raise QuotaExceeded if ``size`` more bytes would take the project over quota, or its client.
+
+    ``client_size`` is what the client gains, when that is not ``size``: files moved in from
+    another project of the same client add nothing to it.
+    """
+    client_size = size if client_size is None else client_size
+    for added, remaining in zip((size, client_size), quota_headroom(project_id)):
+        if remaining is not None and added > remaining:
+            raise QuotaExceeded(f'storage quota exceeded: {added} bytes uploaded, {remaining} bytes left')
+
+
+def recompute_usage():
+    """Rebuild every project's and client's totals from the file and version rows."""
+    totals = defaultdict(lambda: [0, 0])
+    rows = itertools.chain(
+        MediaFile.objects.order_by().values_list('project_id', 'is_deleted').annotate(total=Sum('size')),
+        FileVersion.objects.order_by().values_list('media__project_id', 'media__is_deleted').annotate(total=Sum('size')),
+    )
+    for project_id, is_deleted, total in rows:
+        totals[project_id][is_deleted] += total or 0
+    projects = list(Project.objects.only('pk', 'client_id'))
+    by_client = defaultdict(lambda: [0, 0])
+    for project in projects:
+        project.bytes_used, project.vault_bytes = totals.get(project.pk, (0, 0))
+        by_client[project.client_id][0] += project.bytes_used
+        by_client[project.client_id][1] += project.vault_bytes
+    clients = list(Client.objects.only('pk'))
+    for client in clients:
+        client.bytes_used, client.vault_bytes = by_client.get(client.pk, (0, 0))
+    Project.objects.bulk_update(projects, ['bytes_used', 'vault_bytes'], batch_size=1000)
+    Client.objects.bulk_update(clients, ['bytes_used', 'vault_bytes'], batch_size=1000)
+    return len(projects), len(clients)
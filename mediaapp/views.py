@@ -1,32 +1,180 @@
-from rest_framework import viewsets, status
+import base64
+import hashlib
+import itertools
+import re
+import subprocess
+from collections import Counter
+
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404, render, redirect
-from .models import Client, Project, MediaFile, DeletedFile, FileVersion, ShareLink
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
+from django.utils.cache import patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDay
+from django.core.paginator import Paginator
+from django.conf import settings
+from PIL import Image
+from .models import (Client, Project, MediaFile, DeletedFile, FileVersion, ShareLink, StorageTierRule, UploadBatch,
+                     UploadSession)
 from .serializers import (ClientSerializer, ProjectSerializer, MediaFileSerializer, 
-                         DeletedFileSerializer, FileVersionSerializer, ShareLinkSerializer)
+                         DeletedFileSerializer, FileVersionSerializer, ShareLinkSerializer,
+                         UploadSessionSerializer, BulkMediaSerializer, BulkDeleteSerializer,
+                         BulkStatusSerializer, BulkMoveSerializer, BulkShareSerializer, UploadBatchSerializer,
+                         MediaSearchSerializer, StorageTierRuleSerializer, ImageTransformSerializer,
+                         DuplicateSearchSerializer)
+from .chunked_uploads import (final_name, get_chunk_store, get_running_hash, remember_running_hash,
+                              forget_running_hash, read_stream)
+from .pagination import DeletedAtCursorPagination
+from . import bulk, transforms
+from .batch_uploads import ARCHIVE_ERRORS, TAR_CONTENT_TYPES, ingest, iter_archive, iter_tar, iter_uploaded_files
+from .downloads import serve_file
+from .exports import export_entries, zip_response
+from .search import facet_counts, search_media
+from .storage import adopt_stored_file, is_blob_name, release_blobs
+from .tiering import tier_usage
+from .usage import QuotaExceeded, check_quota, media_bytes, tracking_usage
+from .caching import get_counts, listing_version, resolve_share, share_is_valid
+from .renditions import available_sizes, drop_renditions, get_rendition
+from .share_access import record_share_access
+from .phash import MAX_SEARCH_DISTANCE, candidates_q, hamming
+from .tasks import (compute_media_hash, compute_perceptual_hash, generate_renditions, process_new_version,
+                    rehydrate_on_access)
 from django.utils import timezone
 from datetime import timedelta
 
 
+class InsufficientStorage(APIException):
+    status_code = status.HTTP_507_INSUFFICIENT_STORAGE
+    default_detail = 'storage quota exceeded'
+    default_code = 'quota_exceeded'
+
+
+def enforce_quota(project_id, size, client_size=None):
+    """Refuse an upload of ``size`` bytes that would take the project or its client over quota (see check_quota)."""
+    try:
+        check_quota(project_id, size, client_size)
+    except QuotaExceeded as exc:
+        raise InsufficientStorage(str(exc))
+
+
+def export_media(request, media, filename, folders=False):
+    """Stream ``media`` as a zip: ``?status=`` keeps one status, ``?version=latest`` sends each file's newest version."""
+    status_filter = request.query_params.get('status')
+    if status_filter and status_filter not in dict(MediaFile.STATUS_CHOICES):
+        return Response({'detail': 'unknown status'}, status=status.HTTP_400_BAD_REQUEST)
+    media = media.filter(is_deleted=False)
+    if status_filter:
+        media = media.filter(status=status_filter)
+    latest_version = request.query_params.get('version') == 'latest'
+    return zip_response(filename, export_entries(media, latest_version=latest_version, folders=folders))
+
+
 class ClientViewSet(viewsets.ModelViewSet):
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
 
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """Download all of the client's files as one streamed zip, a folder per project."""
+        client = self.get_object()
+        return export_media(request, MediaFile.objects.filter(project__client=client), f'{client.name}.zip', folders=True)
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Client, project, media and vault counts for the signed-in owner (``?scope=all`` for everyone)."""
+        mine = request.user.is_authenticated and request.query_params.get('scope') != 'all'
+        return Response(get_counts(request.user.pk if mine else None))
+
 
 class ProjectViewSet(viewsets.ModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
 
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """Download the project's files as one streamed zip (``?status=final``, ``?version=latest``)."""
+        project = self.get_object()
+        return export_media(request, project.media.all(), f'{project.name}.zip')
+
 
 class MediaFileViewSet(viewsets.ModelViewSet):
     queryset = MediaFile.objects.filter(is_deleted=False)
     serializer_class = MediaFileSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # downloads, writes and the other actions look up one file without serializing its relations
+        if self.action in ('list', 'retrieve'):
+            queryset = self.with_nested(queryset)
+        return queryset
+
+    def with_nested(self, queryset):
+        # only prefetch the nested relations the response will actually include
+        fields = self.get_serializer().fields
+        return queryset.prefetch_related(*[f for f in ('versions', 'share_links') if f in fields])
+
     def perform_create(self, serializer):
-        instance = serializer.save()
-        # compute file hash for duplicate detection
-        instance.compute_file_hash()
+        enforce_quota(serializer.validated_data['project'].pk, serializer.validated_data['file'].size)
+        # the hashing upload handlers digest the file while it streams in
+        digest = getattr(serializer.validated_data.get('file'), 'sha256', None)
+        if digest:
+            instance = serializer.save(file_hash=digest, hash_status='complete')
+        else:
+            # no streamed digest (e.g. custom upload handlers): hash in the background
+            instance = serializer.save()
+            transaction.on_commit(lambda: compute_media_hash.delay(instance.pk))
+        transaction.on_commit(lambda: generate_renditions.delay(instance.pk))
+        transaction.on_commit(lambda: compute_perceptual_hash.delay(instance.pk))
+
+    def perform_update(self, serializer):
+        # a new file or another project changes the storage totals
+        upload = serializer.validated_data.get('file')
+        project = serializer.validated_data.get('project', serializer.instance.project)
+        # a replaced file takes the new bytes' place; a moved one takes its versions along
+        size = serializer.instance.size if upload is None else upload.size
+        if project.pk != serializer.instance.project_id:
+            moved = media_bytes(serializer.instance.pk) - serializer.instance.size + size
+            # between projects of one client, the client only gains what a replaced file adds
+            same_client = project.client_id == serializer.instance.project.client_id
+            enforce_quota(project.pk, moved, size - serializer.instance.size if same_client else moved)
+        elif upload is not None:
+            enforce_quota(project.pk, size - serializer.instance.size)
+        if upload is None:
+            with transaction.atomic(), tracking_usage([serializer.instance.pk]):
+                serializer.save()
+            return
+        old_name = serializer.instance.file.name
+        old_source = transforms.source_key(serializer.instance)
+        old_hash = serializer.instance.file_hash
+        # the new bytes need their own hash, fingerprint and renditions
+        digest = getattr(upload, 'sha256', None)
+        fields = dict.fromkeys(('phash', 'phash_0', 'phash_1', 'phash_2', 'phash_3'))
+        fields.update(size=size, file_hash=digest, hash_status='complete' if digest else 'pending',
+                      replaced_at=timezone.now())
+        with transaction.atomic(), tracking_usage([serializer.instance.pk]):
+            drop_renditions(serializer.instance)
+            instance = serializer.save(**fields)
+            # storing the upload took its own blob reference, even for the same bytes
+            if is_blob_name(old_name):
+                release_blobs([old_name])
+            elif instance.file.name != old_name:
+                transaction.on_commit(lambda: instance.file.storage.delete(old_name))
+        # transforms are shared by every file with the same bytes
+        if not (old_hash and (MediaFile.objects.filter(file_hash=old_hash).exists()
+                              or FileVersion.objects.filter(file_hash=old_hash).exists())):
+            transforms.drop_transforms(old_source)
+        if not digest:
+            transaction.on_commit(lambda: compute_media_hash.delay(instance.pk))
+        transaction.on_commit(lambda: generate_renditions.delay(instance.pk))
+        transaction.on_commit(lambda: compute_perceptual_hash.delay(instance.pk))
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -36,34 +184,114 @@ class MediaFileViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def restore(self, request, pk=None):
-        media = get_object_or_404(MediaFile, pk=pk)
-        if not media.is_deleted:
-            return Response({'detail': 'Not deleted'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        media.restore()
-        # cleanup DeletedFile entry
-        try:
-            if hasattr(media, 'deleted_entry'):
-                media.deleted_entry.delete()
-        except Exception:
-            pass
-        
+        with transaction.atomic():
+            # the row lock waits out a purge of this file, which then leaves nothing to restore
+            media = get_object_or_404(MediaFile.objects.select_for_update(), pk=pk)
+            if not media.is_deleted:
+                return Response({'detail': 'Not deleted'}, status=status.HTTP_400_BAD_REQUEST)
+            # also removes the Recovery Vault entry
+            media.restore()
+
         serializer = self.get_serializer(media)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Download the files listed in ``?ids=1,2,3`` as one streamed zip."""
+        try:
+            ids = [int(i) for i in request.query_params.get('ids', '').split(',') if i]
+        except ValueError:
+            return Response({'detail': 'ids must be a comma-separated list of integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not ids:
+            return Response({'detail': 'ids required'}, status=status.HTTP_400_BAD_REQUEST)
+        return export_media(request, MediaFile.objects.filter(pk__in=ids), 'media.zip', folders=True)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Search live files by text and filters; the first page also carries facet counts."""
+        params = MediaSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        media = search_media(**params.validated_data)
+        page = self.paginate_queryset(self.with_nested(media))
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        if request.query_params.get(self.paginator.cursor_query_param) is None:
+            response.data['facets'] = facet_counts(media)
+        return response
+
+    def run_bulk(self, serializer_class, operation, **params):
+        serializer = serializer_class(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        data = dict(serializer.validated_data)
+        try:
+            return operation(ids=data.pop('ids', None), filters=data.pop('filter', None),
+                             limit=settings.BULK_MAX_ITEMS, **params, **data)
+        except bulk.TooManyTargets as exc:
+            raise ValidationError({'detail': str(exc)})
+        except QuotaExceeded as exc:
+            raise InsufficientStorage(str(exc))
+
+    def bulk_response(self, results):
+        return Response({
+            'results': results,
+            'counts': dict(Counter(result['result'] for result in results)),
+        })
+
+    @action(detail=False, methods=['post'])
+    def bulk_delete(self, request):
+        """Move many files to the Recovery Vault: ``{"ids": [...]}`` or ``{"filter": {...}}``."""
+        return self.bulk_response(self.run_bulk(BulkDeleteSerializer, bulk.soft_delete))
+
+    @action(detail=False, methods=['post'])
+    def bulk_restore(self, request):
+        """Restore many files from the Recovery Vault."""
+        return self.bulk_response(self.run_bulk(BulkMediaSerializer, bulk.restore))
+
+    @action(detail=False, methods=['post'])
+    def bulk_status(self, request):
+        """Set the status (raw, edited, final) of many files."""
+        return self.bulk_response(self.run_bulk(BulkStatusSerializer, bulk.set_status))
+
+    @action(detail=False, methods=['post'])
+    def bulk_move(self, request):
+        """Move many files to another project."""
+        return self.bulk_response(self.run_bulk(BulkMoveSerializer, bulk.move_to_project))
+
+    @action(detail=False, methods=['post'])
+    def bulk_share(self, request):
+        """Create a share link for each of many files."""
+        results, shares = self.run_bulk(BulkShareSerializer, bulk.create_shares, user=request.user)
+        for result in results:
+            if result['id'] in shares:
+                result['share'] = ShareLinkSerializer(shares[result['id']]).data
+        return self.bulk_response(results)
+
     @action(detail=True, methods=['get'])
     def duplicates(self, request, pk=None):
-        """Find exact and near-duplicate files."""
+        """Find exact (SHA256) and near (perceptual hash) duplicate files."""
         media = self.get_object()
+        params = DuplicateSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
         exact_dupes = []
         if media.file_hash:
-            exact_dupes = MediaFile.objects.filter(file_hash=media.file_hash, is_deleted=False).exclude(id=media.id)
-        
+            exact_dupes = (MediaFile.objects.filter(file_hash=media.file_hash, is_deleted=False)
+                           .exclude(id=media.id).prefetch_related('versions', 'share_links'))
+
+        near_dupes = []
+        if media.phash is not None:
+            max_distance = min(params.validated_data['max_distance'], MAX_SEARCH_DISTANCE)
+            candidates = (MediaFile.objects.filter(candidates_q(media.phash, max_distance), is_deleted=False)
+                          .exclude(id=media.id).values_list('id', 'file', 'phash'))
+            for dupe_id, name, phash in candidates:
+                distance = hamming(media.phash, phash)
+                if distance <= max_distance:
+                    near_dupes.append({'id': dupe_id, 'file': name, 'distance': distance})
+            near_dupes.sort(key=lambda d: (d['distance'], d['id']))
+
         return Response({
             'file_id': media.id,
             'file_hash': media.file_hash,
             'exact_duplicates': MediaFileSerializer(exact_dupes, many=True).data,
-            'note': 'Perceptual hashing for near-duplicates requires additional dependencies (imagehash, etc.)'
+            'near_duplicates': near_dupes,
         })
 
     @action(detail=True, methods=['post'])
@@ -73,14 +301,19 @@ class MediaFileViewSet(viewsets.ModelViewSet):
         if 'file' not in request.FILES:
             return Response({'detail': 'file required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        version_count = media.versions.count()
-        version = FileVersion.objects.create(
-            media=media,
-            file=request.FILES['file'],
-            version_number=version_count + 1,
-            created_by=request.user,
-            note=request.data.get('note', '')
-        )
+        upload = request.FILES['file']
+        enforce_quota(media.project_id, upload.size)
+        with transaction.atomic():
+            version = FileVersion.objects.create(
+                media=media,
+                file=upload,
+                file_hash=getattr(upload, 'sha256', None) or '',
+                size=upload.size,
+                version_number=media.next_version_number(),
+                created_by=request.user,
+                note=request.data.get('note', '')
+            )
+            transaction.on_commit(lambda: process_new_version(media.pk, version.pk))
         return Response(FileVersionSerializer(version).data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['get'])
@@ -90,6 +323,40 @@ class MediaFileViewSet(viewsets.ModelViewSet):
         versions = media.versions.all()
         return Response(FileVersionSerializer(versions, many=True).data)
 
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Stream the file (or ?version=<id>) with Range and conditional GET support."""
+        media = self.get_object()
+        if request.query_params.get('version'):
+            version = get_object_or_404(FileVersion, id=request.query_params['version'], media=media)
+            response = serve_file(request, version.content, etag=version.file_hash or None,
+                                  last_modified=version.created_at,
+                                  filename=version.display_name, as_attachment='attachment' in request.query_params)
+            rehydrate_on_access(version)
+        else:
+            response = serve_file(request, media.file, etag=media.file_hash, last_modified=media.modified_at,
+                                  filename=media.display_name, as_attachment='attachment' in request.query_params)
+            rehydrate_on_access(media)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @action(detail=True, methods=['get'])
+    def transform_url(self, request, pk=None):
+        """A signed URL of this image (or ``?version=<id>``) resized, cropped or re-encoded.
+
+        Parameters: ``w``, ``h``, ``fit`` (contain or cover), ``crop`` ("x,y,width,height"),
+        ``fmt`` (jpeg, png, webp or avif) and ``q``.
+        """
+        media = self.get_object()
+        if media.media_type != 'image':
+            return Response({'detail': 'only images can be transformed'}, status=status.HTTP_400_BAD_REQUEST)
+        params = ImageTransformSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = dict(params.validated_data, token=None, expires=None)
+        if params.get('version'):
+            get_object_or_404(FileVersion, id=params['version'], media=media)
+        return Response({'url': request.build_absolute_uri(transforms.transform_url(media.pk, params))})
+
     @action(detail=True, methods=['post'])
     def create_share(self, request, pk=None):
         """Create a share link for this media file."""
@@ -117,6 +384,21 @@ class FileVersionViewSet(viewsets.ModelViewSet):
     queryset = FileVersion.objects.all()
     serializer_class = FileVersionSerializer
 
+    def perform_create(self, serializer):
+        upload = serializer.validated_data['file']
+        enforce_quota(serializer.validated_data['media'].project_id, upload.size)
+        with transaction.atomic():
+            version = serializer.save(
+                version_number=serializer.validated_data['media'].next_version_number(),
+                file_hash=getattr(upload, 'sha256', None) or '',
+                size=upload.size,
+            )
+            transaction.on_commit(lambda: process_new_version(version.media_id, version.pk))
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(), tracking_usage([instance.media_id]):
+            instance.delete()
+
 
 class ShareLinkViewSet(viewsets.ModelViewSet):
     queryset = ShareLink.objects.all()
@@ -129,22 +411,344 @@ class ShareLinkViewSet(viewsets.ModelViewSet):
         if not token:
             return Response({'detail': 'token required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        share = get_object_or_404(ShareLink, token=token)
-        if not share.is_valid():
+        share = resolve_share(token)
+        if share is None:
+            raise Http404
+        if not share_is_valid(share):
             return Response({'detail': 'link expired'}, status=status.HTTP_403_FORBIDDEN)
-        
-        share.record_access()
+
+        record_share_access(share['id'])
+        download_url = reverse('sharelink-download') + '?' + urlencode({'token': share['token']})
+        return Response({
+            'file': request.build_absolute_uri(download_url),
+            'media_type': share['media__media_type'],
+            'permission': share['permission'],
+            'created_by': share['created_by__username'],
+        })
+
+    @action(detail=True, methods=['get'])
+    def access_log(self, request, pk=None):
+        """Hits per hour (or ``?interval=day``), optionally ``?since=<ISO datetime>``.
+
+        Hits still in the buffer appear after the next flush (SHARE_ACCESS_FLUSH_INTERVAL).
+        """
+        share = self.get_object()
+        buckets = share.access_buckets.all()
+        since = request.query_params.get('since')
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({'detail': 'since must be an ISO 8601 datetime'}, status=status.HTTP_400_BAD_REQUEST)
+            buckets = buckets.filter(bucket_start__gte=since)
+        interval = request.query_params.get('interval', 'hour')
+        if interval == 'day':
+            rows = (buckets.annotate(start=TruncDay('bucket_start')).values('start')
+                    .annotate(hits=Sum('count')).order_by('start').values_list('start', 'hits'))
+        elif interval == 'hour':
+            rows = buckets.values_list('bucket_start', 'count')
+        else:
+            return Response({'detail': 'interval must be hour or day'}, status=status.HTTP_400_BAD_REQUEST)
         return Response({
-            'file': share.media.file.url,
-            'media_type': share.media.media_type,
-            'permission': share.permission,
-            'created_by': str(share.created_by),
+            'access_count': share.access_count,
+            'interval': interval,
+            'buckets': [{'start': start, 'count': count} for start, count in rows],
         })
 
+    @action(detail=False, methods=['get'])
+    def transform_url(self, request):
+        """Public endpoint: a signed transform URL (see MediaFileViewSet.transform_url) of a shared image.
+
+        The URL stops working when the share link expires or is deleted; versions are not shared.
+        """
+        token = request.query_params.get('token')
+        if not token:
+            return Response({'detail': 'token required'}, status=status.HTTP_400_BAD_REQUEST)
+        share = resolve_share(token)
+        if share is None:
+            raise Http404
+        if not share_is_valid(share):
+            return Response({'detail': 'link expired'}, status=status.HTTP_403_FORBIDDEN)
+        if share['media__media_type'] != 'image':
+            return Response({'detail': 'only images can be transformed'}, status=status.HTTP_400_BAD_REQUEST)
+        params = ImageTransformSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        expires = int(share['expires_at'].timestamp()) if share['expires_at'] else None
+        params = dict(params.validated_data, version=None, token=share['token'], expires=expires)
+        return Response({'url': request.build_absolute_uri(transforms.transform_url(share['media_id'], params))})
+
+    @action(detail=False, methods=['get'])
+    def download(self, request):
+        """Public endpoint: stream the shared file with Range and conditional GET support."""
+        token = request.query_params.get('token')
+        if not token:
+            return Response({'detail': 'token required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # unknown and expired tokens are answered from the cache
+        resolved = resolve_share(token)
+        if resolved is None:
+            raise Http404
+        if not share_is_valid(resolved):
+            return Response({'detail': 'link expired'}, status=status.HTTP_403_FORBIDDEN)
+
+        share = get_object_or_404(ShareLink.objects.select_related('media'), token=token)
+        media = share.media
+        as_attachment = share.permission == 'download' and 'attachment' in request.query_params
+        response = serve_file(request, media.file, etag=media.file_hash, last_modified=media.modified_at,
+                              filename=media.display_name, as_attachment=as_attachment)
+        rehydrate_on_access(media)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def parse_chunk_range(headers):
+    """Return (start, length) for a chunk from Content-Range or the tus Upload-Offset header."""
+    content_range = headers.get('Content-Range')
+    if content_range:
+        match = CONTENT_RANGE_RE.match(content_range.strip())
+        if not match:
+            raise ValueError('invalid Content-Range')
+        start, end = int(match.group(1)), int(match.group(2))
+        if end < start:
+            raise ValueError('invalid Content-Range')
+        return start, end - start + 1
+    if 'Upload-Offset' not in headers:
+        raise ValueError('Content-Range or Upload-Offset header required')
+    return int(headers['Upload-Offset']), int(headers.get('Content-Length') or 0)
+
+
+def offset_headers(session):
+    return {'Upload-Offset': str(session.offset), 'Upload-Length': str(session.total_size)}
+
+
+def append_chunk(session, headers, stream):
+    """Write one chunk of ``session`` from ``stream``; returns (status code, body, headers).
+
+    Shared by UploadSessionViewSet.update and its async counterpart in async_views.
+    """
+    if session.status != 'active':
+        return status.HTTP_409_CONFLICT, {'detail': f'upload is {session.status}'}, None
+    try:
+        start, length = parse_chunk_range(headers)
+    except ValueError as e:
+        return status.HTTP_400_BAD_REQUEST, {'detail': str(e)}, None
+    if start != session.offset:
+        return status.HTTP_409_CONFLICT, {'detail': 'offset mismatch', 'offset': session.offset}, offset_headers(session)
+    if length <= 0 or start + length > session.total_size:
+        return status.HTTP_400_BAD_REQUEST, {'detail': 'chunk outside upload range'}, None
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        return status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, {'detail': 'chunk too large'}, None
+
+    store = get_chunk_store()
+    if length < store.min_chunk_size and start + length < session.total_size:
+        return status.HTTP_400_BAD_REQUEST, {'detail': f'chunks must be at least {store.min_chunk_size} bytes'}, None
+
+    # claim the offset before writing: of two requests for the same chunk only one writes it
+    now = timezone.now()
+    claim = now + timedelta(seconds=settings.CHUNKED_UPLOAD_CLAIM_TIMEOUT)
+    claimed = (UploadSession.objects.filter(pk=session.pk, offset=start, status='active')
+               .filter(Q(chunk_claimed_until__isnull=True) | Q(chunk_claimed_until__lt=now))
+               .update(chunk_claimed_until=claim))
+    if not claimed:
+        return status.HTTP_409_CONFLICT, {'detail': 'concurrent chunk upload'}, None
+    try:
+        return write_claimed_chunk(session, headers, stream, start, length, store, claim)
+    finally:
+        # a no-op once the chunk is recorded (which clears the claim)
+        UploadSession.objects.filter(pk=session.pk, chunk_claimed_until=claim).update(chunk_claimed_until=None)
+
+
+def write_claimed_chunk(session, headers, stream, start, length, store, claim):
+    running = get_running_hash(session, store)
+    chunk_hash = hashlib.sha256()
+
+    def hashed(blocks):
+        for block in blocks:
+            chunk_hash.update(block)
+            if running is not None:
+                running.update(block)
+            yield block
+
+    written = store.write(session, start, hashed(read_stream(stream, length)))
+    if written != length:
+        return status.HTTP_400_BAD_REQUEST, {'detail': 'incomplete chunk', 'offset': session.offset}, offset_headers(session)
+
+    # optional tus checksum extension: "Upload-Checksum: sha256 <base64 digest>"
+    checksum = headers.get('Upload-Checksum', '')
+    if checksum:
+        algorithm, _, expected = checksum.partition(' ')
+        try:
+            matches = algorithm == 'sha256' and base64.b64decode(expected) == chunk_hash.digest()
+        except ValueError:
+            matches = False
+        if not matches:
+            return 460, {'detail': 'checksum mismatch', 'offset': session.offset}, offset_headers(session)
+
+    # only while the claim is still ours: after CHUNKED_UPLOAD_CLAIM_TIMEOUT another request may own the chunk
+    updated = UploadSession.objects.filter(pk=session.pk, offset=start, chunk_claimed_until=claim).update(
+        offset=start + length, parts=session.parts, chunk_claimed_until=None, updated_at=timezone.now())
+    if not updated:
+        return status.HTTP_409_CONFLICT, {'detail': 'concurrent chunk upload'}, None
+    session.offset = start + length
+    if running is not None:
+        remember_running_hash(session, running)
+    return status.HTTP_200_OK, {'offset': session.offset, 'chunk_sha256': chunk_hash.hexdigest()}, offset_headers(session)
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Resumable chunked uploads: create a session, PUT byte ranges, then finalize."""
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+
+    def perform_create(self, serializer):
+        # the whole upload is checked against the quota before any of it is sent
+        enforce_quota(serializer.validated_data['project'].pk, serializer.validated_data['total_size'])
+        user = self.request.user if self.request.user.is_authenticated else None
+        session = UploadSession(created_by=user, **serializer.validated_data)
+        get_chunk_store().start(session)
+        session.save()
+        serializer.instance = session
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response['Location'] = request.build_absolute_uri(f"{request.path.rstrip('/')}/{response.data['id']}/")
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        session = self.get_object()
+        return Response(self.get_serializer(session).data, headers=offset_headers(session))
+
+    def update(self, request, pk=None):
+        """Append one chunk. The chunk must start at the session's current offset."""
+        code, data, headers = append_chunk(self.get_object(), request.headers, request.stream)
+        return Response(data, status=code, headers=headers)
+
+    def destroy(self, request, pk=None):
+        """Abort an upload and discard the bytes received so far."""
+        session = self.get_object()
+        if session.status == 'active':
+            get_chunk_store().abort(session)
+            forget_running_hash(session)
+            session.status = 'aborted'
+            session.save(update_fields=['status', 'updated_at'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Assemble the uploaded chunks into a MediaFile."""
+        session = self.get_object()
+        if session.status != 'active':
+            return Response({'detail': f'upload is {session.status}'}, status=status.HTTP_409_CONFLICT)
+        if not session.is_complete():
+            return Response({'detail': 'upload incomplete', 'offset': session.offset},
+                            status=status.HTTP_409_CONFLICT, headers=offset_headers(session))
+
+        # claim the session: of two concurrent finalizes only one assembles the file
+        claimed = UploadSession.objects.filter(pk=session.pk, status='active').update(
+            status='finalizing', updated_at=timezone.now())
+        if not claimed:
+            return Response({'detail': 'upload is already being finalized'}, status=status.HTTP_409_CONFLICT)
+
+        store = get_chunk_store()
+        running = get_running_hash(session, store)
+        digest = running.hexdigest() if running is not None else None
+        try:
+            name = store.complete(session)
+        except Exception:
+            # nothing was assembled, so the client may finalize again
+            UploadSession.objects.filter(pk=session.pk).update(status='active')
+            raise
+        forget_running_hash(session)
+        adopt = digest and settings.CONTENT_ADDRESSED_STORAGE
+        if not adopt:
+            name = store.move(name, final_name(session))
+
+        with transaction.atomic():
+            if adopt:
+                name = adopt_stored_file(name, digest)
+            media = MediaFile.objects.create(
+                project=session.project,
+                uploaded_by=session.created_by,
+                file=name,
+                original_filename=session.filename,
+                size=session.total_size,
+                media_type=session.media_type,
+                status=session.media_status,
+                file_hash=digest,
+                hash_status='complete' if digest else 'pending',
+            )
+            session.status = 'complete'
+            session.storage_name = name
+            session.media = media
+            session.save(update_fields=['status', 'storage_name', 'media', 'updated_at'])
+            if not digest:
+                transaction.on_commit(lambda: compute_media_hash.delay(media.pk))
+            transaction.on_commit(lambda: generate_renditions.delay(media.pk))
+            transaction.on_commit(lambda: compute_perceptual_hash.delay(media.pk))
+
+        return Response(MediaFileSerializer(media, context=self.get_serializer_context()).data,
+                        status=status.HTTP_201_CREATED)
+
+
+class UploadBatchViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Many files in one request: multipart ``files`` and/or one zip/tar ``archive``, or a raw tar body.
+
+    Files are stored during the request; rendering and perceptual hashing run in parallel
+    afterwards, and the batch reports their progress.
+    """
+    queryset = UploadBatch.objects.all()
+    serializer_class = UploadBatchSerializer
+
+    def create(self, request, *args, **kwargs):
+        streamed = request.content_type.split(';')[0].strip() in TAR_CONTENT_TYPES
+        # a raw tar body is extracted as it arrives, so its parameters come in the query string
+        serializer = self.get_serializer(data=request.query_params if streamed else request.data)
+        serializer.is_valid(raise_exception=True)
+        if streamed:
+            if request.stream is None:
+                return Response({'detail': 'empty body'}, status=status.HTTP_400_BAD_REQUEST)
+            members = iter_tar(request.stream, stream=True)
+        else:
+            files = request.FILES.getlist('files')
+            archive = request.FILES.get('archive')
+            if not files and archive is None:
+                return Response({'detail': 'files or archive required'}, status=status.HTTP_400_BAD_REQUEST)
+            members = itertools.chain(iter_uploaded_files(files), iter_archive(archive) if archive else ())
+
+        user = request.user if request.user.is_authenticated else None
+        batch = UploadBatch.objects.create(created_by=user, **serializer.validated_data)
+        try:
+            ingest(batch, members)
+        except ARCHIVE_ERRORS as e:
+            # ingest saved what was stored before the archive turned out to be damaged
+            name = '' if streamed else archive.name
+            batch.errors = (batch.errors + [{'name': name, 'detail': f'unreadable archive: {e}'}])[:UploadBatch.MAX_ERRORS]
+            batch.save(update_fields=['errors'])
+            batch.mark_received()
+            if not batch.received:
+                return Response(self.get_serializer(batch).data, status=status.HTTP_400_BAD_REQUEST)
+
+        headers = {'Location': request.build_absolute_uri(f"{request.path.rstrip('/')}/{batch.pk}/")}
+        return Response(self.get_serializer(batch).data, status=status.HTTP_201_CREATED, headers=headers)
+
+
+class StorageTierRuleViewSet(viewsets.ModelViewSet):
+    """Rules moving files to warm or cold storage by age and status (applied daily, see tiering.py)."""
+    queryset = StorageTierRule.objects.all()
+    serializer_class = StorageTierRuleSerializer
+
+    @action(detail=False, methods=['get'])
+    def usage(self, request):
+        """Files and stored bytes in each storage tier."""
+        return Response(tier_usage())
+
 
 class DeletedFileViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = DeletedFile.objects.all()
+    queryset = DeletedFile.objects.select_related('media').prefetch_related('media__versions', 'media__share_links')
     serializer_class = DeletedFileSerializer
+    pagination_class = DeletedAtCursorPagination
 
 
 # Template views for web UI
@@ -170,17 +774,14 @@ def signup_view(request):
     return render(request, 'registration/signup.html', {'form': form})
 
 def dashboard(request):
-    clients = Client.objects.all()
-    projects = Project.objects.all()
-    media = MediaFile.objects.filter(is_deleted=False)
-    deleted = DeletedFile.objects.all()
-    
+    # cached counters, kept current by the receivers in receivers.py
+    counts = get_counts()
     return render(request, 'mediaapp/dashboard.html', {
-        'clients_count': clients.count(),
-        'projects_count': projects.count(),
-        'media_count': media.count(),
-        'deleted_count': deleted.count(),
-        'recent_clients': clients[:3],
+        'clients_count': counts['clients'],
+        'projects_count': counts['projects'],
+        'media_count': counts['media'],
+        'deleted_count': counts['deleted'],
+        'recent_clients': Client.objects.all()[:3],
     })
 
 
@@ -189,15 +790,26 @@ def clients_view(request):
     return render(request, 'mediaapp/clients.html', {'clients': clients})
 
 
+# cards per page of the media library
+MEDIA_PAGE_SIZE = 60
+
+
 def media_view(request):
-    media = MediaFile.objects.filter(is_deleted=False)
-    clients = Client.objects.all()
-    projects = Project.objects.all()
-    
+    params = MediaSearchSerializer(data=request.GET)
+    filters = params.validated_data if params.is_valid() else {}
+    media = search_media(**filters).select_related('project__client')
+    page = Paginator(media, MEDIA_PAGE_SIZE).get_page(request.GET.get('page'))
+
+    # querysets are lazy: on a fragment cache hit none of these queries run
     return render(request, 'mediaapp/media.html', {
-        'media': media,
-        'clients': clients,
-        'projects': projects,
+        'media': page,
+        'filters': filters,
+        'filter_query': urlencode({name: request.GET[name] for name in filters}),
+        'facets': SimpleLazyObject(lambda: facet_counts(media)),
+        'clients': Client.objects.all(),
+        'projects': Project.objects.select_related('client'),
+        'listing_version': listing_version('media'),
+        'cache_timeout': settings.LISTING_CACHE_TIMEOUT,
     })
 
 
@@ -209,11 +821,13 @@ def projects_view(request):
             Project.objects.create(name=name, client_id=client_id)
             return redirect('projects')
 
-    projects = Project.objects.all()
+    projects = Project.objects.select_related('client').annotate(media_count=Count('media'))
     clients = Client.objects.all()
     return render(request, 'mediaapp/projects.html', {
         'projects': projects,
-        'clients': clients
+        'clients': clients,
+        'listing_version': listing_version('projects'),
+        'cache_timeout': settings.LISTING_CACHE_TIMEOUT,
     })
 
 def recovery_view(request):
@@ -223,4 +837,85 @@ def recovery_view(request):
 
 def file_detail_view(request, file_id):
     media = get_object_or_404(MediaFile, id=file_id)
-    return render(request, 'mediaapp/file_detail.html', {'media': media})
+    preview_sources = []
+    if media.media_type == 'image':
+        # the preview rendition's size, re-encoded for browsers that take AVIF or WebP
+        edge = settings.RENDITION_SIZES['preview']
+        preview_sources = [
+            (f'image/{fmt}', transforms.transform_url(media.pk, {'w': edge, 'h': edge, 'fit': 'contain', 'fmt': fmt,
+                                                                 'q': settings.RENDITION_QUALITY}))
+            for fmt in ('avif', 'webp') if transforms.format_available(fmt)
+        ]
+    return render(request, 'mediaapp/file_detail.html', {'media': media, 'preview_sources': preview_sources})
+
+
+# a rendition URL always serves the same pixels, so browsers may cache it for a year
+RENDITION_CACHE_SECONDS = 365 * 24 * 60 * 60
+
+
+def rendition_view(request, file_id, size):
+    """Serve a rendition, generating stills on a cache miss.
+
+    Video proxies take too long to encode inline; a miss queues the encode and 404s.
+    """
+    media = get_object_or_404(MediaFile, id=file_id)
+    if size not in available_sizes(media.media_type):
+        raise Http404('Unknown rendition size')
+    version = None
+    if request.GET.get('version'):
+        version = get_object_or_404(FileVersion, id=request.GET['version'], media=media)
+
+    try:
+        rendition = get_rendition(media, size, version, generate=size != 'proxy')
+    except (OSError, ValueError, subprocess.SubprocessError):
+        # undecodable source, or ffmpeg missing/failed for a video still
+        raise Http404('Rendition unavailable')
+    if rendition is None:
+        generate_renditions.delay(media.pk, version.pk if version else None)
+        raise Http404('Rendition is being generated')
+    # Range support lets players seek within video proxies
+    response = serve_file(request, rendition.file)
+    patch_cache_control(response, public=True, max_age=RENDITION_CACHE_SECONDS, immutable=True)
+    return response
+
+
+# a transform URL renders the same pixels until its file is replaced
+TRANSFORM_CACHE_SECONDS = 24 * 60 * 60
+
+
+def transform_view(request, file_id):
+    """Serve a resized, cropped or re-encoded image (see transforms.py); only signed URLs are rendered."""
+    params = ImageTransformSerializer(data=request.GET)
+    if not params.is_valid():
+        return JsonResponse(params.errors, status=400)
+    params = params.validated_data
+    if not transforms.signature_is_valid(file_id, params, request.GET.get('s')):
+        return JsonResponse({'detail': 'invalid signature'}, status=403)
+    if transforms.is_expired(params):
+        return JsonResponse({'detail': 'link expired'}, status=403)
+    max_age = TRANSFORM_CACHE_SECONDS
+    if params.get('token'):
+        # handed out through a share link: only as good as the link itself
+        share = resolve_share(params['token'])
+        if share is None or share['media_id'] != file_id:
+            raise Http404
+        if not share_is_valid(share):
+            return JsonResponse({'detail': 'link expired'}, status=403)
+        # caches must not serve the image much longer than the link's own cache entry lives
+        max_age = settings.SHARE_CACHE_TIMEOUT
+    media = get_object_or_404(MediaFile, id=file_id, is_deleted=False, media_type='image')
+    version = None
+    if params.get('version'):
+        version = get_object_or_404(FileVersion, id=params['version'], media=media)
+
+    try:
+        transform = transforms.get_transform(media, params, version)
+    except transforms.InvalidTransform as exc:
+        return JsonResponse({'detail': str(exc)}, status=400)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise Http404('Image unavailable')
+    response = serve_file(request, transform.file, etag=transform.key)
+    if params.get('expires') is not None:
+        max_age = min(max_age, int(params['expires'] - timezone.now().timestamp()))
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response